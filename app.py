@@ -1,12 +1,12 @@
 import os
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, abort, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-import threading
+import hmac
 from datetime import datetime
 
 # Set up basic logging
@@ -37,7 +37,10 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 from models import User, BotLog, BotSetting
-from bot import start_bot, stop_bot, get_bot_status
+from config import Config
+from bot import enqueue_update, get_webhook_token, verify_webhook_secret, watch_settings
+from lifecycle import bot_supervisor
+from settings_cache import settings_cache
 
 # Add context processor for templates
 @app.context_processor
@@ -53,6 +56,13 @@ def load_user(user_id):
 with app.app_context():
     db.create_all()
     
+    # Index builds on large tables run once per deploy (python migrations.py),
+    # never in every worker while it boots
+    from migrations import missing_indexes
+    missing = missing_indexes(db)
+    if missing:
+        logger.warning(f"Missing or invalid indexes {', '.join(missing)}: run python migrations.py")
+    
     # Check if admin user exists, create one if not
     admin = User.query.filter_by(username='admin').first()
     if not admin:
@@ -80,8 +90,19 @@ with app.app_context():
         db.session.commit()
         logger.info("Created admin user and initial settings")
 
-# Bot thread
-bot_thread = None
+# Roll up, archive and purge old logs and messages in the background
+if Config.RETENTION_ENABLED:
+    from retention import retention_worker
+    retention_worker.start()
+
+# Apply token and reply-template changes saved by any worker
+watch_settings()
+
+# Every worker heartbeats the bot lease; started on the first request so
+# that processes which never serve requests (e.g. the reloader) stay out
+@app.before_request
+def start_bot_supervisor():
+    bot_supervisor.ensure_started()
 
 # Routes
 @app.route('/')
@@ -91,19 +112,29 @@ def index():
 @app.route('/miniapp')
 def miniapp():
     """Telegram Mini App endpoint"""
-    from models import BotUser
+    from models import BotUser, BotMessage
+    from user_cache import user_cache, snapshot
     
     user_id = request.args.get('user_id')
     telegram_user = None
+    messages = []
     
     if user_id:
         try:
             user_id = int(user_id)
-            telegram_user = BotUser.query.filter_by(telegram_id=user_id).first()
+            telegram_user = user_cache.get(user_id)
+            if telegram_user is None:
+                db_user = BotUser.query.filter_by(telegram_id=user_id).first()
+                if db_user:
+                    telegram_user = snapshot(db_user)
+                    user_cache.put(telegram_user)
+            if telegram_user:
+                messages = (BotMessage.query.filter_by(telegram_user_id=user_id)
+                            .order_by(BotMessage.timestamp.desc()).limit(10).all())
         except (ValueError, TypeError):
             pass
     
-    return render_template('miniapp.html', user=telegram_user)
+    return render_template('miniapp.html', user=telegram_user, messages=messages)
 
 # Serve static files for the Telegram Mini App
 @app.route('/telegram-miniapp/<path:path>')
@@ -138,73 +169,120 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    bot_status = get_bot_status()
+    bot_status = bot_supervisor.status()
     logs = BotLog.query.order_by(BotLog.timestamp.desc()).limit(10).all()
     return render_template('dashboard.html', bot_status=bot_status, logs=logs)
 
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    from stats import stats_service
+    return jsonify(stats_service.snapshot())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition behind a bearer token; disabled until METRICS_TOKEN is set"""
+    from metrics import REGISTRY
+    if not Config.METRICS_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {Config.METRICS_TOKEN}"):
+        abort(401)
+    return app.response_class(REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
+    from reply_templates import TEMPLATE_KEYS
+    
     if request.method == 'POST':
-        token = request.form.get('telegram_token')
-        
-        # Update token in database
-        token_setting = BotSetting.query.filter_by(key='telegram_token').first()
-        if token_setting:
-            token_setting.value = token
-        else:
-            token_setting = BotSetting(key='telegram_token', value=token)
-            db.session.add(token_setting)
-        
-        db.session.commit()
+        # One write bumps the settings version; the bot and the other workers pick it up
+        values = {'telegram_token': request.form.get('telegram_token', '')}
+        values.update((key, request.form.get(key, '').replace('\r\n', '\n') or None) for key in TEMPLATE_KEYS)
+        settings_cache.set_many(values)
         flash('Settings updated successfully', 'success')
         return redirect(url_for('settings'))
     
     # Get current settings
-    settings = {}
-    for setting in BotSetting.query.all():
-        settings[setting.key] = setting.value
+    settings = settings_cache.get_many(('telegram_token',) + TEMPLATE_KEYS)
     
     return render_template('settings.html', settings=settings)
 
+def log_filters():
+    """Level and date-range filters shared by /logs and /api/logs"""
+    from log_pages import parse_date_range
+    
+    level = request.args.get('level') or None
+    since, until = parse_date_range(request.args.get('date_from'), request.args.get('date_to'))
+    return level, since, until
+
 @app.route('/logs')
 @login_required
 def logs():
-    page = request.args.get('page', 1, type=int)
+    from log_pages import fetch_logs, approximate_log_count
+    
     per_page = 20
-    logs_pagination = BotLog.query.order_by(BotLog.timestamp.desc()).paginate(page=page, per_page=per_page)
-    return render_template('logs.html', logs=logs_pagination)
+    level, since, until = log_filters()
+    log_items, older, newer = fetch_logs(level, since, until,
+                                         after=request.args.get('after'),
+                                         before=request.args.get('before'),
+                                         limit=per_page)
+    # Non-empty filters are carried over to the Newer/Older links
+    filters = {key: request.args[key] for key in ('level', 'date_from', 'date_to') if request.args.get(key)}
+    return render_template('logs.html', logs=log_items, older_cursor=older, newer_cursor=newer,
+                           total=approximate_log_count(level, since, until), filters=filters)
+
+@app.route('/api/logs')
+@login_required
+def api_logs():
+    from log_pages import fetch_logs, approximate_log_count
+    
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    level, since, until = log_filters()
+    log_items, older, newer = fetch_logs(level, since, until,
+                                         after=request.args.get('after'),
+                                         before=request.args.get('before'),
+                                         limit=limit)
+    return jsonify({
+        'logs': [
+            {'id': log.id, 'level': log.level, 'message': log.message, 'timestamp': log.timestamp.isoformat()}
+            for log in log_items
+        ],
+        'next_cursor': older,
+        'prev_cursor': newer,
+        'approx_total': approximate_log_count(level, since, until)
+    })
 
 @app.route('/bot/start')
 @login_required
 def start_bot_route():
-    global bot_thread
-    if bot_thread is None or not bot_thread.is_alive():
-        # Get token from database
-        token_setting = BotSetting.query.filter_by(key='telegram_token').first()
-        if token_setting:
-            token = token_setting.value
-            bot_thread = threading.Thread(target=start_bot, args=(token,))
-            bot_thread.daemon = True
-            bot_thread.start()
+    # Any worker can take the request; the worker holding the lease runs the bot
+    if bot_supervisor.status()['is_running']:
+        flash('Bot is already running', 'info')
+    elif not settings_cache.get('telegram_token'):
+        flash('Telegram token not found in settings', 'danger')
+    else:
+        # Behind ProxyFix this resolves to the public URL Telegram must call
+        webhook_url = Config.WEBHOOK_URL or url_for('telegram_webhook', _external=True, _scheme='https')
+        if bot_supervisor.request_start(webhook_url)['is_running']:
             flash('Bot started successfully', 'success')
-            
-            # Log the bot start
-            new_log = BotLog(level='INFO', message='Bot started by user: ' + current_user.username)
-            db.session.add(new_log)
-            db.session.commit()
         else:
-            flash('Telegram token not found in settings', 'danger')
-    else:
-        flash('Bot is already running', 'info')
+            flash('Bot start requested; it is starting in another worker', 'info')
+        
+        # Log the bot start
+        new_log = BotLog(level='INFO', message='Bot started by user: ' + current_user.username)
+        db.session.add(new_log)
+        db.session.commit()
     
     return redirect(url_for('dashboard'))
 
 @app.route('/bot/stop')
 @login_required
 def stop_bot_route():
-    if stop_bot():
-        flash('Bot stopped successfully', 'success')
+    if bot_supervisor.status()['desired_running']:
+        if bot_supervisor.request_stop()['leader']:
+            flash('Bot stop requested; it stops with the next heartbeat', 'info')
+        else:
+            flash('Bot stopped successfully', 'success')
         
         # Log the bot stop
         new_log = BotLog(level='INFO', message='Bot stopped by user: ' + current_user.username)
@@ -215,6 +293,81 @@ def stop_bot_route():
     
     return redirect(url_for('dashboard'))
 
+@app.route('/bot/status')
+@login_required
+def bot_status_route():
+    return jsonify(bot_supervisor.status())
+
+@app.route('/broadcast', methods=['POST'])
+@login_required
+def broadcast_route():
+    from broadcast import start_broadcast, resume_broadcast
+    
+    token = settings_cache.get('telegram_token')
+    if not token:
+        flash('Telegram token not found in settings', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    if request.form.get('resume'):
+        if resume_broadcast(token):
+            flash('Broadcast resumed from checkpoint', 'success')
+        else:
+            flash('No interrupted broadcast to resume', 'info')
+        return redirect(url_for('dashboard'))
+    
+    text = (request.form.get('message') or '').strip()
+    if not text:
+        flash('Broadcast message cannot be empty', 'danger')
+    elif start_broadcast(token, text):
+        flash('Broadcast started', 'success')
+        
+        # Log the broadcast start
+        new_log = BotLog(level='INFO', message='Broadcast started by user: ' + current_user.username)
+        db.session.add(new_log)
+        db.session.commit()
+    else:
+        flash('A broadcast is already running', 'info')
+    
+    return redirect(url_for('dashboard'))
+
+@app.route('/broadcast/cancel')
+@login_required
+def cancel_broadcast_route():
+    from broadcast import cancel_broadcast
+    
+    if cancel_broadcast():
+        flash('Broadcast cancelled', 'success')
+    else:
+        flash('No broadcast is running', 'info')
+    return redirect(url_for('dashboard'))
+
+@app.route('/broadcast/status')
+@login_required
+def broadcast_status():
+    from broadcast import get_broadcast_status
+    return jsonify(get_broadcast_status() or {})
+
+@app.route('/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    """Receive updates pushed by Telegram and queue them for the handlers"""
+    token = get_webhook_token()
+    if not token:
+        abort(404)
+    
+    if not verify_webhook_secret(token, request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        abort(403)
+    
+    update = request.get_json(silent=True)
+    if not update or 'update_id' not in update:
+        # Acknowledge malformed payloads so Telegram does not redeliver them
+        return '', 200
+    
+    # A full queue makes Telegram retry the delivery later
+    if not enqueue_update(token, update, timeout=5):
+        return '', 503
+    
+    return '', 200
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+try:
+    import aiohttp
+except ImportError:  # Only needed when BOT_ENGINE=asyncio
+    aiohttp = None
+
+from config import Config
+from dispatcher import get_chat_id
+from metrics import POLL_LAG_SECONDS, TELEGRAM_REQUEST_SECONDS
+from rate_limiter import AsyncSendScheduler, send_scheduler
+from telegram_client import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTelegramClient:
+    """aiohttp-based Telegram Bot API client sharing one connection pool"""
+
+    def __init__(self, base_url="https://api.telegram.org", max_connections=100,
+                 connect_timeout=5.0, read_timeout=15.0, max_retries=3):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.session = None
+
+    async def open(self):
+        if aiohttp is None:
+            raise RuntimeError("BOT_ENGINE=asyncio requires the aiohttp package")
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def call(self, token, method, params=None, read_timeout=None, retry_429=True):
+        """Call a Bot API method, retrying 429 and 5xx responses like TelegramClient"""
+        url = f"{self.base_url}/bot{token}/{method}"
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                        sock_read=read_timeout or self.read_timeout)
+        attempt = 0
+
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await self.session.post(url, data=params, timeout=timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                TELEGRAM_REQUEST_SECONDS.labels(method, 'error').observe(time.perf_counter() - started)
+                raise
+
+            async with response:
+                try:
+                    payload = await response.json(content_type=None)
+                except ValueError:
+                    payload = {}
+                TELEGRAM_REQUEST_SECONDS.labels(method, response.status).observe(time.perf_counter() - started)
+
+                if response.status < 400:
+                    return payload
+
+                parameters = payload.get('parameters') or {}
+                error = TelegramAPIError(response.status, payload.get('description') or response.reason,
+                                         error_code=payload.get('error_code'),
+                                         retry_after=parameters.get('retry_after'))
+
+            if attempt < self.max_retries and ((error.status_code == 429 and retry_429) or error.status_code >= 500):
+                attempt += 1
+                await asyncio.sleep(error.retry_after or 0.5 * (2 ** (attempt - 1)))
+                continue
+
+            raise error
+
+
+class AsyncBotEngine:
+    """Bot engine running the long-poll loop and handlers on one asyncio event loop.
+
+    The loop lives in its own thread so the Flask app can keep calling
+    ``start_bot``/``stop_bot`` synchronously. Updates of the same chat are
+    handled in order; at most ``max_in_flight`` updates are handled at once,
+    and the poller stops fetching while all slots are taken.
+    """
+
+    def __init__(self, max_in_flight=1000):
+        self.max_in_flight = max_in_flight
+        self.client = None
+        self.sender = None
+        self.token = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_requested = False
+        self._stopping = None
+        self._slots = None
+        self._tasks = set()
+        self._chat_locks = {}
+        self._chat_pending = {}
+
+    def start(self, token, poll=True):
+        """Start the event loop thread; with ``poll`` it also runs getUpdates"""
+        # Concurrent webhook requests all call start(); only one may create the loop
+        with self._lock:
+            if self.is_running():
+                if not self._stop_requested:
+                    return
+                # A stop is still draining: let it finish before starting afresh
+                self._thread.join(timeout=10.0)
+                if self._thread.is_alive():
+                    raise RuntimeError("Async bot engine is still stopping")
+            self._stop_requested = False
+            self.token = token
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(token, poll, ready),
+                                            name="async-bot-engine", daemon=True)
+            self._thread.start()
+            ready.wait(timeout=5.0)
+
+    def stop(self, timeout=10.0):
+        """Stop polling, wait for in-flight handlers and close the loop"""
+        with self._lock:
+            if not self.is_running() or self._stop_requested:
+                return
+            self._stop_requested = True
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(timeout=timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_token(self, token):
+        """Poll with a new token from the next getUpdates on"""
+        self.token = token
+
+    def submit(self, token, update, timeout=None):
+        """Thread-safe entry point for updates received outside the loop (webhook)"""
+        if not self.is_running() or self._stop_requested:
+            return False
+        future = asyncio.run_coroutine_threadsafe(self._accept(token, update), self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            future.cancel()
+            return False
+
+    def in_flight(self):
+        return len(self._tasks)
+
+    def send_queue_depth(self):
+        return self.sender.queue_depth() if self.sender is not None else 0
+
+    # Event loop side
+
+    def _run(self, token, poll, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main(token, poll, ready))
+        except Exception as e:
+            logger.error(f"Async bot engine crashed: {e}")
+        finally:
+            self._loop.close()
+
+    async def _main(self, token, poll, ready):
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.client = AsyncTelegramClient(
+            base_url=Config.TELEGRAM_API_URL,
+            max_connections=self.max_in_flight,
+            connect_timeout=Config.TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout=Config.TELEGRAM_READ_TIMEOUT,
+            max_retries=Config.TELEGRAM_MAX_RETRIES,
+        )
+        await self.client.open()
+        self.sender = AsyncSendScheduler(send_scheduler, self.client, max_retries=Config.SEND_MAX_RETRIES)
+        ready.set()
+
+        try:
+            if poll:
+                poller = asyncio.ensure_future(self._poll(token))
+                await self._stopping.wait()
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+            else:
+                await self._stopping.wait()
+
+            # Let accepted updates finish before closing the connection pool
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            await self.sender.close()
+            await self.client.close()
+
+    async def _poll(self, token):
+        from bot import add_log, backoff_delay
+        from update_tracker import update_tracker
+
+        # Resume after the last update handled before a restart
+        last_update_id = update_tracker.load(token)
+        failures = 0
+        params = {
+            "timeout": Config.POLL_TIMEOUT,
+            "limit": Config.POLL_LIMIT,
+            "allowed_updates": json.dumps(Config.POLL_ALLOWED_UPDATES),
+        }
+
+        while True:
+            if self.token != token:
+                # Another bot: its update ids have nothing to do with ours
+                token, last_update_id = self.token, update_tracker.load(self.token)
+                params.pop("offset", None)
+            try:
+                if last_update_id:
+                    params["offset"] = last_update_id
+                updates = await self.client.call(token, "getUpdates", params,
+                                                 read_timeout=Config.POLL_TIMEOUT + 10)
+                failures = 0
+                for update in updates.get('result', []):
+                    # Advance the offset only once the update holds a slot
+                    if update_tracker.accept(update['update_id']):
+                        await self._accept(token, update)
+                        if 'date' in update.get('message', {}):
+                            POLL_LAG_SECONDS.observe(max(0.0, time.time() - update['message']['date']))
+                    last_update_id = update['update_id'] + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in async bot polling: {e}")
+                add_log("ERROR", f"Error in async bot polling: {str(e)}")
+                failures += 1
+                await asyncio.sleep(backoff_delay(failures))
+
+    async def _accept(self, token, update):
+        await self._slots.acquire()
+        chat_id = get_chat_id(update)
+        self._chat_pending[chat_id] = self._chat_pending.get(chat_id, 0) + 1
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+
+        task = asyncio.ensure_future(self._handle(token, update, chat_id, lock))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _handle(self, token, update, chat_id, lock):
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, preserving per-chat order
+            async with lock:
+                await handle_update_async(token, update)
+        finally:
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:
+                del self._chat_pending[chat_id]
+                del self._chat_locks[chat_id]
+            self._slots.release()
+
+
+async def handle_update_async(token, update):
+    """Async counterpart of bot.handle_update running the same router and middleware.
+
+    Handlers are synchronous and never block, so the chain runs on the loop;
+    their sends are collected and awaited afterwards, which means handling
+    metrics here exclude the send itself. Reply latency is recorded once
+    the sends completed.
+    """
+    from bot import add_log
+    from handlers import record_reply_latency, router
+    from update_tracker import update_tracker
+
+    pending = []
+
+    def send(token, reply):
+        if reply.method == "sendMessage":
+            # Paced on the loop with the same token buckets as the threaded scheduler
+            future = async_engine.sender.submit(token, reply.params).future
+        else:
+            future = asyncio.ensure_future(async_engine.client.call(token, reply.method, reply.params))
+        pending.append(future)
+        return future
+
+    try:
+        ctx = router.context(token, update, send)
+        ctx.deferred_sends = True
+        router.dispatch(ctx)
+
+        sent = False
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending reply: {result}")
+                add_log("ERROR", f"Error sending reply: {str(result)}")
+            else:
+                sent = True
+        if sent:
+            record_reply_latency(ctx)
+    finally:
+        if 'update_id' in update:
+            update_tracker.done(update['update_id'])
+
+
+async_engine = AsyncBotEngine(max_in_flight=Config.ASYNC_MAX_IN_FLIGHT)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark of send_transaction_to_blockchain against a local JSON-RPC stub.
+
+Compares the previous per-call path (new BlockchainManager, which ran
+is_connected + block_number to connect, then is_connected + block_number
+again for the demo transaction) with the shared manager, which connects
+once and then only asks for the block number. ``--delay`` adds a fixed
+server-side latency to stand in for the round trip to a public RPC.
+
+    python benchmarks/bench_blockchain_rpc.py --iterations 500 --delay 0.005
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import Web3  # noqa: E402
+
+from blockchain_manager import BlockchainManager  # noqa: E402
+from rpc_stub import StubRPCServer  # noqa: E402
+
+DATA = {"user_id": "42", "username": "bench", "app": "HosseinX4_bot"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds the stub waits before answering')
+    return parser.parse_args()
+
+
+def legacy_send(url):
+    """The RPCs made per call before the manager was shared"""
+    web3 = Web3(Web3.HTTPProvider(url))
+    if web3.is_connected():
+        web3.eth.block_number
+    web3.to_hex(text=json.dumps(DATA))
+    return web3.eth.block_number if web3.is_connected() else 0
+
+
+def run(stub, func, iterations):
+    stub.reset()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    return elapsed / iterations * 1e3, stub.total_calls() / iterations, stub.connections
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.INFO)
+    stub = StubRPCServer(delay=args.delay).start()
+    try:
+        manager = BlockchainManager(rpc_urls=[stub.url], health_interval=0)
+        cases = (
+            ("per-call manager (before)", lambda: legacy_send(stub.url)),
+            ("shared manager", lambda: manager.send_transaction(data=DATA, demo_mode=True)),
+        )
+        print(f"{'path':<30}{'ms/call':>10}{'RPCs/call':>12}{'TCP conns':>12}")
+        for name, func in cases:
+            ms, rpcs, connections = run(stub, func, args.iterations)
+            print(f"{name:<30}{ms:>10.3f}{rpcs:>12.2f}{connections:>12}")
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
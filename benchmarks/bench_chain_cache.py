@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+RPCs per call of the chain reads, with and without the chain cache.
+
+Runs get_network_info, a demo send_transaction and get_balance
+``--iterations`` times against a local JSON-RPC stub with ``--delay``
+seconds of latency, first the way they were made before (every value read
+from the node each time) and then through BlockchainManager's ChainCache,
+and prints RPCs and milliseconds per call plus the cache hit rates.
+
+    python benchmarks/bench_chain_cache.py --iterations 200 --delay 0.005
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import Web3  # noqa: E402
+
+from blockchain_manager import TEST_WALLET_ADDRESS, BlockchainManager  # noqa: E402
+from rpc_stub import StubRPCServer  # noqa: E402
+
+ADDRESS = Web3.to_checksum_address(TEST_WALLET_ADDRESS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.005, help='seconds the stub waits before answering')
+    return parser.parse_args()
+
+
+def uncached_calls(web3):
+    """The reads each call made before the cache"""
+    return (
+        ("get_network_info", lambda: (web3.eth.block_number, web3.eth.gas_price, web3.eth.chain_id, web3.is_connected())),
+        ("demo send_transaction", lambda: web3.eth.block_number if web3.is_connected() else 0),
+        ("get_balance", lambda: web3.eth.get_balance(ADDRESS)),
+    )
+
+
+def cached_calls(manager):
+    return (
+        ("get_network_info", manager.get_network_info),
+        ("demo send_transaction", lambda: manager.send_transaction(data={"user_id": "42"}, demo_mode=True)),
+        ("get_balance", lambda: manager.get_balance(ADDRESS)),
+    )
+
+
+def run(stub, func, iterations):
+    stub.reset()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e3, stub.total_calls() / iterations
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    stub = StubRPCServer(delay=args.delay).start()
+    try:
+        manager = BlockchainManager(rpc_urls=[stub.url], health_interval=0)
+        manager.web3   # connect before measuring
+        print(f"{'call':<26}{'before ms':>11}{'RPCs':>7}{'cached ms':>11}{'RPCs':>7}")
+        for (name, before), (_, after) in zip(uncached_calls(Web3(Web3.HTTPProvider(stub.url))), cached_calls(manager)):
+            before_ms, before_rpcs = run(stub, before, args.iterations)
+            after_ms, after_rpcs = run(stub, after, args.iterations)
+            print(f"{name:<26}{before_ms:>11.3f}{before_rpcs:>7.2f}{after_ms:>11.3f}{after_rpcs:>7.2f}")
+
+        print("\ncache hit rates:")
+        for name, stats in manager.cache.stats()["names"].items():
+            print(f"  {name:<14}{stats['hit_rate']:>8.2%}  ({stats['hits']} hits, {stats['misses']} misses)")
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
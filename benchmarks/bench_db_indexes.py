@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the dashboard, log and user-history queries with and without
+the BotMessage/BotLog indexes.
+
+Seeds a database with synthetic rows, runs every query without the indexes,
+creates them through migrations.ensure_indexes and runs the queries again.
+
+    python benchmarks/bench_db_indexes.py --messages 10000000 --logs 5000000 \
+        --database-url postgresql://localhost/bot_bench
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LEVELS = ['INFO', 'INFO', 'INFO', 'WARNING', 'ERROR', 'DEBUG']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default='sqlite:////tmp/bot_index_bench.db')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--logs', type=int, default=500_000)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--batch', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--reseed', action='store_true', help='drop existing benchmark rows first')
+    return parser.parse_args()
+
+
+def seed(db, BotMessage, BotLog, args):
+    from sqlalchemy import func, insert, select
+
+    start = datetime.utcnow() - timedelta(days=90)
+    span = 90 * 24 * 3600
+
+    have = db.session.scalar(select(func.count(BotMessage.id)))
+    for offset in range(have, args.messages, args.batch):
+        count = min(args.batch, args.messages - offset)
+        rows = [{
+            "telegram_user_id": random.randint(1, args.users),
+            "message_text": "benchmark message",
+            "timestamp": start + timedelta(seconds=random.randint(0, span)),
+            "is_from_user": bool(i & 1),
+        } for i in range(count)]
+        db.session.execute(insert(BotMessage), rows)
+        db.session.commit()
+        print(f"  messages: {offset + count:,}/{args.messages:,}", end='\r', flush=True)
+    print()
+
+    have = db.session.scalar(select(func.count(BotLog.id)))
+    for offset in range(have, args.logs, args.batch):
+        count = min(args.batch, args.logs - offset)
+        rows = [{
+            "level": random.choice(LEVELS),
+            "message": "benchmark log line",
+            "timestamp": start + timedelta(seconds=random.randint(0, span)),
+        } for _ in range(count)]
+        db.session.execute(insert(BotLog), rows)
+        db.session.commit()
+        print(f"  logs: {offset + count:,}/{args.logs:,}", end='\r', flush=True)
+    print()
+
+
+def drop_indexes(db, tables):
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in tables:
+            for index in inspector.get_indexes(table.name):
+                if index['name'].startswith('ix_'):
+                    conn.execute(text(f'DROP INDEX {index["name"]}'))
+
+
+def measure(db, queries, repeat):
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+            db.session.rollback()
+        results[name] = (statistics.median(timings), max(timings))
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from app import app, db
+    from migrations import ensure_indexes
+    from models import BotLog, BotMessage
+
+    with app.app_context():
+        if args.reseed:
+            BotMessage.query.delete()
+            BotLog.query.delete()
+            db.session.commit()
+
+        print(f"Seeding {args.database_url}")
+        seed(db, BotMessage, BotLog, args)
+
+        user_ids = [random.randint(1, args.users) for _ in range(args.repeat)]
+        queries = {
+            "dashboard: last 10 logs": lambda: BotLog.query.order_by(BotLog.timestamp.desc()).limit(10).all(),
+            "logs: ERROR page": lambda: BotLog.query.filter_by(level='ERROR')
+                                              .order_by(BotLog.timestamp.desc()).limit(20).all(),
+            "user history: last 10 messages": lambda: BotMessage.query
+                .filter_by(telegram_user_id=user_ids[random.randrange(len(user_ids))])
+                .order_by(BotMessage.timestamp.desc()).limit(10).all(),
+        }
+
+        drop_indexes(db, [BotMessage.__table__, BotLog.__table__])
+        before = measure(db, queries, args.repeat)
+
+        print("Creating indexes...")
+        started = time.perf_counter()
+        ensure_indexes(db)
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+        after = measure(db, queries, args.repeat)
+
+    print(f"\n{'query':<34}{'before p50':>12}{'after p50':>12}{'speedup':>10}")
+    for name in queries:
+        b, a = before[name][0], after[name][0]
+        print(f"{name:<34}{b:>10.2f}ms{a:>10.2f}ms{b / a if a else float('inf'):>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
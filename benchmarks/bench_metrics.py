@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the metrics hot path.
+
+Measures the per-call cost of the operations the bot performs on every
+update and Telegram request (labelled histogram observe, counter inc,
+timer context manager), single-threaded and contended, and the cost of
+rendering /metrics. A labelled observe costs one to two microseconds;
+compare that with a Telegram round trip (tens of milliseconds) to judge
+the overhead.
+
+    python benchmarks/bench_metrics.py --iterations 1000000 --threads 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Counter, Histogram, Registry  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500_000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--series', type=int, default=50, help='label combinations in the scrape benchmark')
+    return parser.parse_args()
+
+
+def per_call_ns(func, iterations):
+    started = time.perf_counter()
+    func(iterations)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def contended_ns(func, iterations, threads):
+    """Wall time per call with ``threads`` threads sharing the same series"""
+    share = iterations // threads
+    workers = [threading.Thread(target=func, args=(share,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (share * threads) * 1e9
+
+
+def main():
+    args = parse_args()
+    registry = Registry()
+    histogram = Histogram('bench_seconds', 'Benchmark histogram', ('method', 'status'), registry=registry)
+    counter = Counter('bench_total', 'Benchmark counter', ('command', 'outcome'), registry=registry)
+
+    def baseline(n):
+        for _ in range(n):
+            time.perf_counter()
+
+    def observe(n):
+        for _ in range(n):
+            histogram.labels('sendMessage', 200).observe(0.042)
+
+    def inc(n):
+        for _ in range(n):
+            counter.labels('/start', 'ok').inc()
+
+    def timer(n):
+        child = histogram.labels('getUpdates', 200)
+        for _ in range(n):
+            with child.time():
+                pass
+
+    print(f"{'operation':<40}{'ns/call':>10}")
+    for name, func in (("perf_counter() (baseline)", baseline),
+                       ("histogram.labels(...).observe()", observe),
+                       ("counter.labels(...).inc()", inc),
+                       ("with histogram child .time()", timer)):
+        print(f"{name:<40}{per_call_ns(func, args.iterations):>10.0f}")
+    print(f"{f'observe() across {args.threads} threads':<40}"
+          f"{contended_ns(observe, args.iterations, args.threads):>10.0f}")
+
+    for index in range(args.series):
+        histogram.labels(f"method{index}", 200).observe(0.1)
+    started = time.perf_counter()
+    body = registry.expose()
+    print(f"\nScrape of {args.series + 2} series: {(time.perf_counter() - started) * 1000:.2f}ms, "
+          f"{len(body)} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of building the /start reply.
+
+Compares the previous per-message path (read REPLIT_DOMAINS, build the
+URL, build the keyboard dict, json.dumps it) with the precompiled
+templates from reply_templates, which only join strings. /help and
+/about were already constant strings and are now served as they are.
+
+    python benchmarks/bench_reply_templates.py --iterations 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reply_templates import DEFAULT_BUTTON_TEXT, DEFAULT_START_TEXT, ReplyTemplates  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100_000)
+    return parser.parse_args()
+
+
+def legacy_start(user_id, first_name):
+    """The per-message /start work done before reply templates"""
+    welcome_message = DEFAULT_START_TEXT.replace('{first_name}', first_name)
+    replit_domain = os.environ.get('REPLIT_DOMAINS', '57a0603e-812d-4af0-a6fd-47ceb27f1626-00-365m8arhc6yga.picard.replit.dev')
+    if ',' in replit_domain:
+        replit_domain = replit_domain.split(',')[0]
+    webapp_url = f"https://{replit_domain}/telegram-miniapp/index.html?user_id={user_id}"
+    keyboard = {"inline_keyboard": [[{"text": DEFAULT_BUTTON_TEXT, "web_app": {"url": webapp_url}}]]}
+    return welcome_message, json.dumps(keyboard), welcome_message + "\n[Mini App Button Added]"
+
+
+def per_call_us(func, iterations):
+    started = time.perf_counter()
+    for user_id in range(iterations):
+        func(user_id)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    args = parse_args()
+    compiled = ReplyTemplates().reload(overrides={})
+
+    # Both paths must produce the same keyboard
+    assert json.loads(compiled.start(42, 'Ali')[1]) == json.loads(legacy_start(42, 'Ali')[1])
+
+    cases = (
+        ("/start before (build + json.dumps)", lambda user_id: legacy_start(user_id, 'Ali')),
+        ("/start templates", lambda user_id: compiled.start(user_id, 'Ali')),
+    )
+    print(f"{'reply':<40}{'us/reply':>10}")
+    for name, func in cases:
+        print(f"{name:<40}{per_call_us(func, args.iterations):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
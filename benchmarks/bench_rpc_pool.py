@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Failover benchmark of the RPC pool against three local JSON-RPC stubs.
+
+The stubs stand in for the three testnet RPCs: "slow" answers in 40 ms,
+"stalling" answers in 5 ms but stalls 10% of requests for a second, and
+"flaky" answers in 10 ms but fails 30% of requests and lags 20 blocks.
+Each scenario reads the block number ``--iterations`` times, once through
+a plain Web3 on the first URL (the old fixed-order connection) and once
+through BlockchainManager's pool, and reports latency and failed calls.
+The outage scenario takes the healthiest stub down half way through and
+brings it back, to show ejection and readmission.
+
+    python benchmarks/bench_rpc_pool.py --iterations 300
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import Web3  # noqa: E402
+
+from blockchain_manager import BlockchainManager  # noqa: E402
+from rpc_stub import StubRPCServer  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=300)
+    return parser.parse_args()
+
+
+def measure(read, iterations, midway=None):
+    latencies, failures = [], 0
+    for i in range(iterations):
+        if midway and i == iterations // 2:
+            midway()
+        started = time.perf_counter()
+        try:
+            read()
+        except Exception:
+            failures += 1
+        latencies.append((time.perf_counter() - started) * 1e3)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.99) - 1], failures
+
+
+def report(name, result):
+    mean, p99, failures = result
+    print(f"{name:<34}{mean:>10.2f}{p99:>10.2f}{failures:>10}")
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    slow = StubRPCServer(delay=0.04).start()
+    stalling = StubRPCServer(delay=0.005, stall_rate=0.1, stall=1.0).start()
+    flaky = StubRPCServer(delay=0.01, fail_rate=0.3, block_number=1_000_000 - 20).start()
+    stubs = (slow, stalling, flaky)
+    names = {slow: 'slow', stalling: 'stalling', flaky: 'flaky'}
+    try:
+        print(f"{'scenario':<34}{'mean ms':>10}{'p99 ms':>10}{'failed':>10}")
+
+        for first in stubs:
+            fixed = Web3(Web3.HTTPProvider(first.url))
+            report(f"fixed first URL = {names[first]}", measure(lambda: fixed.eth.block_number, args.iterations))
+
+        # Health checks re-measure every stub twice a second
+        manager = BlockchainManager(rpc_urls=[stub.url for stub in stubs], health_interval=0.5)
+        pool_read = lambda: manager.web3.eth.block_number  # noqa: E731
+        report("pool", measure(pool_read, args.iterations))
+
+        # Outage: the pool's favourite goes down half way, then comes back
+        manager.pool.eject_seconds = 0.5
+        by_url = {stub.url: stub for stub in stubs}
+        down = []
+
+        def outage():
+            down.append(by_url[manager.rpc_url])
+            down[0].fail_rate = 1.0
+
+        report("pool, favourite goes down", measure(pool_read, args.iterations, midway=outage))
+        down[0].fail_rate = 0.0
+        time.sleep(2 * manager.pool.eject_seconds)
+        report("pool, after recovery", measure(pool_read, args.iterations))
+
+        stats = manager.pool.stats()
+        print(f"\ntook down: {names[down[0]]}  hedges: {stats['hedges']}  failovers: {stats['failovers']}  head: {stats['head']}")
+        for endpoint, stub in zip(stats["endpoints"], stubs):
+            name = names[stub]
+            print(f"  {name:<10}{endpoint['state']:<11}latency {endpoint['latency_ms']:>7.2f} ms  "
+                  f"errors {endpoint['error_rate']:.2f}  lag {endpoint['block_lag']}  requests {endpoint['requests']}")
+    finally:
+        for stub in stubs:
+            stub.stop()
+
+
+if __name__ == '__main__':
+    main()
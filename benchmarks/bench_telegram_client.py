@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Retry behaviour of TelegramClient against a local Bot API stub.
+
+Each scenario scripts the stub's responses, makes one call and checks how
+many requests reached the stub, what the call returned or raised and how
+long it took:
+
+- 429 with retry_after is retried after that many seconds, and not at
+  all with ``retry_429=False``
+- 5xx is retried with backoff until ``max_retries`` is used up
+- other 4xx errors and read timeouts are not retried, since the request
+  may already have been handled
+- a connect timeout (nothing reached the server) is retried
+
+Exits non-zero if any check fails.
+
+    python benchmarks/bench_telegram_client.py
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from telegram_client import TelegramAPIError, TelegramClient  # noqa: E402
+from telegram_stub import StubTelegramServer  # noqa: E402
+
+MAX_RETRIES = 3
+
+
+def run(client, stub, script, method='sendMessage', **kwargs):
+    stub.script(*script)
+    started = time.perf_counter()
+    try:
+        outcome = client.call('123:stub', method, {"chat_id": 1, "text": "hi"}, **kwargs)
+    except Exception as e:
+        outcome = e
+    return outcome, stub.calls[method], time.perf_counter() - started
+
+
+def main():
+    logging.disable(logging.WARNING)
+    stub = StubTelegramServer().start()
+    client = TelegramClient(base_url=stub.url, connect_timeout=0.5, read_timeout=0.5,
+                            max_retries=MAX_RETRIES, backoff_base=0.05)
+    failures = 0
+
+    def check(name, outcome, requests_seen, seconds, expected_outcome, expected_requests, min_seconds=0.0):
+        nonlocal failures
+        ok = (isinstance(outcome, expected_outcome) and requests_seen == expected_requests
+              and seconds >= min_seconds)
+        failures += not ok
+        shown = type(outcome).__name__
+        print(f"{'ok' if ok else 'FAIL':<6}{name:<44}{shown:<18}{requests_seen:>9}{seconds:>9.2f}")
+
+    try:
+        print(f"{'':<6}{'scenario':<44}{'outcome':<18}{'requests':>9}{'seconds':>9}")
+
+        outcome, seen, seconds = run(client, stub, [('rate_limit', 1), ('rate_limit', 1)])
+        check("429 retry_after=1 twice, then ok", outcome, seen, seconds, dict, 3, min_seconds=2.0)
+
+        outcome, seen, seconds = run(client, stub, [('rate_limit', 1)], retry_429=False)
+        check("429 with retry_429=False", outcome, seen, seconds, TelegramAPIError, 1)
+
+        outcome, seen, seconds = run(client, stub, [('rate_limit', 60)])
+        check("429 retry_after above max_retry_after", outcome, seen, seconds, TelegramAPIError, 1)
+
+        outcome, seen, seconds = run(client, stub, [('error', 502), ('error', 503)])
+        check("502, 503, then ok", outcome, seen, seconds, dict, 3)
+
+        outcome, seen, seconds = run(client, stub, [('error', 500)] * (MAX_RETRIES + 1))
+        check(f"500 on all {MAX_RETRIES + 1} attempts", outcome, seen, seconds, TelegramAPIError, MAX_RETRIES + 1)
+
+        outcome, seen, seconds = run(client, stub, [('error', 400)])
+        check("400 is not retried", outcome, seen, seconds, TelegramAPIError, 1)
+
+        outcome, seen, seconds = run(client, stub, [('stall', 1.0)])
+        check("read timeout is not retried", outcome, seen, seconds, requests.exceptions.ReadTimeout, 1)
+
+        # Nothing reaches a server that never accepts, so count attempts on the client side
+        blackhole = TelegramClient(base_url=stub.blackhole(), connect_timeout=0.2,
+                                   max_retries=MAX_RETRIES, backoff_base=0.05)
+        attempts = []
+        post = blackhole.session.post
+        blackhole.session.post = lambda *args, **kwargs: attempts.append(1) or post(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            outcome = blackhole.call('123:stub', 'sendMessage', {"chat_id": 1})
+        except Exception as e:
+            outcome = e
+        check("connect timeout on every attempt", outcome, len(attempts), time.perf_counter() - started,
+              requests.exceptions.ConnectTimeout, MAX_RETRIES + 1, min_seconds=0.2 * (MAX_RETRIES + 1))
+        blackhole.close()
+    finally:
+        client.close()
+        stub.stop()
+
+    print(f"\n{failures} check(s) failed" if failures else "\nall checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
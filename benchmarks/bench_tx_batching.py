@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+One transaction per user record versus one per batch, on a local dev chain stub.
+
+Sends ``--records`` user records from ``--threads`` threads, first as one
+real-mode transaction each (JSON payload, as send_transaction did) and then
+through RecordBatcher, which anchors each batch's Merkle root in a 40-byte
+payload. Reports transactions, gas used (the stub charges intrinsic gas:
+21000 plus calldata) and wall time, and checks every inclusion proof.
+
+    python benchmarks/bench_tx_batching.py --records 500 --threads 20 --max-records 200
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eth_account import Account  # noqa: E402
+from web3 import Web3  # noqa: E402
+
+from blockchain_manager import BlockchainManager  # noqa: E402
+from rpc_stub import StubRPCServer  # noqa: E402
+from tx_batcher import RecordBatcher, verify_proof  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--window', type=float, default=0.5, help='batch window in seconds')
+    parser.add_argument('--max-records', type=int, default=200)
+    parser.add_argument('--mine-delay', type=float, default=0.3)
+    return parser.parse_args()
+
+
+def user_record(index):
+    return {"user_id": str(100000 + index), "username": f"user{index}", "app": "HosseinX4_bot",
+            "timestamp": datetime.now().isoformat()}
+
+
+def new_manager(stub):
+    account = Account.create()
+    manager = BlockchainManager(private_key=account.key, wallet_address=account.address,
+                                rpc_urls=[stub.url], health_interval=0)
+    manager.receipts.poll_interval = 0.1
+    manager.web3
+    return manager
+
+
+def gas_used(handles):
+    return sum(handle.gas_used for handle in handles)
+
+
+def report(name, transactions, gas, elapsed, records):
+    print(f"{name:<18}{transactions:>6}{gas:>12,}{gas / records:>12,.0f}{elapsed:>9.2f}")
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    stub = StubRPCServer(mine_delay=args.mine_delay).start()
+    try:
+        print(f"{'path':<18}{'txs':>6}{'gas':>12}{'gas/record':>12}{'seconds':>9}")
+
+        # One transaction per record
+        manager = new_manager(stub)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            handles = list(executor.map(
+                lambda index: manager.submit_transaction(Web3.to_hex(text=json.dumps(user_record(index)))),
+                range(args.records)))
+        for handle in handles:
+            handle.wait(timeout=60)
+        report("per record", len(handles), gas_used(handles), time.perf_counter() - started, args.records)
+
+        # Batched: one transaction per window or max_records
+        manager = new_manager(stub)
+        submitted = []
+
+        def submit(hex_data, info):
+            handle = manager.submit_transaction(hex_data, info)
+            submitted.append(handle)
+            return handle
+
+        batcher = RecordBatcher(submit, window=args.window, max_records=args.max_records, batch_dir=tempfile.mkdtemp())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            record_ids = list(executor.map(lambda index: batcher.add(user_record(index)), range(args.records)))
+        while batcher.pending_count() or len(submitted) < -(-args.records // args.max_records) \
+                or not all(handle.done for handle in submitted):
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        # Wait for the batcher to write the receipts into the batch files
+        time.sleep(0.1)
+        report("batched", len(submitted), gas_used(submitted), elapsed, args.records)
+
+        receipts = [batcher.lookup(record_id) for record_id in record_ids]
+        valid = sum(1 for receipt in receipts
+                    if receipt["status"] == "confirmed" and verify_proof(receipt["record"], receipt["proof"], receipt["root"]))
+        proof_lengths = [len(receipt["proof"]) for receipt in receipts]
+        print(f"\nconfirmed with a valid inclusion proof: {valid}/{len(receipts)}  "
+              f"proof length: {min(proof_lengths)}-{max(proof_lengths)} hashes")
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
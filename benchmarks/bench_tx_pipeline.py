@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Throughput of real-mode transactions from one wallet against a local dev chain stub.
+
+Before: every sender asks the node for the (latest) transaction count,
+then blocks in wait_for_transaction_receipt, so concurrent senders reuse
+the same nonce and all but one of them fail until the first is mined.
+After: BlockchainManager.submit_transaction takes nonces from the local
+NonceManager and returns a TxHandle right away; one ReceiptTracker polls
+all pending receipts in batch requests.
+
+    python benchmarks/bench_tx_pipeline.py --transactions 50 --threads 10 --mine-delay 0.5
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eth_account import Account  # noqa: E402
+from web3 import Web3  # noqa: E402
+
+from blockchain_manager import BlockchainManager  # noqa: E402
+from rpc_stub import StubRPCServer  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=10)
+    parser.add_argument('--mine-delay', type=float, default=0.5, help='seconds until the stub mines a transaction')
+    return parser.parse_args()
+
+
+def legacy_send(web3, account, index):
+    """The real-mode path before the nonce manager"""
+    nonce = web3.eth.get_transaction_count(account.address)
+    tx = {'to': account.address, 'value': 0, 'gas': 100000, 'gasPrice': web3.eth.gas_price,
+          'nonce': nonce, 'data': Web3.to_hex(text=str(index)), 'chainId': web3.eth.chain_id}
+    signed_tx = web3.eth.account.sign_transaction(tx, account.key)
+    tx_hash = web3.eth.send_raw_transaction(signed_tx.rawTransaction)
+    return web3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+
+
+def pipelined_send(manager, index):
+    return manager.submit_transaction(Web3.to_hex(text=str(index)))
+
+
+def run(stub, name, submit, collect, args):
+    stub.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        futures = [executor.submit(submit, index) for index in range(args.transactions)]
+    results = [collect(future) for future in futures]
+    elapsed = time.perf_counter() - started
+    mined = sum(1 for ok in results if ok)
+    print(f"{name:<14}{elapsed:>9.2f}{mined / elapsed:>8.1f}{mined:>7}{len(results) - mined:>8}"
+          f"{stub.calls['eth_getTransactionCount']:>8}{stub.calls['eth_getTransactionReceipt']:>10}")
+
+
+def main():
+    args = parse_args()
+    logging.disable(logging.WARNING)
+    stub = StubRPCServer(mine_delay=args.mine_delay).start()
+    try:
+        print(f"{'path':<14}{'seconds':>9}{'tx/s':>8}{'mined':>7}{'failed':>8}{'nonces':>8}{'receipts':>10}")
+
+        account = Account.create()
+        web3 = Web3(Web3.HTTPProvider(stub.url))
+
+        def collect_legacy(future):
+            try:
+                return future.result().status == 1
+            except Exception:
+                return False
+
+        run(stub, "before", lambda index: legacy_send(web3, account, index), collect_legacy, args)
+
+        account = Account.create()
+        manager = BlockchainManager(private_key=account.key, wallet_address=account.address,
+                                    rpc_urls=[stub.url], health_interval=0)
+        manager.receipts.poll_interval = 0.1   # web3's wait_for_transaction_receipt polls every 0.1 s too
+        manager.web3
+
+        def collect_pipelined(future):
+            try:
+                future.result().wait(timeout=60)
+                return True
+            except Exception:
+                return False
+
+        run(stub, "pipelined", lambda index: pipelined_send(manager, index), collect_pipelined, args)
+        print(f"\nreceipt batch requests: {manager.receipts.polls}  nonce syncs: {manager.nonces.syncs}")
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
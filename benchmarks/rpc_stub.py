@@ -0,0 +1,200 @@
+"""
+Local JSON-RPC stub of a BNB node for the blockchain benchmarks.
+
+Answers the read methods BlockchainManager uses with fixed values, counts
+calls per method and can add a delay, stall a share of requests or fail a
+share of them, so connection reuse and failover can be measured without a
+real node. The fault settings are plain attributes and may be changed
+while the server runs.
+
+It also accepts signed legacy transactions like a dev chain: a nonce
+ahead of the sender's next one waits in the mempool until the gap is
+filled, and a transaction is mined into its own block, in nonce order,
+once it has been in the mempool for ``mine_delay`` seconds.
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubRPCError(Exception):
+    def __init__(self, message, code=-32000):
+        super().__init__(message)
+        self.code = code
+
+
+class StubRPCServer:
+    """JSON-RPC server on 127.0.0.1 with an ephemeral port"""
+
+    def __init__(self, delay=0.0, fail_rate=0.0, stall_rate=0.0, stall=1.0,
+                 block_number=1_000_000, chain_id=97, gas_price=10 ** 10, mine_delay=0.5):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.block_number = block_number
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.mine_delay = mine_delay
+        self.mined_nonces = {}      # sender -> next nonce of mined transactions
+        self.mempool = {}           # (sender, nonce) -> (tx hash, sent at, gas used)
+        self.receipts = {}          # tx hash -> receipt
+        self.calls = Counter()
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.connections = 0
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def answer(self, request):
+        """JSON-RPC response to one request object"""
+        method, params = request.get('method'), request.get('params') or []
+        with self._lock:
+            self.calls[method] += 1
+            self._mine()
+        results = {
+            'web3_clientVersion': lambda: 'stub/1.0',
+            'net_version': lambda: str(self.chain_id),
+            'eth_chainId': lambda: hex(self.chain_id),
+            'eth_blockNumber': lambda: hex(self.block_number),
+            'eth_gasPrice': lambda: hex(self.gas_price),
+            'eth_getBalance': lambda: hex(10 ** 18),
+            'eth_getTransactionCount': lambda: self._transaction_count(*params),
+            'eth_sendRawTransaction': lambda: self._send_raw_transaction(params[0]),
+            'eth_getTransactionReceipt': lambda: self.receipts.get(params[0]),
+        }
+        if method not in results:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32601, 'message': f'unknown method {method}'}}
+        try:
+            with self._lock:
+                result = results[method]()
+        except StubRPCError as e:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': e.code, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    # Dev chain
+
+    def _transaction_count(self, address, block='latest'):
+        sender = address.lower()
+        nonce = self.mined_nonces.get(sender, 0)
+        if block == 'pending':
+            while (sender, nonce) in self.mempool:
+                nonce += 1
+        return hex(nonce)
+
+    def _send_raw_transaction(self, raw):
+        import rlp
+        from eth_account import Account
+        from eth_utils import keccak
+
+        raw = bytes.fromhex(raw[2:])
+        tx_hash = '0x' + keccak(raw).hex()
+        sender = Account.recover_transaction(raw).lower()
+        fields = rlp.decode(raw)
+        nonce = int.from_bytes(fields[0], 'big')
+        # Intrinsic gas: the base cost plus 16 per non-zero and 4 per zero data byte
+        gas_used = 21000 + sum(16 if byte else 4 for byte in fields[5])
+        if tx_hash in self.receipts or self.mempool.get((sender, nonce), (None,))[0] == tx_hash:
+            raise StubRPCError('already known')
+        if nonce < self.mined_nonces.get(sender, 0):
+            raise StubRPCError(f'nonce too low: next nonce {self.mined_nonces[sender]}, tx nonce {nonce}')
+        if (sender, nonce) in self.mempool:
+            raise StubRPCError('replacement transaction underpriced')
+        self.mempool[(sender, nonce)] = (tx_hash, time.monotonic(), gas_used)
+        return tx_hash
+
+    def _mine(self):
+        now = time.monotonic()
+        for sender in {sender for sender, _ in self.mempool}:
+            while True:
+                nonce = self.mined_nonces.get(sender, 0)
+                tx_hash, sent_at, gas_used = self.mempool.get((sender, nonce), (None, now, 0))
+                if tx_hash is None or now - sent_at < self.mine_delay:
+                    break
+                del self.mempool[(sender, nonce)]
+                self.block_number += 1
+                self.mined_nonces[sender] = nonce + 1
+                self.receipts[tx_hash] = {
+                    'transactionHash': tx_hash,
+                    'blockNumber': hex(self.block_number),
+                    'blockHash': '0x' + f'{self.block_number:064x}',
+                    'transactionIndex': '0x0',
+                    'from': sender,
+                    'to': sender,
+                    'status': '0x1',
+                    'gasUsed': hex(gas_used),
+                    'cumulativeGasUsed': hex(gas_used),
+                    'contractAddress': None,
+                    'logs': [],
+                    'logsBloom': '0x' + '0' * 512,
+                    'effectiveGasPrice': hex(self.gas_price),
+                    'type': '0x0',
+                }
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections open between requests
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; do not let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.stall_rate and random.random() < stub.stall_rate:
+                    time.sleep(stub.stall)
+                if stub.fail_rate and random.random() < stub.fail_rate:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if isinstance(body, list):
+                    payload = [stub.answer(request) for request in body]
+                else:
+                    payload = stub.answer(body)
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
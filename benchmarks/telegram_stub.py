@@ -0,0 +1,124 @@
+"""
+Local stub of the Telegram Bot API for the Telegram client checks.
+
+Every request is answered from a script of responses: ``script(...)``
+queues entries that are used up one per request, in order, and once the
+script runs out every request gets ``{"ok": true}``. An entry is one of
+
+    ('ok',)                 200 with {"ok": true, "result": true}
+    ('error', status)       that status with a Bot API error body
+    ('rate_limit', seconds) 429 with parameters.retry_after
+    ('stall', seconds)      sleeps, then answers 200
+
+Requests are counted per Bot API method. ``blackhole()`` returns the
+address of a listening socket whose accept queue is full, so connecting
+to it runs into the connect timeout.
+"""
+
+import json
+import socket
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubTelegramServer:
+    """Bot API server on 127.0.0.1 with an ephemeral port"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._script = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+        self._blackholes = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for sock in self._blackholes:
+            sock.close()
+
+    def script(self, *entries):
+        """Replace the queued responses and reset the call counts"""
+        with self._lock:
+            self._script = deque(entries)
+            self.calls.clear()
+
+    def blackhole(self):
+        """URL of a socket that never accepts; its backlog is filled, so new connects hang"""
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(0)
+        self._blackholes.append(listener)
+        # Linux queues backlog + 1 connections; further SYNs are dropped
+        for _ in range(2):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(listener.getsockname())
+            self._blackholes.append(filler)
+        time.sleep(0.1)
+        return f"http://127.0.0.1:{listener.getsockname()[1]}"
+
+    def _next(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            return self._script.popleft() if self._script else ('ok',)
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; do not let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                self._answer()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self._answer()
+
+            def _answer(self):
+                method = self.path.split('?')[0].rsplit('/', 1)[-1]
+                entry = stub._next(method)
+                status, payload = 200, {"ok": True, "result": True}
+                if entry[0] == 'stall':
+                    time.sleep(entry[1])
+                elif entry[0] == 'error':
+                    status = entry[1]
+                    payload = {"ok": False, "error_code": status, "description": f"Stub error {status}"}
+                elif entry[0] == 'rate_limit':
+                    status = 429
+                    payload = {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                               "parameters": {"retry_after": entry[1]}}
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on a stalled request
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
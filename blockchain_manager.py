@@ -10,8 +10,18 @@ import os
 import json
 import random
 import logging
+import threading
+import time
 from datetime import datetime
+
 from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+from chain_cache import ChainCache
+from config import Config
+from rpc_pool import RPCPool
+from tx_batcher import RecordBatcher
+from tx_pipeline import NonceManager, ReceiptTracker, TxHandle, is_already_known, is_nonce_error
 
 # تنظیم لاگینگ
 logging.basicConfig(
@@ -30,59 +40,161 @@ BNB_TESTNET_RPC_URLS = [
     "https://data-seed-prebsc-2-s1.binance.org:8545/"
 ]
 
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """پرووایدر Web3 که هر درخواست را از طریق استخر RPC به سالم‌ترین آدرس می‌فرستد"""
+    
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+    
+    def make_request(self, method, params):
+        return self.pool.request(method, self.encode_rpc_request(method, params))
+    
+    def is_connected(self, show_traceback=False):
+        # وضعیت از آمار استخر خوانده می‌شود و درخواست شبکه‌ای ندارد
+        return self.pool.is_available()
+
+
 class BlockchainManager:
-    """کلاس مدیریت تراکنش‌های بلاکچین BNB"""
+    """کلاس مدیریت تراکنش‌های بلاکچین BNB
+
+    درخواست‌ها از طریق یک استخر RPC (rpc_pool.RPCPool) به سالم‌ترین آدرس
+    می‌روند. اتصال در اولین استفاده برقرار می‌شود و بعد از آن یک رشته
+    پس‌زمینه هر ``health_interval`` ثانیه همه آدرس‌ها را بررسی می‌کند.
+    یک نمونه را می‌توان بین چند رشته به اشتراک گذاشت.
+    """
     
-    def __init__(self, private_key=None, wallet_address=None, rpc_url=None):
-        """مقداردهی اولیه مدیریت بلاکچین"""
-        # استفاده از RPC پیش‌فرض اگر مقدار ورودی نداریم
-        if rpc_url is None:
-            rpc_url = BNB_TESTNET_RPC_URLS[0]
+    def __init__(self, private_key=None, wallet_address=None, rpc_url=None, health_interval=None, rpc_urls=None):
+        """مقداردهی اولیه مدیریت بلاکچین (بدون اتصال به شبکه)"""
+        # آدرس‌های RPC: فهرست ورودی، یا RPC ورودی و بعد بقیه آدرس‌های پیش‌فرض
+        default_urls = Config.BLOCKCHAIN_RPC_URLS or BNB_TESTNET_RPC_URLS
+        if rpc_urls is None:
+            rpc_urls = [rpc_url] + [url for url in default_urls if url != rpc_url] if rpc_url else default_urls
         
-        self.rpc_url = rpc_url
-        self.web3 = self._connect_to_blockchain()
+        self.pool = RPCPool(
+            rpc_urls,
+            timeout=Config.BLOCKCHAIN_RPC_TIMEOUT,
+            hedge_delay=Config.BLOCKCHAIN_HEDGE_DELAY,
+            eject_failures=Config.BLOCKCHAIN_EJECT_FAILURES,
+            eject_seconds=Config.BLOCKCHAIN_EJECT_SECONDS,
+            max_lag=Config.BLOCKCHAIN_MAX_BLOCK_LAG,
+            pool_size=Config.BLOCKCHAIN_RPC_POOL_SIZE,
+        )
+        self.health_interval = Config.BLOCKCHAIN_HEALTH_INTERVAL if health_interval is None else health_interval
+        self.cache = ChainCache()
+        self._web3 = None
+        self._lock = threading.Lock()
+        self._health_thread = None
         
         # کلید خصوصی از محیط یا از پارامتر ورودی
         self.private_key = private_key or os.environ.get('BNB_PRIVATE_KEY')
         self.wallet_address = wallet_address or os.environ.get('BNB_WALLET_ADDRESS', TEST_WALLET_ADDRESS)
         
-        logger.info(f"مدیریت بلاکچین راه‌اندازی شد با RPC: {rpc_url}")
+        # nonce محلی و ردیاب رسیدها برای ارسال چند تراکنش پشت سر هم
+        self.nonces = NonceManager(lambda: self.web3.eth.get_transaction_count(self.wallet_address, 'pending'))
+        self.receipts = ReceiptTracker(
+            self.pool,
+            poll_interval=Config.BLOCKCHAIN_RECEIPT_POLL_INTERVAL,
+            timeout=Config.BLOCKCHAIN_RECEIPT_TIMEOUT,
+            on_receipt=self._on_receipt,
+        )
+        
+        logger.info(f"مدیریت بلاکچین راه‌اندازی شد با RPC: {', '.join(rpc_urls)}")
+    
+    @property
+    def rpc_url(self):
+        """آدرس RPC که درخواست بعدی به آن می‌رود"""
+        return self.pool.best_url()
+    
+    @property
+    def connected(self):
+        """اتصال برقرار شده و دست کم یک آدرس RPC سالم است"""
+        return self._web3 is not None and self.pool.is_available()
+    
+    @property
+    def web3(self):
+        """نمونه Web3 فعلی؛ اتصال در اولین استفاده برقرار می‌شود"""
+        web3 = self._web3
+        if web3 is None:
+            started = False
+            with self._lock:
+                if self._web3 is None:
+                    self._web3 = self._connect_to_blockchain()
+                    self._start_health_checks()
+                    started = True
+                web3 = self._web3
+            if started:
+                self._sync_nonce_on_start()
+        return web3
     
     def _connect_to_blockchain(self):
         """اتصال به شبکه بلاکچین BNB"""
+        # همه آدرس‌ها با هم بررسی می‌شوند تا تأخیر و شماره بلاک هر کدام معلوم شود
+        if self.pool.check_health():
+            logger.info(f"اتصال به شبکه BNB برقرار شد: {self.rpc_url}")
+        else:
+            # اگر هیچ RPC کار نکرد، Web3 را برمی‌گردانیم تا برنامه کار کند و بررسی سلامت بعدی دوباره تلاش می‌کند
+            logger.error("اتصال به هیچ RPC موفقیت‌آمیز نبود")
+        return Web3(PooledHTTPProvider(self.pool))
+    
+    def _sync_nonce_on_start(self):
+        """خواندن nonce از زنجیره هنگام راه‌اندازی، اگر کلید خصوصی داریم"""
+        if self.private_key is None:
+            return
         try:
-            web3 = Web3(Web3.HTTPProvider(self.rpc_url))
-            
-            # بررسی اتصال
-            if web3.is_connected():
-                logger.info(f"اتصال به شبکه BNB برقرار شد. شماره بلاک فعلی: {web3.eth.block_number}")
-                return web3
-            else:
-                logger.error(f"خطا در اتصال به {self.rpc_url}")
-                
-                # تلاش با دیگر آدرس‌های RPC
-                for alt_rpc in BNB_TESTNET_RPC_URLS:
-                    if alt_rpc != self.rpc_url:
-                        logger.info(f"تلاش برای اتصال به RPC جایگزین: {alt_rpc}")
-                        web3 = Web3(Web3.HTTPProvider(alt_rpc))
-                        if web3.is_connected():
-                            self.rpc_url = alt_rpc
-                            logger.info(f"اتصال به RPC جایگزین برقرار شد: {alt_rpc}")
-                            return web3
-                
-                # اگر هیچ RPC کار نکرد
-                raise ConnectionError("اتصال به هیچ RPC موفقیت‌آمیز نبود")
-        
+            self.nonces.prime()
         except Exception as e:
-            logger.error(f"خطا در اتصال به بلاکچین: {str(e)}")
-            # در حالت دمو یک نمونه Web3 برمی‌گردانیم تا برنامه کار کند
-            return Web3(Web3.HTTPProvider(self.rpc_url))
+            # اولین ارسال دوباره تلاش می‌کند
+            logger.error(f"خطا در خواندن nonce: {str(e)}")
+    
+    def check_health(self):
+        """بررسی سلامت همه آدرس‌های RPC و بازگرداندن آدرس‌های اخراج‌شده پس از بهبود"""
+        healthy = self.pool.check_health()
+        if not healthy:
+            logger.warning("هیچ آدرس RPC سالمی در دسترس نیست")
+        return healthy
+    
+    def _start_health_checks(self):
+        if self.health_interval <= 0 or (self._health_thread is not None and self._health_thread.is_alive()):
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, name="blockchain-health", daemon=True)
+        self._health_thread.start()
+    
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"خطا در بررسی سلامت اتصال: {str(e)}")
+    
+    # داده‌های زنجیره با کش
+    
+    def get_chain_id(self):
+        """شناسه زنجیره؛ تغییر نمی‌کند و یک بار خوانده می‌شود"""
+        return self.cache.get("chain_id", lambda: self.web3.eth.chain_id)
+    
+    def get_gas_price(self):
+        """قیمت گس (wei) با TTL کوتاه و به‌روزرسانی در پس‌زمینه"""
+        return self.cache.get("gas_price", lambda: self.web3.eth.gas_price,
+                              ttl=Config.BLOCKCHAIN_GAS_PRICE_TTL, refresh=True)
+    
+    def get_block_number(self):
+        """شماره آخرین بلاک با TTL کوتاه و به‌روزرسانی در پس‌زمینه"""
+        return self.cache.get("block_number", lambda: self.web3.eth.block_number,
+                              ttl=Config.BLOCKCHAIN_BLOCK_NUMBER_TTL, refresh=True)
+    
+    def invalidate_balance(self, address=None):
+        """حذف موجودی کش‌شده یک آدرس، مثلاً بعد از تراکنش خودمان"""
+        self.cache.invalidate("balance", (address or self.wallet_address).lower())
     
     def get_balance(self, address=None):
         """دریافت موجودی یک آدرس کیف پول"""
         try:
             address = address or self.wallet_address
-            balance_wei = self.web3.eth.get_balance(address)
+            balance_wei = self.cache.get("balance", lambda: self.web3.eth.get_balance(address),
+                                         ttl=Config.BLOCKCHAIN_BALANCE_TTL, key=address.lower())
             balance_bnb = self.web3.from_wei(balance_wei, 'ether')
             logger.info(f"موجودی آدرس {address}: {balance_bnb} BNB")
             return balance_bnb
@@ -94,11 +206,13 @@ class BlockchainManager:
         """دریافت اطلاعات شبکه بلاکچین"""
         try:
             network_info = {
-                "block_number": self.web3.eth.block_number,
-                "gas_price": self.web3.from_wei(self.web3.eth.gas_price, 'gwei'),
-                "chain_id": self.web3.eth.chain_id,
-                "connected": self.web3.is_connected(),
-                "rpc_url": self.rpc_url
+                "block_number": self.get_block_number(),
+                "gas_price": Web3.from_wei(self.get_gas_price(), 'gwei'),
+                "chain_id": self.get_chain_id(),
+                "connected": self.connected,
+                "rpc_url": self.rpc_url,
+                "rpc_pool": self.pool.stats(),
+                "cache": self.cache.stats()
             }
             return network_info
         except Exception as e:
@@ -108,6 +222,106 @@ class BlockchainManager:
                 "error": str(e)
             }
     
+    # ارسال تراکنش
+    
+    def submit_transaction(self, hex_data, data=None):
+        """امضا و ارسال تراکنش بدون انتظار برای رسید؛ یک TxHandle برمی‌گرداند
+
+        nonce از NonceManager گرفته می‌شود، پس چند فراخوان هم‌زمان nonce
+        تکراری نمی‌گیرند. اگر شبکه nonce را رد کند، nonce از زنجیره دوباره
+        خوانده و تراکنش یک بار دیگر امضا و ارسال می‌شود.
+        """
+        if self.private_key is None:
+            raise ValueError("برای ارسال تراکنش واقعی کلید خصوصی لازم است")
+        
+        # اتصال پیش از گرفتن nonce برقرار می‌شود (اتصال خودش nonce را از زنجیره می‌خواند)
+        web3 = self.web3
+        for attempt in range(2):
+            nonce = self.nonces.allocate()
+            
+            # ساخت تراکنش 
+            tx = {
+                'to': self.wallet_address,  # ارسال به خود برای ثبت داده
+                'value': 0,  # بدون ارسال مقدار
+                'gas': 100000,
+                'gasPrice': self.get_gas_price(),
+                'nonce': nonce,
+                'data': hex_data,
+                'chainId': self.get_chain_id()
+            }
+            
+            # امضای تراکنش
+            signed_tx = web3.eth.account.sign_transaction(tx, self.private_key)
+            tx_hash = signed_tx.hash.hex()
+            
+            # ارسال تراکنش
+            try:
+                web3.eth.send_raw_transaction(signed_tx.rawTransaction)
+                break
+            except Exception as e:
+                if is_already_known(e):
+                    # همین تراکنش قبلاً به شبکه رسیده است
+                    break
+                # ممکن است nonce مصرف نشده باشد؛ ارسال بعدی آن را از زنجیره می‌خواند
+                self.nonces.reset()
+                if attempt or not is_nonce_error(e):
+                    raise
+                logger.warning(f"nonce {nonce} رد شد؛ خواندن دوباره از زنجیره: {str(e)}")
+        
+        self.invalidate_balance()
+        logger.info(f"تراکنش ارسال شد: {tx_hash} (nonce {nonce})")
+        return self.receipts.track(TxHandle(tx_hash, nonce, data))
+    
+    def submit_batch(self, hex_data, info=None):
+        """ارسال ریشه مرکل یک دسته از رکوردها در یک تراکنش
+
+        در حالت دمو (یا بدون کلید خصوصی) تراکنشی ارسال نمی‌شود و نتیجه نمایشی برمی‌گردد.
+        """
+        if Config.BLOCKCHAIN_DEMO_MODE or self.private_key is None:
+            logger.info(f"حالت دمو: شبیه‌سازی ارسال دسته {info}")
+            # هیچ بلاکی این ریشه را ندارد، پس شماره بلاکی هم برنمی‌گردد
+            return {
+                "status": "success",
+                "tx_hash": _fake_tx_hash(),
+                "block_number": None,
+                "demo_mode": True,
+            }
+        return self.submit_transaction(hex_data, info)
+    
+    def check_transaction(self, tx_hash):
+        """وضعیت یک تراکنش: success، failed، pending یا dropped (دیگر در شبکه نیست) و شماره بلاک آن"""
+        receipt, tx = self.pool.batch([
+            ("eth_getTransactionReceipt", [tx_hash]),
+            ("eth_getTransactionByHash", [tx_hash]),
+        ])
+        for response in (receipt, tx):
+            if "error" in response:
+                raise RuntimeError(response["error"].get("message"))
+        if receipt.get("result"):
+            status = "success" if int(receipt["result"].get("status", "0x0"), 16) == 1 else "failed"
+            return status, int(receipt["result"]["blockNumber"], 16)
+        if tx.get("result"):
+            return "pending", None
+        # nonce این تراکنش آزاد شده است؛ ارسال بعدی آن را از زنجیره می‌خواند
+        self.nonces.reset()
+        return "dropped", None
+    
+    def _on_receipt(self, handle):
+        # هزینه گس با استخراج تراکنش از موجودی کم می‌شود
+        self.invalidate_balance()
+        if handle.error is not None:
+            logger.error(f"رسید تراکنش {handle.tx_hash} دریافت نشد: {handle.error}")
+    
+    def _cached_block_number(self):
+        """شماره بلاک کش‌شده، یا صفر اگر شبکه در دسترس نیست"""
+        try:
+            # دسترسی به web3 در اولین استفاده اتصال را برقرار می‌کند
+            if self.web3 is not None and self.connected:
+                return self.get_block_number()
+        except Exception as e:
+            logger.error(f"خطا در دریافت شماره بلاک: {str(e)}")
+        return 0
+    
     def send_transaction(self, data=None, demo_mode=True):
         """ارسال تراکنش به شبکه بلاکچین
 
@@ -128,57 +342,38 @@ class BlockchainManager:
             }
         
         # تبدیل به داده hex برای ارسال روی بلاکچین
-        hex_data = self.web3.to_hex(text=json.dumps(data))
+        hex_data = Web3.to_hex(text=json.dumps(data))
         
         try:
             if demo_mode or self.private_key is None:
                 # حالت دمو - بدون ارسال تراکنش واقعی
                 logger.info(f"حالت دمو: شبیه‌سازی ارسال تراکنش با داده: {data}")
                 
-                # ساخت یک هش تراکنش تصادفی
-                fake_tx_hash = "0x" + "".join([random.choice("0123456789abcdef") for _ in range(64)])
-                
                 tx_result = {
                     "status": "success",
-                    "tx_hash": fake_tx_hash,
+                    "tx_hash": _fake_tx_hash(),
                     "data": data,
                     "random_number": random_number,
                     "demo_mode": True,
                     "timestamp": timestamp,
-                    "block_number": self.web3.eth.block_number if self.web3.is_connected() else 0,
+                    # شماره بلاک از کش خوانده می‌شود، نه با درخواست تازه برای هر تراکنش دمو
+                    "block_number": self._cached_block_number(),
                     "network": "BNB Testnet"
                 }
                 return tx_result
             
             else:
                 # حالت واقعی - ارسال تراکنش به شبکه بلاکچین
-                nonce = self.web3.eth.get_transaction_count(self.wallet_address)
+                handle = self.submit_transaction(hex_data, data)
                 
-                # ساخت تراکنش 
-                tx = {
-                    'to': self.wallet_address,  # ارسال به خود برای ثبت داده
-                    'value': 0,  # بدون ارسال مقدار
-                    'gas': 100000,
-                    'gasPrice': self.web3.eth.gas_price,
-                    'nonce': nonce,
-                    'data': hex_data,
-                    'chainId': self.web3.eth.chain_id
-                }
-                
-                # امضای تراکنش
-                signed_tx = self.web3.eth.account.sign_transaction(tx, self.private_key)
-                
-                # ارسال تراکنش
-                tx_hash = self.web3.eth.send_raw_transaction(signed_tx.rawTransaction)
-                
-                # دریافت رسید تراکنش
-                receipt = self.web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+                # دریافت رسید تراکنش از ردیاب رسیدها؛ در این مدت تراکنش‌های دیگر ارسال می‌شوند
+                handle.wait(timeout=Config.BLOCKCHAIN_RECEIPT_TIMEOUT + Config.BLOCKCHAIN_RECEIPT_POLL_INTERVAL * 2)
                 
                 tx_result = {
-                    "status": "success" if receipt.status == 1 else "failed",
-                    "tx_hash": tx_hash.hex(),
-                    "block_number": receipt.blockNumber,
-                    "gas_used": receipt.gasUsed,
+                    "status": handle.status,
+                    "tx_hash": handle.tx_hash,
+                    "block_number": handle.block_number,
+                    "gas_used": handle.gas_used,
                     "data": data,
                     "random_number": random_number,
                     "timestamp": timestamp,
@@ -200,13 +395,52 @@ class BlockchainManager:
             }
 
 
+def _fake_tx_hash():
+    """ساخت یک هش تراکنش تصادفی برای حالت دمو"""
+    return "0x" + "".join([random.choice("0123456789abcdef") for _ in range(64)])
+
+
+_manager = None
+_batcher = None
+_manager_lock = threading.Lock()
+
+
+def get_blockchain_manager():
+    """نمونه مشترک BlockchainManager برای کل پروسه"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = BlockchainManager()
+    return _manager
+
+
+def get_record_batcher():
+    """نمونه مشترک RecordBatcher که رکوردها را دسته‌ای روی بلاکچین ثبت می‌کند"""
+    global _batcher
+    if _batcher is None:
+        manager = get_blockchain_manager()
+        with _manager_lock:
+            if _batcher is None:
+                _batcher = RecordBatcher(
+                    manager.submit_batch,
+                    window=Config.BLOCKCHAIN_BATCH_WINDOW,
+                    max_records=Config.BLOCKCHAIN_BATCH_MAX_RECORDS,
+                    batch_dir=Config.BLOCKCHAIN_BATCH_DIR,
+                    max_retries=Config.BLOCKCHAIN_BATCH_MAX_RETRIES,
+                    check=manager.check_transaction,
+                )
+    return _batcher
+
+
 # تابع کمکی برای استفاده در Flask
 def send_transaction_to_blockchain(user_id=None, username=None):
-    """ارسال تراکنش به بلاکچین و دریافت نتیجه آن"""
+    """ارسال تراکنش به بلاکچین و دریافت نتیجه آن
+
+    با فعال بودن BLOCKCHAIN_BATCHING رکورد در دسته بعدی ثبت می‌شود و یک
+    record_id برمی‌گردد که با get_blockchain_receipt پیگیری می‌شود.
+    """
     try:
-        # ایجاد نمونه مدیریت بلاکچین
-        blockchain_manager = BlockchainManager()
-        
         # ساخت داده برای ارسال
         data = {
             "user_id": str(user_id) if user_id else "anonymous",
@@ -215,8 +449,19 @@ def send_transaction_to_blockchain(user_id=None, username=None):
             "timestamp": datetime.now().isoformat()
         }
         
-        # ارسال تراکنش در حالت دمو
-        result = blockchain_manager.send_transaction(data=data, demo_mode=True)
+        if Config.BLOCKCHAIN_BATCHING:
+            # یک تراکنش برای همه رکوردهای هر دسته؛ رسید بعداً با record_id خوانده می‌شود
+            record_id = get_record_batcher().add(data)
+            return {
+                "status": "queued",
+                "record_id": record_id,
+                "data": data,
+                "batch_window": Config.BLOCKCHAIN_BATCH_WINDOW,
+                "timestamp": data["timestamp"]
+            }
+        
+        # ارسال تراکنش جداگانه با نمونه مشترک مدیریت بلاکچین
+        result = get_blockchain_manager().send_transaction(data=data, demo_mode=Config.BLOCKCHAIN_DEMO_MODE)
         
         return result
     
@@ -229,6 +474,25 @@ def send_transaction_to_blockchain(user_id=None, username=None):
         }
 
 
+def get_blockchain_receipt(record_id):
+    """وضعیت، تراکنش و اثبات مرکل یک رکورد دسته‌ای
+
+    با tx_batcher.verify_proof(record, proof, root) می‌توان درستی اثبات را بررسی کرد.
+    """
+    try:
+        receipt = get_record_batcher().lookup(record_id)
+        if receipt is None:
+            return {"status": "not_found", "record_id": record_id}
+        return receipt
+    except Exception as e:
+        logger.error(f"خطا در دریافت رسید رکورد: {str(e)}")
+        return {
+            "status": "error",
+            "error": str(e),
+            "record_id": record_id
+        }
+
+
 # تست اولیه اگر فایل مستقیماً اجرا شود
 if __name__ == "__main__":
     print("آزمایش سرویس بلاکچین...")
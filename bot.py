@@ -4,8 +4,11 @@ import sys
 import threading
 import time
 import json
+import hashlib
+import hmac
+import random
+from collections import deque
 from datetime import datetime
-import requests
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,23 +18,37 @@ logger = logging.getLogger(__name__)
 bot_instance = None
 is_running = False
 bot_thread = None
+bot_stop_event = None
+current_token = None
+current_webhook_url = None
+settings_watched = False
 
 # Import models here to avoid circular imports
 from models import BotLog, BotUser, BotMessage
 from app import db
+from async_bot import async_engine
+from config import Config
+from db_log_handler import bot_logger, db_log_handler
+from dispatcher import UpdateDispatcher, get_chat_id
+from handlers import router
+from metrics import POLL_LAG_SECONDS, SEND_QUEUE_DEPTH, UPDATE_QUEUE_DEPTH
+from persistence import persistence_queue
+from rate_limiter import PRIORITY_INTERACTIVE, send_scheduler
+from reply_templates import reply_templates
+from router import Reply
+from settings_cache import settings_cache
+from telegram_client import telegram_client
+from update_tracker import update_tracker
+from user_cache import user_cache
 
 # Function to add log entries to the database
 def add_log(level, message):
-    from app import app
-    with app.app_context():
-        log_entry = BotLog(level=level, message=message)
-        db.session.add(log_entry)
-        db.session.commit()
+    """Hand a log entry to the buffered BotLog handler; never blocks on the database"""
+    bot_logger.log(logging.getLevelName(level), message)
 
 # Function to send a message using the Telegram Bot API
-def send_telegram_message(token, chat_id, text, reply_markup=None):
-    """Send a message using the Telegram Bot API"""
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+def send_telegram_message(token, chat_id, text, reply_markup=None, priority=PRIORITY_INTERACTIVE):
+    """Send a message through the rate-limited send scheduler and wait for the result"""
     data = {
         "chat_id": chat_id,
         "text": text,
@@ -39,46 +56,40 @@ def send_telegram_message(token, chat_id, text, reply_markup=None):
     }
     
     if reply_markup:
-        data["reply_markup"] = json.dumps(reply_markup)
+        # Pre-serialized keyboards (see reply_templates) are sent as they are
+        data["reply_markup"] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
     
+    return send_reply(token, Reply("sendMessage", data, None), priority)
+
+# Function to perform a handler's reply
+def send_reply(token, reply, priority=PRIORITY_INTERACTIVE):
+    """Send a router Reply and wait for the result; returns None on failure"""
     try:
-        response = requests.post(url, data=data)
-        response.raise_for_status()
-        return response.json()
+        if reply.method == "sendMessage":
+            # Messages go through the scheduler so Telegram's flood limits hold
+            job = send_scheduler.submit(token, reply.params, priority)
+            return job.future.result(timeout=Config.SEND_WAIT_TIMEOUT)
+        return telegram_client.call(token, reply.method, reply.params)
     except Exception as e:
-        logger.error(f"Error sending message: {e}")
+        logger.error(f"Error calling {reply.method}: {e}")
         return None
         
-# Function to create an inline keyboard with a Mini App button
-def create_webapp_button(web_app_url, button_text="Open Mini App"):
-    """Create a keyboard with a Web App button"""
-    keyboard = {
-        "inline_keyboard": [
-            [
-                {
-                    "text": button_text,
-                    "web_app": {
-                        "url": web_app_url
-                    }
-                }
-            ]
-        ]
-    }
-    return keyboard
-
 # Function to get bot updates using the Telegram Bot API
-def get_telegram_updates(token, offset=None):
+def get_telegram_updates(token, offset=None, limit=None, allowed_updates=None):
     """Get updates from the Telegram Bot API"""
-    url = f"https://api.telegram.org/bot{token}/getUpdates"
-    params = {"timeout": 30}
+    params = {"timeout": Config.POLL_TIMEOUT}
     
     if offset:
         params["offset"] = offset
+    if limit:
+        params["limit"] = limit
+    if allowed_updates is not None:
+        params["allowed_updates"] = json.dumps(allowed_updates)
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        # The read timeout must outlast the server-side long poll
+        return telegram_client.call(token, "getUpdates", params, http_method='get',
+                                    read_timeout=Config.POLL_TIMEOUT + 10)
     except Exception as e:
         logger.error(f"Error getting updates: {e}")
         return None
@@ -86,20 +97,128 @@ def get_telegram_updates(token, offset=None):
 # Function to get bot information using the Telegram Bot API
 def get_bot_info(token):
     """Get bot information using the Telegram Bot API"""
-    url = f"https://api.telegram.org/bot{token}/getMe"
-    
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
+        return telegram_client.call(token, "getMe", http_method='get')
     except Exception as e:
         logger.error(f"Error getting bot info: {e}")
         return None
 
+# Function to register the webhook with Telegram
+def set_telegram_webhook(token, url):
+    """Point Telegram at our webhook endpoint"""
+    params = {
+        "url": url,
+        "secret_token": get_webhook_secret(token),
+        "allowed_updates": json.dumps(Config.POLL_ALLOWED_UPDATES),
+        "max_connections": Config.WEBHOOK_MAX_CONNECTIONS
+    }
+    
+    try:
+        return telegram_client.call(token, "setWebhook", params)
+    except Exception as e:
+        logger.error(f"Error setting webhook: {e}")
+        return None
+
+# Function to remove the webhook so getUpdates can be used again
+def delete_telegram_webhook(token):
+    """Remove any webhook registered for the bot"""
+    try:
+        return telegram_client.call(token, "deleteWebhook")
+    except Exception as e:
+        logger.error(f"Error deleting webhook: {e}")
+        return None
+
+# Function to get the secret Telegram sends with every webhook request
+def get_webhook_secret(token):
+    """Configured WEBHOOK_SECRET, or one derived from the token so every worker agrees"""
+    if Config.WEBHOOK_SECRET:
+        return Config.WEBHOOK_SECRET
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def verify_webhook_secret(token, received):
+    """Constant-time check of the X-Telegram-Bot-Api-Secret-Token header"""
+    return bool(received) and hmac.compare_digest(received, get_webhook_secret(token))
+
+# Function to get the token for webhook requests handled by this process
+def get_webhook_token():
+    """Current token from the settings cache (a version-stamp check, not a full read)"""
+    return settings_cache.get('telegram_token')
+
+# Function to switch the running bot to a new token
+def apply_token_change(changed):
+    """Hot-reload a token changed in any worker without restarting the bot's threads"""
+    global current_token
+    token = changed.get('telegram_token')
+    if not is_running or not token or token == current_token:
+        return
+    old_token, current_token = current_token, token
+    add_log("INFO", "Telegram token changed, switching the running bot")
+    
+    if Config.BOT_MODE == 'webhook':
+        delete_telegram_webhook(old_token)
+        set_telegram_webhook(token, current_webhook_url)
+    else:
+        # getUpdates is rejected while a webhook is registered
+        delete_telegram_webhook(token)
+        if Config.BOT_ENGINE == 'asyncio':
+            async_engine.set_token(token)
+
+# Function to propagate settings changes to this process
+def watch_settings():
+    """Subscribe to token and reply-template changes (once per process)"""
+    global settings_watched
+    if settings_watched:
+        return
+    settings_watched = True
+    reply_templates.watch_settings()
+    settings_cache.subscribe(('telegram_token',), apply_token_change)
+
+# Function to compute the retry delay after consecutive polling errors
+def backoff_delay(failures):
+    """Exponential backoff with full jitter, capped at POLL_BACKOFF_MAX"""
+    delay = min(Config.POLL_BACKOFF_MAX, Config.POLL_BACKOFF_BASE * (2 ** (failures - 1)))
+    return random.uniform(0, delay)
+
+class ReplyLatency:
+    """Latency from a Telegram update's ``date`` to our reply being sent.
+
+    Telegram timestamps have one-second resolution, so individual samples
+    are only accurate to about a second; percentiles over many samples are
+    still useful to compare polling modes.
+    """
+    
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+    
+    def record(self, update_date):
+        latency = max(0.0, time.time() - update_date)
+        with self._lock:
+            self._samples.append(latency)
+            self.count += 1
+            self.total += latency
+    
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": count,
+            "avg": round(total / count, 3),
+            "p50": round(samples[len(samples) // 2], 3),
+            "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+            "max": round(samples[-1], 3)
+        }
+
+reply_latency = ReplyLatency()
+
 # Function to simulate bot polling
-def simulate_bot_polling(token):
-    """Simulate bot polling in a separate thread."""
-    global is_running
+def simulate_bot_polling(token, stop_event):
+    """Simulate bot polling in a separate thread until ``stop_event`` is set."""
     
     add_log("INFO", f"Starting bot simulation with token: {token[:5]}...{token[-5:]}")
     
@@ -141,171 +260,92 @@ def simulate_bot_polling(token):
             db.session.commit()
             add_log("INFO", "Added demo users and messages")
     
-    # Try to poll for real updates
-    last_update_id = None
+    # Resume after the last update handled before a restart
+    last_update_id = update_tracker.load(token)
+    failures = 0
     
-    # Keep the bot running while is_running is True
-    while is_running:
+    # Each poller has its own stop event, so one that is still inside a long
+    # poll when the bot is restarted stops instead of running alongside the new one
+    while not stop_event.is_set():
+        if current_token and current_token != token:
+            # Token changed in the settings: poll the new bot from its own stored offset
+            token = current_token
+            last_update_id = update_tracker.load(token)
+        
         try:
-            # Try to get real updates from Telegram
-            if token and token != "simulation":
-                updates = get_telegram_updates(token, last_update_id)
-                
-                if updates and updates.get('ok'):
-                    for update in updates.get('result', []):
-                        handle_update(token, update)
-                        # Update the last update ID
-                        last_update_id = update['update_id'] + 1
+            if not token or token == "simulation":
+                # Nothing to poll in simulation mode
+                stop_event.wait(2)
+                continue
             
-            # Sleep to prevent CPU usage spikes
-            time.sleep(2)
+            # Long poll: Telegram holds the request until updates arrive, so
+            # the next poll starts immediately after a batch
+            updates = get_telegram_updates(token, last_update_id, limit=Config.POLL_LIMIT,
+                                           allowed_updates=Config.POLL_ALLOWED_UPDATES)
+            
+            if stop_event.is_set():
+                # Stopped during the long poll: leave these updates to the next poller
+                break
+            
+            if not updates or not updates.get('ok'):
+                failures += 1
+                stop_event.wait(backoff_delay(failures))
+                continue
+            
+            failures = 0
+            for update in updates.get('result', []):
+                # Advance the offset only once a worker accepted the update
+                # (duplicates count as accepted; they are dropped in enqueue_update)
+                if not enqueue_update(token, update):
+                    break
+                last_update_id = update['update_id'] + 1
+                if 'date' in update.get('message', {}):
+                    POLL_LAG_SECONDS.observe(max(0.0, time.time() - update['message']['date']))
         except Exception as e:
             logger.error(f"Error in bot simulation: {e}")
             add_log("ERROR", f"Error in bot simulation: {str(e)}")
-            time.sleep(5)  # Wait longer if there's an error
+            failures += 1
+            stop_event.wait(backoff_delay(failures))
 
 # Function to handle a Telegram update
 def handle_update(token, update):
-    """Handle a single update from Telegram"""
-    from app import app
-    
+    """Handle a single update through the command router"""
     try:
-        # Check if this is a message
-        if 'message' in update and 'text' in update['message']:
-            chat_id = update['message']['chat']['id']
-            user_id = update['message']['from']['id']
-            text = update['message']['text']
-            username = update['message'].get('from', {}).get('username', '')
-            first_name = update['message'].get('from', {}).get('first_name', '')
-            last_name = update['message'].get('from', {}).get('last_name', '')
-            
-            # Log the received message
-            with app.app_context():
-                # Check if user exists
-                user = BotUser.query.filter_by(telegram_id=user_id).first()
-                if not user:
-                    # Create new user
-                    user = BotUser(
-                        telegram_id=user_id,
-                        username=username,
-                        first_name=first_name,
-                        last_name=last_name
-                    )
-                    db.session.add(user)
-                    db.session.commit()
-                    add_log("INFO", f"New user registered: {user_id} - {username}")
-                
-                # Save the message
-                message = BotMessage(
-                    telegram_user_id=user_id,
-                    message_text=text,
-                    is_from_user=True
-                )
-                db.session.add(message)
-                db.session.commit()
-            
-            # Handle commands
-            if text.startswith('/'):
-                command = text.split(' ')[0].lower()
-                
-                if command == '/start':
-                    welcome_message = (
-                        f"به بازی حسین ایکس بات ۳ خوش آمدید {first_name}! 👋\n\n"
-                        f"من اینجا هستم تا به شما کمک کنم.\n\n"
-                        f"برای دیدن دستورات از /help استفاده کنید یا مینی اپ را از دکمه زیر باز کنید."
-                    )
-                    
-                    # Create a Mini App button
-                    # 1. First option: Use GitHub Pages (when available)
-                    github_url = "homland1.github.io/HosseinX-bot3"
-                    
-                    # 2. Fallback to Replit URL if GitHub Pages is not ready
-                    replit_domain = os.environ.get('REPLIT_DOMAINS', '57a0603e-812d-4af0-a6fd-47ceb27f1626-00-365m8arhc6yga.picard.replit.dev')
-                    if ',' in replit_domain:  # Handle multiple domains
-                        replit_domain = replit_domain.split(',')[0]
-                    
-                    # 3. Choose which URL to use (for now use Replit URL)
-                    use_github = False  # Set to True when GitHub Pages is ready
-                    
-                    if use_github:
-                        webapp_url = f"https://{github_url}/miniapp/?user_id={user_id}"
-                    else:
-                        webapp_url = f"https://{replit_domain}/telegram-miniapp/index.html?user_id={user_id}"
-                    
-                    keyboard = create_webapp_button(webapp_url, "باز کردن مینی اپ حسین ایکس بات")
-                    
-                    # Send welcome message with Mini App button
-                    send_telegram_message(token, chat_id, welcome_message, keyboard)
-                    
-                    # Log the bot's response
-                    with app.app_context():
-                        bot_message = BotMessage(
-                            telegram_user_id=user_id,
-                            message_text=welcome_message + "\n[Mini App Button Added]",
-                            is_from_user=False
-                        )
-                        db.session.add(bot_message)
-                        db.session.commit()
-                
-                elif command == '/help':
-                    help_text = (
-                        "دستورات قابل استفاده:\n\n"
-                        "/start - شروع مجدد ربات\n"
-                        "/help - نمایش این پیام راهنما\n"
-                        "/about - درباره این ربات\n"
-                    )
-                    send_telegram_message(token, chat_id, help_text)
-                    
-                    # Log the bot's response
-                    with app.app_context():
-                        bot_message = BotMessage(
-                            telegram_user_id=user_id,
-                            message_text=help_text,
-                            is_from_user=False
-                        )
-                        db.session.add(bot_message)
-                        db.session.commit()
-                
-                elif command == '/about':
-                    about_text = (
-                        "🤖 حسین ایکس بات ۳\n\n"
-                        "یک ربات تلگرام ساخته شده با پایتون.\n"
-                        "توسعه داده شده برای سرگرمی و بازی."
-                    )
-                    send_telegram_message(token, chat_id, about_text)
-                    
-                    # Log the bot's response
-                    with app.app_context():
-                        bot_message = BotMessage(
-                            telegram_user_id=user_id,
-                            message_text=about_text,
-                            is_from_user=False
-                        )
-                        db.session.add(bot_message)
-                        db.session.commit()
-            
-            else:
-                # Echo back for regular messages
-                response = f"شما گفتید: {text}"
-                send_telegram_message(token, chat_id, response)
-                
-                # Log the bot's response
-                with app.app_context():
-                    bot_message = BotMessage(
-                        telegram_user_id=user_id,
-                        message_text=response,
-                        is_from_user=False
-                    )
-                    db.session.add(bot_message)
-                    db.session.commit()
+        router.dispatch(router.context(token, update, send_reply))
+    finally:
+        if 'update_id' in update:
+            update_tracker.done(update['update_id'])
+
+# Worker pool that runs handle_update with per-chat ordering
+update_dispatcher = UpdateDispatcher(handle_update, workers=Config.BOT_WORKERS, queue_size=Config.BOT_QUEUE_SIZE)
+
+# Queue depths are read at scrape time
+UPDATE_QUEUE_DEPTH.set_function(lambda: update_dispatcher.queue_depth() + async_engine.in_flight())
+SEND_QUEUE_DEPTH.set_function(lambda: send_scheduler.queue_depth() + async_engine.send_queue_depth())
+
+# Function to hand an update to the worker pool
+def enqueue_update(token, update, timeout=None):
+    """Queue an update for handle_update; shared by the poller and the webhook"""
+    # Redeliveries (poller restarts, webhook retries, mode switches) are dropped here
+    update_id = update.get('update_id')
+    update_tracker.ensure_loaded(token)
+    if update_id is not None and not update_tracker.accept(update_id):
+        return True
     
-    except Exception as e:
-        logger.error(f"Error handling update: {e}")
-        add_log("ERROR", f"Error handling update: {str(e)}")
+    if Config.BOT_ENGINE == 'asyncio':
+        async_engine.start(token, poll=False)
+        accepted = async_engine.submit(token, update, timeout=timeout)
+    else:
+        update_dispatcher.start()
+        accepted = update_dispatcher.submit(token, update, chat_id=get_chat_id(update), timeout=timeout)
+    
+    if not accepted and update_id is not None:
+        update_tracker.forget(update_id)
+    return accepted
 
-def start_bot(token):
+def start_bot(token, webhook_url=None):
     """Start the Telegram bot with the given token"""
-    global is_running, bot_thread
+    global is_running, bot_thread, bot_stop_event, current_token, current_webhook_url
     
     try:
         if is_running:
@@ -314,10 +354,37 @@ def start_bot(token):
         
         # Set bot as running
         is_running = True
+        current_token = token
+        current_webhook_url = webhook_url
         
-        # Start the bot in a separate thread
-        bot_thread = threading.Thread(target=simulate_bot_polling, args=(token,), daemon=True)
-        bot_thread.start()
+        use_asyncio = Config.BOT_ENGINE == 'asyncio'
+        
+        # Compile the canned replies before the first update arrives and
+        # follow settings changes made in any worker
+        reply_templates.reload()
+        watch_settings()
+        settings_cache.start_watcher()
+        
+        if Config.BOT_MODE == 'webhook':
+            # Telegram pushes updates to the webhook route; no poller needed
+            if use_asyncio:
+                async_engine.start(token, poll=False)
+            else:
+                update_dispatcher.start()
+            result = set_telegram_webhook(token, webhook_url)
+            if not result or not result.get('ok'):
+                raise RuntimeError(f"Could not register webhook at {webhook_url}")
+            add_log("INFO", f"Webhook registered at {webhook_url}")
+        else:
+            # getUpdates is rejected while a webhook is registered
+            delete_telegram_webhook(token)
+            if use_asyncio:
+                async_engine.start(token)
+            else:
+                update_dispatcher.start()
+                bot_stop_event = threading.Event()
+                bot_thread = threading.Thread(target=simulate_bot_polling, args=(token, bot_stop_event), daemon=True)
+                bot_thread.start()
         
         add_log("INFO", "Bot started successfully")
         return True
@@ -325,22 +392,39 @@ def start_bot(token):
         add_log("ERROR", f"Failed to start bot: {str(e)}")
         logger.error(f"Failed to start bot: {e}")
         is_running = False
+        if bot_stop_event is not None:
+            bot_stop_event.set()
         return False
 
-def stop_bot():
-    """Stop the bot if it's running"""
+def stop_bot(release_webhook=True):
+    """Stop the bot if it's running; ``release_webhook=False`` leaves the webhook to the next leader"""
     global is_running, bot_thread
     
     if is_running:
         try:
             # Stop the bot thread
             is_running = False
+            if bot_stop_event is not None:
+                bot_stop_event.set()
+            
+            if Config.BOT_MODE == 'webhook' and current_token and release_webhook:
+                delete_telegram_webhook(current_token)
             
             # Wait for thread to finish if it exists
             if bot_thread and bot_thread.is_alive():
                 bot_thread.join(timeout=2.0)
             
+            # Finish the updates that were already accepted
+            update_dispatcher.stop()
+            async_engine.stop()
+            send_scheduler.stop()
+            update_tracker.flush()
+            
             add_log("INFO", "Bot stopped")
+            
+            # Drain everything the handlers queued before the thread exited
+            persistence_queue.stop()
+            db_log_handler.flush()
             return True
         except Exception as e:
             add_log("ERROR", f"Error stopping bot: {str(e)}")
@@ -354,5 +438,13 @@ def get_bot_status():
     """Get the current status of the bot"""
     global is_running
     return {
-        "is_running": is_running
+        "is_running": is_running,
+        "engine": Config.BOT_ENGINE,
+        "queue_depth": update_dispatcher.queue_depth() + async_engine.in_flight(),
+        "reply_latency": reply_latency.stats(),
+        "updates": update_tracker.stats(),
+        "send_queue": send_scheduler.stats(),
+        "async_send_queue": async_engine.sender.stats() if async_engine.sender is not None else None,
+        "user_cache": user_cache.stats(),
+        "log_buffer": db_log_handler.stats()
     }
@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select, update
+
+from config import Config
+from lifecycle import db_now, get_lease, update_lease
+from rate_limiter import PRIORITY_BULK, send_scheduler
+from telegram_client import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+# BotLease row coordinating broadcasts across workers; its status holds the checkpoint
+LEASE_NAME = 'broadcast'
+
+# 403 descriptions meaning the user can no longer be messaged
+BLOCKED_MARKERS = ('bot was blocked', 'user is deactivated', 'bot was kicked', 'chat not found')
+
+
+def load_checkpoint():
+    """Return the stored broadcast checkpoint dict, or None"""
+    from app import db
+    from models import BotLease
+    lease = db.session.get(BotLease, LEASE_NAME)
+    if lease is not None and lease.status:
+        return json.loads(lease.status)
+    return None
+
+
+class BroadcastJob:
+    """Send one message to every active BotUser.
+
+    Users are streamed in keyset-paginated chunks ordered by ``BotUser.id``;
+    each chunk is sent concurrently through the rate-limited send scheduler
+    at bulk priority, users that blocked the bot are marked inactive and the
+    last finished id is checkpointed so a crashed job can be resumed.
+
+    The job holds the 'broadcast' BotLease row like the bot holds its own:
+    it is claimed with a compare-and-set, renewed every ``heartbeat``
+    seconds together with the checkpoint, and expires after ``ttl``
+    seconds without renewal. Any worker can cancel the job by clearing the
+    row's ``desired_running``.
+    """
+
+    def __init__(self, token, text, chunk_size=500, state=None, heartbeat=5.0, ttl=30.0):
+        self.token = token
+        self.text = text
+        self.chunk_size = chunk_size
+        self.heartbeat = heartbeat
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.state = state or {
+            "text": text,
+            "status": "running",
+            "last_id": 0,
+            "total": None,
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+        }
+        self._cancelled = threading.Event()
+        self._lost = False
+        self._thread = None
+        self._started = None
+        self._ended = None
+        self._sent_at_start = self.state["sent"]
+
+    def claim(self, expected_status=None):
+        """Take the broadcast lease if no broadcast holds it.
+
+        When resuming, ``expected_status`` is the checkpoint as read, so
+        only one of several workers resuming it at once wins.
+        """
+        from app import app, db
+        from models import BotLease
+
+        with app.app_context():
+            get_lease(db, BotLease, LEASE_NAME)
+            now = db_now(db)
+            condition = or_(BotLease.holder.is_(None), BotLease.expires_at.is_(None), BotLease.expires_at < now)
+            if expected_status is not None:
+                condition = condition & (BotLease.status == expected_status)
+            return update_lease(db, BotLease, {
+                "holder": self.owner,
+                "heartbeat_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl),
+                "desired_running": True,
+                "status": json.dumps(self.state),
+            }, condition, name=LEASE_NAME)
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def progress(self):
+        """Checkpoint state plus live throughput"""
+        progress = dict(self.state)
+        if self._started is not None:
+            elapsed = (self._ended or time.monotonic()) - self._started
+            progress["elapsed"] = round(elapsed, 1)
+            progress["throughput"] = round((self.state["sent"] - self._sent_at_start) / elapsed, 2) if elapsed else 0.0
+        return progress
+
+    def _checkpoint(self, db):
+        """Store progress and renew the lease; stops the job if it was cancelled or lost"""
+        from models import BotLease
+
+        now = db_now(db)
+        renewed = update_lease(db, BotLease, {
+            "heartbeat_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl),
+            "status": json.dumps(self.progress()),
+        }, (BotLease.holder == self.owner) & BotLease.desired_running.is_(True), name=LEASE_NAME)
+        if not renewed:
+            lease = db.session.get(BotLease, LEASE_NAME)
+            if lease.holder != self.owner:
+                # Expired and taken over; the new holder owns the checkpoint
+                logger.error("Broadcast lease lost, stopping this broadcast")
+                self._lost = True
+            self._cancelled.set()
+        return renewed
+
+    def _release(self, db):
+        from models import BotLease
+
+        update_lease(db, BotLease, {"holder": None, "desired_running": False, "status": json.dumps(self.progress())},
+                     BotLease.holder == self.owner, name=LEASE_NAME)
+
+    def _run(self):
+        from app import app, db
+        from models import BotUser
+
+        with app.app_context():
+            try:
+                if self.state["total"] is None:
+                    self.state["total"] = db.session.scalar(
+                        select(func.count(BotUser.id)).where(BotUser.is_active.is_(True)))
+                self._checkpoint(db)
+
+                while not self._cancelled.is_set():
+                    rows = db.session.execute(
+                        select(BotUser.id, BotUser.telegram_id)
+                        .where(BotUser.is_active.is_(True), BotUser.id > self.state["last_id"])
+                        .order_by(BotUser.id)
+                        .limit(self.chunk_size)
+                    ).all()
+                    db.session.rollback()  # do not hold a transaction open while sending
+                    if not rows:
+                        break
+
+                    self._send_chunk(db, BotUser, rows)
+                    self.state["last_id"] = rows[-1].id
+                    if not self._cancelled.is_set():
+                        self._checkpoint(db)
+
+                if not self._lost:
+                    self.state["status"] = "cancelled" if self._cancelled.is_set() else "finished"
+                    self.state["finished_at"] = datetime.utcnow().isoformat()
+                    self._ended = time.monotonic()
+                    self._release(db)
+            except Exception as e:
+                # The checkpoint stays "running" so the job can be resumed
+                logger.error(f"Broadcast failed: {e}")
+                db.session.rollback()
+                try:
+                    # Free the lease so the resume does not have to wait for it to expire
+                    self._release(db)
+                except Exception as release_error:
+                    logger.error(f"Error releasing broadcast lease: {release_error}")
+                    db.session.rollback()
+            finally:
+                self._ended = self._ended or time.monotonic()
+
+    def _send_chunk(self, db, BotUser, rows):
+        from persistence import persistence_queue
+        from user_cache import user_cache
+
+        jobs = {}
+        for row in rows:
+            params = {"chat_id": row.telegram_id, "text": self.text, "parse_mode": "HTML"}
+            jobs[send_scheduler.submit(self.token, params, PRIORITY_BULK).future] = row
+
+        # Renew the lease and look for a cancel while the scheduler works through the chunk
+        pending, stalled = set(jobs), False
+        progressed_at = time.monotonic()
+        while pending:
+            done, pending = wait(pending, timeout=self.heartbeat)
+            if not pending:
+                break
+            if done:
+                progressed_at = time.monotonic()
+            stalled = time.monotonic() - progressed_at > Config.SEND_WAIT_TIMEOUT
+            if stalled or not self._checkpoint(db):
+                # Jobs still queued are dropped rather than sent after the broadcast ended
+                for future in pending:
+                    future.cancel()
+                break
+
+        blocked = []
+        for future, row in jobs.items():
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                self.state["sent"] += 1
+                persistence_queue.add_message(row.telegram_id, self.text, False)
+            elif isinstance(error, TelegramAPIError) and error.status_code in (400, 403) and \
+                    any(marker in (error.description or '').lower() for marker in BLOCKED_MARKERS):
+                self.state["blocked"] += 1
+                blocked.append(row)
+            else:
+                self.state["failed"] += 1
+
+        if blocked:
+            db.session.execute(update(BotUser), [{"id": row.id, "is_active": False} for row in blocked])
+            db.session.commit()
+            for row in blocked:
+                user_cache.invalidate(row.telegram_id)
+
+        if stalled:
+            raise RuntimeError(f"send scheduler made no progress for {Config.SEND_WAIT_TIMEOUT:g}s")
+
+
+# The broadcast started by this process, if any
+current_broadcast = None
+
+
+def new_job(token, text, state=None):
+    return BroadcastJob(token, text, chunk_size=Config.BROADCAST_CHUNK_SIZE, state=state,
+                        heartbeat=Config.BROADCAST_HEARTBEAT, ttl=Config.BROADCAST_LEASE_TTL)
+
+
+def start_broadcast(token, text):
+    """Start a new broadcast; returns False if one is already running in any worker"""
+    global current_broadcast
+    job = new_job(token, text)
+    if not job.claim():
+        return False
+    current_broadcast = job
+    job.start()
+    return True
+
+
+def resume_broadcast(token):
+    """Resume the checkpointed broadcast left unfinished by a crash"""
+    global current_broadcast
+    from app import app, db
+    from models import BotLease
+
+    with app.app_context():
+        raw = get_lease(db, BotLease, LEASE_NAME).status
+        state = json.loads(raw) if raw else None
+    if not state or state.get("status") != "running":
+        return False
+    # claim() fails while the broadcast is still running in some worker
+    job = new_job(token, state["text"], state=state)
+    if not job.claim(expected_status=raw):
+        return False
+    current_broadcast = job
+    job.start()
+    return True
+
+
+def cancel_broadcast():
+    """Cancel the running broadcast, whichever worker runs it"""
+    from app import app, db
+    from models import BotLease
+
+    local = current_broadcast is not None and current_broadcast.is_alive()
+    if local:
+        current_broadcast.cancel()
+    with app.app_context():
+        get_lease(db, BotLease, LEASE_NAME)
+        now = db_now(db)
+        # The holder notices at its next heartbeat
+        requested = update_lease(db, BotLease, {"desired_running": False},
+                                 BotLease.holder.isnot(None) & (BotLease.expires_at > now)
+                                 & BotLease.desired_running.is_(True), name=LEASE_NAME)
+    return local or requested
+
+
+def get_broadcast_status():
+    """Progress of the broadcast running here, else the checkpoint its holder last stored"""
+    if current_broadcast is not None and current_broadcast.is_alive():
+        progress = current_broadcast.progress()
+        progress["active"] = True
+        return progress
+
+    from app import app, db
+    from models import BotLease
+
+    with app.app_context():
+        lease = db.session.get(BotLease, LEASE_NAME)
+        state = load_checkpoint()
+        if state:
+            state["active"] = bool(lease and lease.holder and lease.expires_at and lease.expires_at > db_now(db))
+    return state
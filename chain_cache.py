@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ChainCache:
+    """TTL cache of chain reads (chain id, gas price, block number, balances).
+
+    Each value is stored under ``(name, key)`` with its own TTL; a TTL of
+    None keeps it until it is invalidated. Values read with ``refresh=True``
+    are also reloaded by a background thread shortly before they expire, as
+    long as they were read within the last ``idle_after`` seconds, so hot
+    readers keep hitting the cache without polling the node when idle.
+    Hits and misses are counted per name.
+    """
+
+    def __init__(self, max_entries=10000, idle_after=60.0):
+        self.max_entries = max_entries
+        self.idle_after = idle_after
+        self._entries = OrderedDict()   # (name, key) -> (value, expires_at)
+        self._refreshers = {}           # (name, key) -> (loader, ttl, last read)
+        self._stats = {}                # name -> [hits, misses]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+
+    def get(self, name, loader, ttl=None, key=None, refresh=False):
+        """Cached value of ``(name, key)``, calling ``loader()`` on a miss"""
+        now = time.monotonic()
+        entry_key = (name, key)
+        with self._lock:
+            counts = self._stats.setdefault(name, [0, 0])
+            entry = self._entries.get(entry_key)
+            if refresh and entry_key in self._refreshers:
+                self._refreshers[entry_key] = self._refreshers[entry_key][:2] + (now,)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(entry_key)
+                counts[0] += 1
+                return entry[0]
+            counts[1] += 1
+
+        value = loader()
+        self._store(entry_key, value, ttl)
+        if refresh and ttl:
+            with self._lock:
+                self._refreshers[entry_key] = (loader, ttl, now)
+            self._ensure_refresher()
+            self._wakeup.set()
+        return value
+
+    def invalidate(self, name, key=None):
+        with self._lock:
+            self._entries.pop((name, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for name, (hits, misses) in self._stats.items():
+                lookups = hits + misses
+                stats[name] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                }
+            return {"entries": len(self._entries), "refreshes": self.refreshes, "names": stats}
+
+    def _store(self, entry_key, value, ttl):
+        with self._lock:
+            self._entries[entry_key] = (value, None if ttl is None else time.monotonic() + ttl)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Background refresh
+
+    def _ensure_refresher(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="chain-cache-refresh", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                due, wait = [], None
+                for entry_key, (loader, ttl, read_at) in list(self._refreshers.items()):
+                    if now - read_at > self.idle_after:
+                        # Nobody reads it any more; the next read loads it again
+                        del self._refreshers[entry_key]
+                        continue
+                    entry = self._entries.get(entry_key)
+                    # Reload once 80% of the TTL has passed
+                    refresh_at = now if entry is None else entry[1] - ttl * 0.2
+                    if refresh_at <= now:
+                        due.append((entry_key, loader, ttl))
+                    else:
+                        wait = refresh_at - now if wait is None else min(wait, refresh_at - now)
+
+            for entry_key, loader, ttl in due:
+                try:
+                    self._store(entry_key, loader(), ttl)
+                    self.refreshes += 1
+                    next_in = ttl * 0.8
+                except Exception as e:
+                    logger.warning(f"Error refreshing cached {entry_key[0]}: {e}")
+                    next_in = ttl * 0.2
+                wait = next_in if wait is None else min(wait, next_in)
+
+            self._wakeup.wait(self.idle_after if wait is None else wait)
+            self._wakeup.clear()
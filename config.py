@@ -16,3 +16,115 @@ class Config:
     
     # Database settings
     DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///bot.db')
+    
+    # Write-behind persistence settings
+    PERSISTENCE_BATCH_SIZE = int(os.environ.get('PERSISTENCE_BATCH_SIZE', '100'))
+    PERSISTENCE_FLUSH_INTERVAL_MS = int(os.environ.get('PERSISTENCE_FLUSH_INTERVAL_MS', '500'))
+    PERSISTENCE_MAX_RETRIES = int(os.environ.get('PERSISTENCE_MAX_RETRIES', '5'))
+    
+    # Known-user cache settings
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '300'))
+    
+    # Update dispatcher settings
+    BOT_WORKERS = int(os.environ.get('BOT_WORKERS', '4'))
+    BOT_QUEUE_SIZE = int(os.environ.get('BOT_QUEUE_SIZE', '100'))
+    
+    # Long polling settings
+    POLL_TIMEOUT = int(os.environ.get('POLL_TIMEOUT', '30'))
+    POLL_LIMIT = int(os.environ.get('POLL_LIMIT', '100'))
+    POLL_ALLOWED_UPDATES = os.environ.get('POLL_ALLOWED_UPDATES', 'message,callback_query').split(',')
+    POLL_BACKOFF_BASE = float(os.environ.get('POLL_BACKOFF_BASE', '1.0'))
+    POLL_BACKOFF_MAX = float(os.environ.get('POLL_BACKOFF_MAX', '60.0'))
+    
+    # Telegram Bot API client settings
+    TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+    TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', '5'))
+    TELEGRAM_READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', '15'))
+    TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', '3'))
+    
+    # Update ingestion: 'polling' (getUpdates) or 'webhook'
+    BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+    WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+    WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+    
+    # Bot engine: 'threaded' (worker pool) or 'asyncio' (requires aiohttp)
+    BOT_ENGINE = os.environ.get('BOT_ENGINE', 'threaded')
+    ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', '1000'))
+    
+    # Outbound rate limits (Telegram allows ~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group)
+    RATE_LIMIT_GLOBAL = float(os.environ.get('RATE_LIMIT_GLOBAL', '30'))
+    RATE_LIMIT_PER_CHAT = float(os.environ.get('RATE_LIMIT_PER_CHAT', '1'))
+    RATE_LIMIT_GROUP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_GROUP_PER_MINUTE', '20'))
+    RATE_LIMIT_CHAT_BURST = int(os.environ.get('RATE_LIMIT_CHAT_BURST', '3'))
+    SEND_WORKERS = int(os.environ.get('SEND_WORKERS', '8'))
+    SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', '5'))
+    SEND_WAIT_TIMEOUT = float(os.environ.get('SEND_WAIT_TIMEOUT', '60'))
+    
+    # Broadcast settings
+    BROADCAST_CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', '500'))
+    BROADCAST_HEARTBEAT = float(os.environ.get('BROADCAST_HEARTBEAT', '5'))
+    BROADCAST_LEASE_TTL = float(os.environ.get('BROADCAST_LEASE_TTL', '30'))
+    
+    # Buffered BotLog handler settings
+    LOG_BUFFER_CAPACITY = int(os.environ.get('LOG_BUFFER_CAPACITY', '10000'))
+    LOG_FLUSH_INTERVAL_MS = int(os.environ.get('LOG_FLUSH_INTERVAL_MS', '1000'))
+    LOG_FLUSH_MAX_RETRIES = int(os.environ.get('LOG_FLUSH_MAX_RETRIES', '5'))
+    
+    # Retention, rollup and archival settings (0 days keeps rows forever)
+    RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'False') == 'True'
+    RETENTION_LOG_DAYS = int(os.environ.get('RETENTION_LOG_DAYS', '30'))
+    RETENTION_MESSAGE_DAYS = int(os.environ.get('RETENTION_MESSAGE_DAYS', '90'))
+    RETENTION_CHUNK_SIZE = int(os.environ.get('RETENTION_CHUNK_SIZE', '1000'))
+    RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', '3600'))
+    RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', '')
+    # Rows younger than this are left for the next rollup (writers may still commit lower ids)
+    RETENTION_SETTLE_SECONDS = int(os.environ.get('RETENTION_SETTLE_SECONDS', '600'))
+    
+    # Dashboard statistics settings
+    STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', '5'))
+    STATS_PERSIST_INTERVAL = float(os.environ.get('STATS_PERSIST_INTERVAL', '60'))
+    
+    # Metrics endpoint settings (/metrics is disabled while the token is empty)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    
+    # Settings cache: seconds between checks of the settings version stamp
+    SETTINGS_CHECK_INTERVAL = float(os.environ.get('SETTINGS_CHECK_INTERVAL', '2'))
+    
+    # Bot lease settings (one worker process runs the bot)
+    BOT_LEASE_TTL = float(os.environ.get('BOT_LEASE_TTL', '20'))
+    BOT_LEASE_HEARTBEAT = float(os.environ.get('BOT_LEASE_HEARTBEAT', '5'))
+    
+    # Update deduplication settings
+    UPDATE_DEDUP_WINDOW = int(os.environ.get('UPDATE_DEDUP_WINDOW', '10000'))
+    UPDATE_OFFSET_FLUSH_INTERVAL = float(os.environ.get('UPDATE_OFFSET_FLUSH_INTERVAL', '1.0'))
+    
+    # BNB blockchain RPC settings
+    BLOCKCHAIN_RPC_TIMEOUT = float(os.environ.get('BLOCKCHAIN_RPC_TIMEOUT', '10'))
+    BLOCKCHAIN_RPC_POOL_SIZE = int(os.environ.get('BLOCKCHAIN_RPC_POOL_SIZE', '10'))
+    BLOCKCHAIN_HEALTH_INTERVAL = float(os.environ.get('BLOCKCHAIN_HEALTH_INTERVAL', '30'))
+    # Comma-separated RPC URLs; empty uses the built-in BNB testnet list
+    BLOCKCHAIN_RPC_URLS = [url for url in os.environ.get('BLOCKCHAIN_RPC_URLS', '').split(',') if url]
+    BLOCKCHAIN_HEDGE_DELAY = float(os.environ.get('BLOCKCHAIN_HEDGE_DELAY', '0.3'))
+    BLOCKCHAIN_EJECT_FAILURES = int(os.environ.get('BLOCKCHAIN_EJECT_FAILURES', '3'))
+    BLOCKCHAIN_EJECT_SECONDS = float(os.environ.get('BLOCKCHAIN_EJECT_SECONDS', '30'))
+    BLOCKCHAIN_MAX_BLOCK_LAG = int(os.environ.get('BLOCKCHAIN_MAX_BLOCK_LAG', '5'))
+    
+    # BNB chain read cache TTLs (seconds); the chain id is cached for good
+    BLOCKCHAIN_GAS_PRICE_TTL = float(os.environ.get('BLOCKCHAIN_GAS_PRICE_TTL', '10'))
+    BLOCKCHAIN_BLOCK_NUMBER_TTL = float(os.environ.get('BLOCKCHAIN_BLOCK_NUMBER_TTL', '3'))
+    BLOCKCHAIN_BALANCE_TTL = float(os.environ.get('BLOCKCHAIN_BALANCE_TTL', '15'))
+    
+    # BNB transaction receipt tracking (seconds)
+    BLOCKCHAIN_RECEIPT_POLL_INTERVAL = float(os.environ.get('BLOCKCHAIN_RECEIPT_POLL_INTERVAL', '1'))
+    BLOCKCHAIN_RECEIPT_TIMEOUT = float(os.environ.get('BLOCKCHAIN_RECEIPT_TIMEOUT', '120'))
+    
+    # BNB record batching: one transaction anchors each batch's Merkle root
+    BLOCKCHAIN_DEMO_MODE = os.environ.get('BLOCKCHAIN_DEMO_MODE', 'True') == 'True'
+    # Off by default: when on, send_transaction_to_blockchain returns a queued record_id, not a tx_hash
+    BLOCKCHAIN_BATCHING = os.environ.get('BLOCKCHAIN_BATCHING', 'False') == 'True'
+    BLOCKCHAIN_BATCH_WINDOW = float(os.environ.get('BLOCKCHAIN_BATCH_WINDOW', '10'))
+    BLOCKCHAIN_BATCH_MAX_RECORDS = int(os.environ.get('BLOCKCHAIN_BATCH_MAX_RECORDS', '500'))
+    BLOCKCHAIN_BATCH_DIR = os.environ.get('BLOCKCHAIN_BATCH_DIR', 'blockchain_batches')
+    BLOCKCHAIN_BATCH_MAX_RETRIES = int(os.environ.get('BLOCKCHAIN_BATCH_MAX_RETRIES', '3'))
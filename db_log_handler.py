@@ -0,0 +1,207 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from config import Config
+from metrics import DB_FLUSH_ROWS, DB_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseLogHandler(logging.Handler):
+    """Logging handler that writes records to BotLog without blocking the caller.
+
+    ``emit`` only appends to an in-memory ring buffer; a background thread
+    flushes it with multi-row inserts. When the buffer passes its high-water
+    mark only every ``sample_rate``-th DEBUG/INFO record is kept, and when it
+    is full DEBUG/INFO records are dropped while WARNING and above evict the
+    oldest low-level record. A batch that fails to commit goes back to the
+    front of the buffer, within the same limits, and is retried with
+    exponential backoff; only after ``max_retries`` consecutive failures
+    are its records dropped. Every dropped record is counted.
+    """
+
+    def __init__(self, capacity=10000, flush_interval_ms=1000, batch_size=500,
+                 high_water=0.75, sample_rate=10, max_retries=5, level=logging.NOTSET):
+        super().__init__(level)
+        self.capacity = capacity
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.high_water = int(capacity * high_water)
+        self.sample_rate = max(1, sample_rate)
+        self.max_retries = max_retries
+
+        self._low = deque()
+        self._high = deque()
+        self._buffer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._sampled = 0
+        self._failures = 0          # consecutive failed flushes
+        self._retry_at = 0.0
+
+        self.dropped = 0
+        self.written = 0
+        self.failed_flushes = 0
+
+    def emit(self, record):
+        try:
+            row = {
+                "level": record.levelname,
+                "message": record.getMessage(),
+                "timestamp": datetime.utcfromtimestamp(record.created),
+            }
+            is_high = record.levelno >= logging.WARNING
+
+            with self._buffer_lock:
+                size = len(self._low) + len(self._high)
+                if not is_high and size >= self.high_water:
+                    self._sampled += 1
+                    if size >= self.capacity or self._sampled % self.sample_rate:
+                        self.dropped += 1
+                        return
+                if size >= self.capacity:
+                    # Make room for the important record at the expense of chatter
+                    (self._low or self._high).popleft()
+                    self.dropped += 1
+                (self._high if is_high else self._low).append(row)
+                size += 1
+
+            self._ensure_started()
+            if size >= self.batch_size:
+                self._wakeup.set()
+        except Exception:
+            # Logging must never break message handling
+            self.dropped += 1
+
+    def flush(self, force=True):
+        """Write everything buffered so far; returns the number of records written.
+
+        Without ``force`` nothing is written while a failed batch waits for
+        its retry.
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                if not force and time.monotonic() < self._retry_at:
+                    return 0
+                high, low = list(self._high), list(self._low)
+                self._high.clear()
+                self._low.clear()
+            if not (high or low):
+                return 0
+
+            rows = sorted(high + low, key=lambda row: row["timestamp"])
+            from app import app, db
+            from models import BotLog
+
+            started = time.perf_counter()
+            try:
+                with app.app_context():
+                    for start in range(0, len(rows), self.batch_size):
+                        db.session.execute(insert(BotLog), rows[start:start + self.batch_size])
+                    db.session.commit()
+            except Exception as e:
+                self.failed_flushes += 1
+                DB_FLUSH_SECONDS.labels('bot_log', 'error').observe(time.perf_counter() - started)
+                self._requeue(high, low, e)
+                return 0
+            with self._buffer_lock:
+                self._failures, self._retry_at = 0, 0.0
+            self.written += len(rows)
+            DB_FLUSH_SECONDS.labels('bot_log', 'ok').observe(time.perf_counter() - started)
+            DB_FLUSH_ROWS.labels('bot_log').inc(len(rows))
+            return len(rows)
+
+    def close(self, timeout=5.0):
+        self._stop_thread()
+        # Retry a failing batch until it is written, dropped or time runs out
+        deadline = time.monotonic() + timeout
+        while self._buffered() and time.monotonic() < deadline:
+            if not self.flush():
+                time.sleep(min(self._backoff(), max(0.0, deadline - time.monotonic())))
+        super().close()
+
+    def stats(self):
+        buffered = self._buffered()
+        return {
+            "buffered": buffered,
+            "capacity": self.capacity,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+    def _buffered(self):
+        with self._buffer_lock:
+            return len(self._low) + len(self._high)
+
+    def _requeue(self, high, low, error):
+        """Put a failed batch back in front of the records buffered since, or drop it after max_retries"""
+        # Goes to the module logger, which is not attached to this handler
+        with self._buffer_lock:
+            self._failures += 1
+            if self._failures > self.max_retries:
+                self._failures, self._retry_at = 0, 0.0
+                self.dropped += len(high) + len(low)
+                logger.error(f"Dropping {len(high) + len(low)} log records after "
+                             f"{self.max_retries} failed retries: {error}")
+                return
+
+            # Same limits as emit: WARNING and above up to the capacity,
+            # DEBUG/INFO only below the high-water mark; the oldest go first
+            size = len(self._low) + len(self._high)
+            keep_high = min(len(high), max(0, self.capacity - size))
+            keep_low = min(len(low), max(0, self.high_water - size - keep_high))
+            self.dropped += len(high) - keep_high + len(low) - keep_low
+            self._high.extendleft(reversed(high[len(high) - keep_high:]))
+            self._low.extendleft(reversed(low[len(low) - keep_low:]))
+            self._retry_at = time.monotonic() + self._backoff()
+            logger.error(f"Error writing {len(high) + len(low)} log records "
+                         f"(attempt {self._failures}, retrying): {error}")
+
+    def _backoff(self):
+        return self.flush_interval * (2 ** max(0, self._failures - 1))
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="db-log-flusher", daemon=True)
+                    self._thread.start()
+
+    def _stop_thread(self):
+        thread, self._thread = self._thread, None
+        if thread and thread.is_alive():
+            self._wakeup.set()
+            thread.join(timeout=5.0)
+
+    def _run(self):
+        current = threading.current_thread()
+        while self._thread is current:
+            # A failed batch is backing off; new records wait with it
+            retry_in = self._retry_at - time.monotonic()
+            self._wakeup.wait(timeout=retry_in if retry_in > 0 else self.flush_interval)
+            self._wakeup.clear()
+            self.flush(force=False)
+
+
+db_log_handler = DatabaseLogHandler(
+    capacity=Config.LOG_BUFFER_CAPACITY,
+    flush_interval_ms=Config.LOG_FLUSH_INTERVAL_MS,
+    max_retries=Config.LOG_FLUSH_MAX_RETRIES,
+)
+
+# Records sent here end up in the BotLog table (see bot.add_log)
+bot_logger = logging.getLogger('hosseinx.botlog')
+bot_logger.setLevel(logging.DEBUG)
+bot_logger.propagate = False
+bot_logger.addHandler(db_log_handler)
+
+atexit.register(db_log_handler.close)
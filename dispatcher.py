@@ -0,0 +1,108 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling a worker to exit once its queue is drained
+_STOP = object()
+
+
+def get_chat_id(update):
+    """Return the chat an update belongs to, or None if it has no chat"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in update:
+            return update[key].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        message = update['callback_query'].get('message') or {}
+        chat_id = message.get('chat', {}).get('id')
+        if chat_id is None:
+            chat_id = update['callback_query'].get('from', {}).get('id')
+        return chat_id
+    return None
+
+
+class UpdateDispatcher:
+    """Fan updates out to a pool of worker threads.
+
+    Every chat is pinned to one worker (``chat_id % workers``), so updates of
+    the same chat are handled in order while different chats run in
+    parallel. Worker queues are bounded: ``submit`` blocks when the target
+    queue is full, which applies back-pressure to the poller.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=100):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queues = []
+        self._threads = []
+        self._running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+            self._threads = []
+            for index, worker_queue in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(worker_queue,),
+                                          name=f"update-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=10.0):
+        """Let the workers finish every accepted update, then stop them"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            queues, threads = self._queues, self._threads
+
+        for worker_queue in queues:
+            worker_queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def submit(self, *args, chat_id=None, timeout=None):
+        """Queue a call to the handler for the given chat.
+
+        Blocks while the worker queue is full. Returns True once the update
+        was accepted, False if the dispatcher stopped or ``timeout`` expired.
+        """
+        if not self._running:
+            return False
+
+        worker_queue = self._queues[hash(chat_id) % self.workers]
+        waited = 0.0
+        while self._running:
+            try:
+                worker_queue.put(args, timeout=0.5)
+                return True
+            except queue.Full:
+                waited += 0.5
+                if timeout is not None and waited >= timeout:
+                    return False
+        return False
+
+    def queue_depth(self):
+        """Number of updates waiting in all worker queues"""
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def is_running(self):
+        return self._running
+
+    def _work(self, worker_queue):
+        while True:
+            item = worker_queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(*item)
+            except Exception as e:
+                logger.error(f"Error in update worker: {e}")
+            finally:
+                worker_queue.task_done()
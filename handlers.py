@@ -0,0 +1,116 @@
+import logging
+import time
+
+from metrics import UPDATE_HANDLING_SECONDS, UPDATES_TOTAL
+from persistence import persistence_queue
+from reply_templates import reply_templates
+from router import callback_answer, message_reply, router
+from stats import stats_service
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+# Update kinds whose message date is the time the user sent it
+MESSAGE_KINDS = ('command', 'text', 'web_app_data')
+
+
+# Middleware, outermost first
+
+@router.middleware
+def metrics_middleware(ctx, call_next):
+    """Handling time by command, outcome counters and dashboard stats"""
+    try:
+        call_next(ctx)
+    finally:
+        duration = time.perf_counter() - ctx.started
+        UPDATE_HANDLING_SECONDS.labels(ctx.label).observe(duration)
+        UPDATES_TOTAL.labels(ctx.label, 'error' if ctx.failed else 'ok').inc()
+        if ctx.user_id is not None:
+            stats_service.record_update(ctx.user_id, duration, ctx.failed)
+        if not ctx.deferred_sends:
+            record_reply_latency(ctx)
+
+
+def record_reply_latency(ctx):
+    """Time from a message being sent to its reply going out"""
+    if ctx.replies and ctx.kind in MESSAGE_KINDS and 'date' in ctx.message:
+        from bot import reply_latency
+        reply_latency.record(ctx.message['date'])
+
+
+@router.middleware
+def error_middleware(ctx, call_next):
+    """A failing handler is logged and counted instead of killing the worker"""
+    try:
+        call_next(ctx)
+    except Exception as e:
+        from bot import add_log
+        ctx.failed = True
+        logger.error(f"Error handling update: {e}")
+        add_log("ERROR", f"Error handling update: {str(e)}")
+
+
+@router.middleware
+def persistence_middleware(ctx, call_next):
+    """Queue the sender, the incoming message and the bot's replies for the database"""
+    if ctx.user_id is not None and ctx.text is not None:
+        record_incoming_message(ctx)
+    call_next(ctx)
+    for reply in ctx.replies:
+        if reply.log_text:
+            persistence_queue.add_message(ctx.user_id, reply.log_text, False)
+
+
+def record_incoming_message(ctx):
+    """Queue the sender upsert and the message itself for persistence"""
+    username = ctx.user.get('username', '')
+    first_name = ctx.user.get('first_name', '')
+    last_name = ctx.user.get('last_name', '')
+
+    # Known users with unchanged profiles need no database work
+    cached_user = user_cache.get(ctx.user_id)
+    if cached_user is None or (cached_user.username, cached_user.first_name, cached_user.last_name) != (username, first_name, last_name):
+        persistence_queue.upsert_user(ctx.user_id, username, first_name, last_name)
+
+    if ctx.kind in ('command', 'text'):
+        text = ctx.text
+    else:
+        text = f"[{ctx.kind}] {ctx.text}"
+    persistence_queue.add_message(ctx.user_id, text, True)
+
+
+# Commands
+
+@router.command('/start')
+def start_command(ctx):
+    # Welcome message with Mini App button; only the name and user id vary per user
+    text, keyboard, log_text = reply_templates.get().start(ctx.user_id, ctx.user.get('first_name', ''))
+    return message_reply(ctx.chat_id, text, keyboard, log_text)
+
+
+@router.command('/help')
+def help_command(ctx):
+    return message_reply(ctx.chat_id, reply_templates.get().help_text)
+
+
+@router.command('/about')
+def about_command(ctx):
+    return message_reply(ctx.chat_id, reply_templates.get().about_text)
+
+
+# Other update kinds (unknown commands get no reply)
+
+@router.on('text')
+def echo(ctx):
+    return message_reply(ctx.chat_id, f"شما گفتید: {ctx.text}")
+
+
+@router.on('web_app_data')
+def web_app_data(ctx):
+    return message_reply(ctx.chat_id, "✅ اطلاعات مینی اپ دریافت شد.")
+
+
+@router.on('callback_query')
+def callback_query(ctx):
+    # Buttons without a registered prefix still need an answer, or Telegram keeps spinning
+    return callback_answer(ctx.update['callback_query']['id'])
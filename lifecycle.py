@@ -0,0 +1,237 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# BotLease row that decides which worker runs the bot
+LEASE_NAME = 'bot'
+
+
+def db_now(db):
+    """Current UTC time by the database clock, which every worker shares"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.scalar(select(func.timezone('UTC', func.now())))
+    now = db.session.scalar(select(func.current_timestamp()))
+    return datetime.fromisoformat(now) if isinstance(now, str) else now
+
+
+def get_lease(db, BotLease, name=LEASE_NAME):
+    """The lease row called ``name``, created on first use"""
+    lease = db.session.get(BotLease, name)
+    if lease is None:
+        try:
+            db.session.add(BotLease(name=name, desired_running=False))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        lease = db.session.get(BotLease, name)
+    return lease
+
+
+def update_lease(db, BotLease, values, condition, name=LEASE_NAME):
+    """Compare-and-set on a lease row; True if this worker's update won"""
+    updated = db.session.execute(
+        update(BotLease).where(BotLease.name == name, condition).values(**values)
+    ).rowcount
+    db.session.commit()
+    return bool(updated)
+
+
+class BotSupervisor:
+    """Runs the bot in exactly one worker process, chosen through a DB-row lease.
+
+    The BotLease row records whether the bot should run (``desired_running``)
+    and which worker holds the lease. Every worker ticks every ``heartbeat``
+    seconds: the holder renews the lease and publishes its status, and while
+    the bot should run, any worker may take over a lease that was released
+    or not renewed within ``ttl`` seconds. Lease times come from the
+    database clock. A holder that has not renewed for ``ttl`` seconds (the
+    database is down, say) stops its bot before another worker can take
+    over. Start, stop and status only touch the row, so they work from
+    whichever worker serves the request.
+    """
+
+    def __init__(self, ttl=20.0, heartbeat=5.0):
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.worker_id = None
+        self._tick_lock = threading.Lock()
+        self._thread = None
+        self._watchdog = None
+        self._pid = None
+        self._renewed_at = None     # monotonic time of the last renewal that started before it won
+
+    # Control, from any worker
+
+    def ensure_started(self):
+        """Start this worker's heartbeat thread (again after a fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._tick_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+            self._renewed_at = None
+            self._thread = threading.Thread(target=self._run, name="bot-supervisor", daemon=True)
+            self._thread.start()
+            self._watchdog = threading.Thread(target=self._watch, name="bot-lease-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def request_start(self, webhook_url=None):
+        """Ask for the bot to run; this worker takes the lease if it is free"""
+        self.ensure_started()
+        self._set_desired(True, webhook_url)
+        self.tick()
+        return self.status()
+
+    def request_stop(self):
+        """Ask for the bot to stop; the leader stops it with its next heartbeat"""
+        self.ensure_started()
+        self._set_desired(False)
+        return self.status()
+
+    def status(self):
+        """Cluster-wide bot status, published by the leader with every heartbeat"""
+        from app import app, db
+        from models import BotLease
+
+        with app.app_context():
+            lease = db.session.get(BotLease, LEASE_NAME)
+            now = db_now(db)
+            live = lease is not None and lease.holder is not None and lease.expires_at is not None and lease.expires_at > now
+            status = json.loads(lease.status) if live and lease.status else {}
+            status.update({
+                "is_running": bool(live and lease.desired_running and status.get("is_running")),
+                "desired_running": bool(lease and lease.desired_running),
+                "leader": lease.holder if live else None,
+                "leader_heartbeat": lease.heartbeat_at.isoformat() if live and lease.heartbeat_at else None,
+                "is_leader": bool(live and lease.holder == self.worker_id),
+                "worker": self.worker_id,
+            })
+        return status
+
+    # Heartbeat
+
+    def tick(self):
+        """Renew, take over or give up the lease and start/stop the local bot to match"""
+        import bot
+        from app import app, db
+        from models import BotLease
+
+        with self._tick_lock, app.app_context():
+            lease = get_lease(db, BotLease)
+            desired, holder, webhook_url = lease.desired_running, lease.holder, lease.webhook_url
+            # Taken before the database clock, so the local deadline is never later than expires_at
+            renewing_at = time.monotonic()
+            now = db_now(db)
+            values = {"holder": self.worker_id, "heartbeat_at": now, "expires_at": now + timedelta(seconds=self.ttl)}
+
+            if desired and holder == self.worker_id:
+                values["status"] = json.dumps(bot.get_bot_status())
+                leading = update_lease(db, BotLease, values, BotLease.holder == self.worker_id)
+                if leading:
+                    self._renewed_at = renewing_at
+                if leading and not bot.is_running:
+                    # The bot crashed or was stopped locally; start it again
+                    leading = self._start_local(db, BotLease, webhook_url)
+            elif desired:
+                free = or_(BotLease.holder.is_(None), BotLease.expires_at.is_(None), BotLease.expires_at < now)
+                leading = update_lease(db, BotLease, values, free)
+                if leading:
+                    self._renewed_at = renewing_at
+                    leading = self._start_local(db, BotLease, webhook_url)
+            else:
+                leading = False
+                if holder == self.worker_id:
+                    update_lease(db, BotLease, {"holder": None, "status": None}, BotLease.holder == self.worker_id)
+
+            if not leading and bot.is_running:
+                # Stopped from another worker, or the lease was lost to one; in
+                # the latter case the new leader owns the webhook now
+                bot.stop_bot(release_webhook=not desired)
+
+    def shutdown(self):
+        """Stop the local bot and hand the lease over right away"""
+        import bot
+        from app import app, db
+        from models import BotLease
+
+        if self._pid != os.getpid():
+            return
+        try:
+            if bot.is_running:
+                bot.stop_bot(release_webhook=False)
+            with app.app_context():
+                update_lease(db, BotLease, {"holder": None, "status": None}, BotLease.holder == self.worker_id)
+        except Exception as e:
+            logger.error(f"Error releasing bot lease: {e}")
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Bot supervisor heartbeat failed: {e}")
+            time.sleep(self.heartbeat)
+
+    def _watch(self):
+        # Separate from _run so a tick stuck on an unreachable database cannot delay it
+        import bot
+
+        while True:
+            time.sleep(min(1.0, self.heartbeat))
+            if bot.is_running and self.lease_expired():
+                logger.error("Bot lease not renewed within its TTL, stopping the local bot")
+                try:
+                    bot.stop_bot(release_webhook=False)
+                except Exception as e:
+                    logger.error(f"Error stopping bot after losing the lease: {e}")
+
+    def lease_expired(self):
+        """True once ``ttl`` seconds have passed since this worker last renewed the lease"""
+        renewed_at = self._renewed_at
+        return renewed_at is None or time.monotonic() >= renewed_at + self.ttl
+
+    def _start_local(self, db, BotLease, webhook_url):
+        import bot
+        from settings_cache import settings_cache
+
+        token = settings_cache.get('telegram_token')
+        if token and bot.start_bot(token, webhook_url):
+            update_lease(db, BotLease, {"status": json.dumps(bot.get_bot_status())}, BotLease.holder == self.worker_id)
+            return True
+
+        # Do not let every worker retry a start that cannot work
+        bot.add_log("ERROR", "Bot could not be started" + ("" if token else ": no Telegram token in settings"))
+        update_lease(db, BotLease, {"holder": None, "status": None, "desired_running": False},
+                     BotLease.holder == self.worker_id)
+        return False
+
+    def _set_desired(self, running, webhook_url=None):
+        from app import app, db
+        from models import BotLease
+
+        with app.app_context():
+            get_lease(db, BotLease)
+            values = {"desired_running": running}
+            if running:
+                values["webhook_url"] = webhook_url
+            update_lease(db, BotLease, values, BotLease.name == LEASE_NAME)
+
+
+bot_supervisor = BotSupervisor(ttl=Config.BOT_LEASE_TTL, heartbeat=Config.BOT_LEASE_HEARTBEAT)
+
+atexit.register(bot_supervisor.shutdown)
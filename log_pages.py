@@ -0,0 +1,125 @@
+import base64
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, text
+
+# Cached totals: {filter key: (count, expires_at)}
+_count_cache = {}
+_count_lock = threading.Lock()
+COUNT_TTL = 60
+
+
+def encode_cursor(log):
+    """Opaque cursor for the (timestamp, id) position of a BotLog row"""
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) for a cursor, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, log_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parse_date_range(date_from=None, date_to=None):
+    """Turn YYYY-MM-DD strings into a [since, until) datetime range"""
+    since = until = None
+    try:
+        if date_from:
+            since = datetime.strptime(date_from, '%Y-%m-%d')
+        if date_to:
+            until = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        pass
+    return since, until
+
+
+def _filtered(query, BotLog, level, since, until):
+    if level:
+        query = query.where(BotLog.level == level)
+    if since:
+        query = query.where(BotLog.timestamp >= since)
+    if until:
+        query = query.where(BotLog.timestamp < until)
+    return query
+
+
+def fetch_logs(level=None, since=None, until=None, after=None, before=None, limit=20):
+    """Keyset-paginated logs, newest first.
+
+    ``after`` continues with older rows than the cursor, ``before`` goes
+    back to newer ones. Returns ``(logs, older_cursor, newer_cursor)``;
+    a cursor is None when there is nothing further in that direction.
+    No OFFSET and no COUNT(*) are issued.
+    """
+    from app import db
+    from models import BotLog
+
+    query = _filtered(select(BotLog), BotLog, level, since, until)
+    position = decode_cursor(before or after or '')
+
+    if position and before:
+        ts, log_id = position
+        query = query.where(or_(BotLog.timestamp > ts, and_(BotLog.timestamp == ts, BotLog.id > log_id)))
+        query = query.order_by(BotLog.timestamp.asc(), BotLog.id.asc())
+    else:
+        if position:
+            ts, log_id = position
+            query = query.where(or_(BotLog.timestamp < ts, and_(BotLog.timestamp == ts, BotLog.id < log_id)))
+        query = query.order_by(BotLog.timestamp.desc(), BotLog.id.desc())
+
+    logs = db.session.scalars(query.limit(limit + 1)).all()
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+
+    if position and before:
+        logs.reverse()
+        older = encode_cursor(logs[-1]) if logs else None
+        newer = encode_cursor(logs[0]) if logs and has_more else None
+    else:
+        older = encode_cursor(logs[-1]) if logs and has_more else None
+        newer = encode_cursor(logs[0]) if logs and position else None
+
+    return logs, older, newer
+
+
+def approximate_log_count(level=None, since=None, until=None):
+    """Total number of matching logs, cached for COUNT_TTL seconds.
+
+    Unfiltered totals on PostgreSQL come from the planner statistics
+    instead of a full-table COUNT(*).
+    """
+    from app import db
+    from models import BotLog
+
+    key = (level, since, until)
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    count = None
+    if key == (None, None, None) and db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"),
+            {"name": BotLog.__tablename__}
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            count = estimate
+    if count is None:
+        count = db.session.scalar(_filtered(select(func.count(BotLog.id)), BotLog, level, since, until))
+
+    with _count_lock:
+        _count_cache[key] = (count, now + COUNT_TTL)
+        # Filter combinations are unbounded; keep the cache small
+        if len(_count_cache) > 256:
+            _count_cache.clear()
+            _count_cache[key] = (count, now + COUNT_TTL)
+    return count
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Schema migrations: creates the tables and the indexes declared on the
+models that an existing database is missing.
+
+Building an index on a large table can take far longer than a web
+worker may spend booting, so this runs once per deploy, before the web
+workers start:
+
+    python migrations.py && gunicorn ...
+"""
+
+import json
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock serializing concurrent migration runs
+MIGRATION_LOCK_ID = 0x486f73736569
+
+# Indexes a CREATE INDEX CONCURRENTLY left unusable when it was interrupted
+INVALID_INDEXES_SQL = text("""
+    SELECT index_class.relname
+    FROM pg_index
+    JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+    JOIN pg_class table_class ON table_class.oid = pg_index.indrelid
+    WHERE table_class.relname = :table AND NOT pg_index.indisvalid
+""")
+
+
+def missing_indexes(db):
+    """Names of declared indexes missing from existing tables, or invalid (PostgreSQL)"""
+    engine = db.engine
+    inspector = inspect(engine)
+    missing = []
+    with engine.connect() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            if engine.dialect.name == 'postgresql':
+                existing -= set(conn.scalars(INVALID_INDEXES_SQL, {"table": table.name}))
+            missing.extend(index.name for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def ensure_indexes(db):
+    """Create indexes declared on the models that are missing from existing tables.
+
+    ``db.create_all()`` only builds indexes together with new tables, so
+    indexes added to a model later never reach a database created earlier.
+    On PostgreSQL they are built with CREATE INDEX CONCURRENTLY so large
+    tables stay writable while the index builds; an index left INVALID by
+    an interrupted build is dropped and built again.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return _create_missing(db, engine, None)
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            return _create_missing(db, engine, conn)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+def _create_missing(db, engine, conn):
+    inspector = inspect(engine)
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        if conn is not None:
+            for name in conn.scalars(INVALID_INDEXES_SQL, {"table": table.name}).all():
+                logger.warning(f"Dropping invalid index {name} on {table.name}")
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+                existing.discard(name)
+
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            logger.info(f"Creating index {index.name} on {table.name}")
+            if conn is not None:
+                index.dialect_kwargs['postgresql_concurrently'] = True
+                try:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+                finally:
+                    del index.dialect_kwargs['postgresql_concurrently']
+            else:
+                with engine.begin() as transaction:
+                    transaction.execute(CreateIndex(index, if_not_exists=True))
+            created.append(index.name)
+
+    return created
+
+
+def migrate():
+    """Create missing tables and indexes"""
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+        return {"indexes_created": ensure_indexes(db)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(migrate(), indent=2))
@@ -1,6 +1,8 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import event
+from user_cache import user_cache
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -21,6 +23,10 @@ class BotLog(db.Model):
     def __repr__(self):
         return f'<BotLog {self.timestamp} {self.level}: {self.message[:20]}...>'
 
+# /dashboard and /logs order by timestamp, optionally filtered by level
+db.Index('ix_bot_log_timestamp', BotLog.timestamp)
+db.Index('ix_bot_log_level_timestamp', BotLog.level, BotLog.timestamp)
+
 class BotSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(64), unique=True, nullable=False)
@@ -46,6 +52,12 @@ class BotUser(db.Model):
     def __repr__(self):
         return f'<BotUser {self.telegram_id}>'
 
+# Keep the shared user cache consistent with ORM changes to BotUser rows
+@event.listens_for(BotUser, 'after_update')
+@event.listens_for(BotUser, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.telegram_id)
+
 class BotMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     telegram_user_id = db.Column(db.BigInteger, nullable=False)
@@ -55,3 +67,49 @@ class BotMessage(db.Model):
     
     def __repr__(self):
         return f'<BotMessage {self.telegram_user_id} {self.timestamp}>'
+
+# BotUser.messages filters on telegram_user_id and orders by newest first
+db.Index('ix_bot_message_user_timestamp', BotMessage.telegram_user_id, BotMessage.timestamp.desc())
+db.Index('ix_bot_message_timestamp', BotMessage.timestamp)
+
+class MessageRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    telegram_user_id = db.Column(db.BigInteger, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    from_user_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'telegram_user_id', name='uq_message_rollup_bucket'),
+    )
+    
+    def __repr__(self):
+        return f'<MessageRollup {self.granularity} {self.bucket_start} {self.telegram_user_id}: {self.message_count}>'
+
+class LogRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    level = db.Column(db.String(20), nullable=False)
+    log_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'level', name='uq_log_rollup_bucket'),
+    )
+    
+    def __repr__(self):
+        return f'<LogRollup {self.granularity} {self.bucket_start} {self.level}: {self.log_count}>'
+
+class BotLease(db.Model):
+    # One row per leased role; the holder runs it until expires_at (see lifecycle.py)
+    name = db.Column(db.String(32), primary_key=True)
+    holder = db.Column(db.String(128), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    desired_running = db.Column(db.Boolean, nullable=False, default=False)
+    webhook_url = db.Column(db.String(512), nullable=True)
+    status = db.Column(db.Text, nullable=True)  # JSON bot status published by the holder
+    
+    def __repr__(self):
+        return f'<BotLease {self.name} held by {self.holder} until {self.expires_at}>'
@@ -0,0 +1,294 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import Config
+from metrics import DB_FLUSH_ROWS, DB_FLUSH_SECONDS
+from stats import stats_service
+from user_cache import CachedUser, user_cache
+
+logger = logging.getLogger(__name__)
+
+# Dialects whose INSERT supports ON CONFLICT ... DO UPDATE
+UPSERT_INSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+
+class PersistenceQueue:
+    """Write-behind queue that batches BotMessage and BotUser rows.
+
+    Handlers only append to in-memory buffers; a background thread flushes
+    them with bulk inserts every ``batch_size`` rows or ``flush_interval_ms``
+    milliseconds, whichever comes first. A batch that fails to commit goes
+    back to the front of the buffers and is retried with exponential
+    backoff; only after ``max_retries`` consecutive failures are its rows
+    dropped.
+    """
+
+    def __init__(self, batch_size=100, flush_interval_ms=500, max_retries=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._messages = []
+        self._users = {}
+        self._thread = None
+        self._running = False
+        self._failures = 0          # consecutive failed flushes
+        self._retry_at = 0.0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+    # Queue API used by the handlers
+
+    def add_message(self, telegram_user_id, message_text, is_from_user):
+        """Buffer a BotMessage row"""
+        self._put(self._messages, {
+            "telegram_user_id": telegram_user_id,
+            "message_text": message_text,
+            "is_from_user": is_from_user,
+            "timestamp": datetime.utcnow(),
+        })
+
+    def upsert_user(self, telegram_id, username=None, first_name=None, last_name=None):
+        """Buffer a BotUser insert-or-update; the last write per user wins"""
+        with self._cond:
+            self._users[telegram_id] = {
+                "telegram_id": telegram_id,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+            }
+            self._notify_if_full()
+        self._ensure_started()
+
+    def pending(self):
+        """Number of rows waiting to be flushed"""
+        with self._cond:
+            return self._pending_count()
+
+    # Lifecycle
+
+    def start(self):
+        """Start the background flusher thread if it is not running"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher and drain everything still buffered"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            thread = self._thread
+            self._running = False
+            self._cond.notify_all()
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=timeout)
+        # Rows queued while the thread was shutting down are flushed here,
+        # retrying a failing batch until it is written or dropped
+        while self.pending() and time.monotonic() < deadline:
+            if not self.flush(force=True):
+                time.sleep(min(self._backoff(), max(0.0, deadline - time.monotonic())))
+
+    def flush(self, force=True):
+        """Write every buffered row to the database in one transaction.
+
+        Without ``force`` nothing is written while a failed batch waits for
+        its retry.
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not force and time.monotonic() < self._retry_at:
+                    return 0
+                messages, self._messages = self._messages, []
+                users, self._users = self._users, {}
+
+            if not (messages or users):
+                return 0
+
+            from app import app, db
+            from models import BotLog, BotMessage, BotUser
+
+            cached_users = []
+            logs = []
+            started = time.perf_counter()
+            try:
+                with app.app_context():
+                    if users:
+                        logs.extend(self._write_users(db, BotUser, users, cached_users))
+                    if messages:
+                        db.session.execute(insert(BotMessage), messages)
+                    if logs:
+                        db.session.execute(insert(BotLog), logs)
+                    db.session.commit()
+            except Exception as e:
+                self.failed_flushes += 1
+                DB_FLUSH_SECONDS.labels('persistence', 'error').observe(time.perf_counter() - started)
+                self._requeue(messages, users, e)
+                return 0
+            DB_FLUSH_SECONDS.labels('persistence', 'ok').observe(time.perf_counter() - started)
+            with self._cond:
+                self._failures, self._retry_at = 0, 0.0
+
+            # Only publish users to the cache once their rows are committed
+            for user in cached_users:
+                user_cache.put(user)
+            if logs:
+                stats_service.record_new_users(len(logs))
+
+            count = len(messages) + len(users) + len(logs)
+            self.flushed_rows += count
+            DB_FLUSH_ROWS.labels('persistence').inc(count)
+            return count
+
+    # Internals
+
+    def _put(self, buffer, row):
+        with self._cond:
+            buffer.append(row)
+            self._notify_if_full()
+        self._ensure_started()
+
+    def _notify_if_full(self):
+        if self._pending_count() >= self.batch_size:
+            self._cond.notify()
+
+    def _ensure_started(self):
+        if not self._running:
+            self.start()
+
+    def _requeue(self, messages, users, error):
+        """Put a failed batch back in front of the rows queued since, or drop it after max_retries"""
+        with self._cond:
+            self._failures += 1
+            if self._failures > self.max_retries:
+                self._failures, self._retry_at = 0, 0.0
+                self.dropped_rows += len(messages) + len(users)
+                logger.error(f"Dropping {len(messages)} messages and {len(users)} users after "
+                             f"{self.max_retries} failed retries: {error}")
+                return
+            self._messages[:0] = messages
+            # Users updated since the failed flush keep their newer data
+            self._users = {**users, **self._users}
+            self._retry_at = time.monotonic() + self._backoff()
+            logger.error(f"Error flushing {len(messages) + len(users)} rows "
+                         f"(attempt {self._failures}, retrying): {error}")
+
+    def _backoff(self):
+        return self.flush_interval * (2 ** max(0, self._failures - 1))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                retry_in = self._retry_at - time.monotonic()
+                if self._running and retry_in > 0:
+                    # A failed batch is backing off; new rows wait with it
+                    self._cond.wait(timeout=retry_in)
+                elif self._running and self._pending_count() < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                running = self._running
+            if not running:
+                break
+            self.flush(force=False)
+
+    def _pending_count(self):
+        return len(self._messages) + len(self._users)
+
+    def _write_users(self, db, BotUser, users, cached_users):
+        """Insert unknown users and refresh profile fields of known ones.
+
+        Snapshots of the written users are appended to ``cached_users``.
+        Returns the BotLog rows announcing newly registered users.
+        """
+        existing = {
+            row.telegram_id: row
+            for row in db.session.execute(
+                select(BotUser.id, BotUser.telegram_id, BotUser.username,
+                       BotUser.first_name, BotUser.last_name,
+                       BotUser.joined_at, BotUser.is_active)
+                .where(BotUser.telegram_id.in_(list(users)))
+            )
+        }
+
+        now = datetime.utcnow()
+        new_rows = []
+        changed_rows = []
+        for telegram_id, data in users.items():
+            row = existing.get(telegram_id)
+            if row is None:
+                new_rows.append(dict(data, joined_at=now, is_active=True))
+                continue
+
+            cached_users.append(CachedUser(joined_at=row.joined_at, is_active=row.is_active, **data))
+            if (row.username, row.first_name, row.last_name) != (
+                    data["username"], data["first_name"], data["last_name"]):
+                changed_rows.append({
+                    "id": row.id,
+                    "username": data["username"],
+                    "first_name": data["first_name"],
+                    "last_name": data["last_name"],
+                })
+
+        registered = []
+        if new_rows:
+            joined = self._insert_users(db, BotUser, new_rows)
+            for data in new_rows:
+                joined_at, is_active = joined.get(data["telegram_id"], (now, True))
+                cached_users.append(CachedUser(joined_at=joined_at, is_active=is_active, **users[data["telegram_id"]]))
+                # Another worker may have inserted the same user since the select
+                if joined_at == now:
+                    registered.append(data)
+        if changed_rows:
+            db.session.execute(update(BotUser), changed_rows)
+
+        return [
+            {
+                "level": "INFO",
+                "message": f"New user registered: {row['telegram_id']} - {row['username']}",
+                "timestamp": now,
+            }
+            for row in registered
+        ]
+
+    @staticmethod
+    def _insert_users(db, BotUser, rows):
+        """Insert users, updating the profile of any inserted concurrently.
+
+        Returns ``{telegram_id: (joined_at, is_active)}`` as stored, so rows
+        that already existed keep their original ``joined_at``.
+        """
+        dialect_insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+        if dialect_insert is None:
+            db.session.execute(insert(BotUser), rows)
+            return {}
+
+        statement = dialect_insert(BotUser).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[BotUser.telegram_id],
+            set_={
+                "username": statement.excluded.username,
+                "first_name": statement.excluded.first_name,
+                "last_name": statement.excluded.last_name,
+            },
+        ).returning(BotUser.telegram_id, BotUser.joined_at, BotUser.is_active)
+        return {row.telegram_id: (row.joined_at, row.is_active) for row in db.session.execute(statement)}
+
+
+persistence_queue = PersistenceQueue(
+    batch_size=Config.PERSISTENCE_BATCH_SIZE,
+    flush_interval_ms=Config.PERSISTENCE_FLUSH_INTERVAL_MS,
+    max_retries=Config.PERSISTENCE_MAX_RETRIES,
+)
+
+# Never lose buffered rows on interpreter shutdown
+atexit.register(persistence_queue.stop)
@@ -0,0 +1,433 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import Config
+from telegram_client import TelegramAPIError, telegram_client
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+
+class TokenBucket:
+    """Classic token bucket; ``delay`` never blocks"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until one token is available (0 if one is available now)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendJob:
+    """A queued sendMessage call; ``future`` resolves to the API response"""
+
+    def __init__(self, token, params, priority, future=None):
+        self.token = token
+        self.params = params
+        self.chat_id = params["chat_id"]
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.future = future if future is not None else Future()
+
+
+def wait_stats(waits):
+    """Percentiles of a sequence of queue wait times"""
+    waits = sorted(waits)
+    if not waits:
+        return {}
+    return {
+        "wait_p50": round(waits[len(waits) // 2], 3),
+        "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+        "wait_max": round(waits[-1], 3),
+    }
+
+
+class SendScheduler:
+    """Outbound message scheduler honoring Telegram's flood limits.
+
+    A global bucket caps total throughput and one bucket per chat caps each
+    private chat (per second) or group (per minute). Jobs wait in a priority
+    queue so interactive replies go out before bulk traffic; a job whose
+    chat is throttled, or that got a 429, is parked until it may be sent.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1.0, group_rate_per_minute=20,
+                 chat_burst=3, workers=8, max_retries=5, max_chat_buckets=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60.0
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+
+        self._cond = threading.Condition()
+        self._ready = []
+        self._delayed = []
+        self._seq = itertools.count()
+        self._chat_buckets = OrderedDict()
+        self._in_flight = 0
+        self._claimed_until = 0.0
+        self._thread = None
+        self._executor = None
+        self._running = False
+
+        self._waits = deque(maxlen=1000)
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.requeued = 0
+
+    # Public API
+
+    def submit(self, token, params, priority=PRIORITY_INTERACTIVE):
+        """Queue a sendMessage call and return its SendJob"""
+        job = SendJob(token, params, priority)
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._ready, (priority, next(self._seq), job))
+            self.enqueued += 1
+            self._cond.notify()
+        return job
+
+    def stop(self, timeout=10.0):
+        """Send what is queued (up to ``timeout``), then stop the threads"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._ready or self._delayed or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(timeout=0.1)
+            self._running = False
+            self._cond.notify_all()
+            thread, executor = self._thread, self._executor
+            self._thread = self._executor = None
+        if thread:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if executor:
+            executor.shutdown(wait=False)
+
+    def queue_depth(self):
+        """Jobs waiting to be sent, including rate-limited ones"""
+        with self._cond:
+            return len(self._ready) + len(self._delayed)
+
+    def acquire(self, chat_id, priority=PRIORITY_INTERACTIVE):
+        """Take a global and a chat token for a send made outside this scheduler.
+
+        Returns ``(global_wait, chat_wait)``; both are 0 when the tokens were
+        taken. While an interactive caller waits for a global token, bulk
+        jobs queued here hold back so replies keep their priority.
+        """
+        with self._cond:
+            now = time.monotonic()
+            global_wait = self.global_bucket.delay(now)
+            if global_wait > 0:
+                if priority == PRIORITY_INTERACTIVE:
+                    self._claimed_until = max(self._claimed_until, now + global_wait + 0.1)
+                return global_wait, 0.0
+            chat_bucket = self._chat_bucket(chat_id)
+            chat_wait = chat_bucket.delay(now)
+            if chat_wait > 0:
+                return 0.0, chat_wait
+            self.global_bucket.consume(now)
+            chat_bucket.consume(now)
+            if priority == PRIORITY_INTERACTIVE and self._claimed_until:
+                self._claimed_until = 0.0
+                self._cond.notify()
+            return 0.0, 0.0
+
+    def stats(self):
+        """Queue depth and wait-time statistics"""
+        with self._cond:
+            waits = list(self._waits)
+            stats = {
+                "queued": len(self._ready),
+                "delayed": len(self._delayed),
+                "in_flight": self._in_flight,
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "requeued": self.requeued,
+            }
+        stats.update(wait_stats(waits))
+        return stats
+
+    # Scheduling loop
+
+    def _ensure_started(self):
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="send-worker")
+        self._thread = threading.Thread(target=self._run, name="send-scheduler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, priority, seq, job = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, seq, job))
+
+                if not self._ready:
+                    timeout = self._delayed[0][0] - now if self._delayed else None
+                    self._cond.wait(timeout=timeout)
+                    continue
+
+                global_wait = self.global_bucket.delay(now)
+                if not global_wait and self._ready[0][0] > PRIORITY_INTERACTIVE and self._claimed_until > now:
+                    # An interactive send outside the scheduler is next in line
+                    global_wait = self._claimed_until - now
+                if global_wait > 0:
+                    self._cond.wait(timeout=global_wait)
+                    continue
+
+                priority, seq, job = heapq.heappop(self._ready)
+                if job.future.cancelled():
+                    # Given up by its submitter (e.g. a cancelled broadcast)
+                    continue
+                chat_bucket = self._chat_bucket(job.chat_id)
+                chat_wait = chat_bucket.delay(now)
+                if chat_wait > 0:
+                    heapq.heappush(self._delayed, (now + chat_wait, priority, seq, job))
+                    continue
+
+                self.global_bucket.consume(now)
+                chat_bucket.consume(now)
+                self._in_flight += 1
+                self._executor.submit(self._send, job)
+
+    def _send(self, job):
+        job.attempts += 1
+        try:
+            # 429s are rescheduled here instead of sleeping inside the client
+            result = telegram_client.call(job.token, "sendMessage", job.params, retry_429=False)
+        except TelegramAPIError as e:
+            if e.status_code == 429 and job.attempts <= self.max_retries:
+                self._requeue(job, e.retry_after or 1)
+                return
+            self._finish(job, error=e)
+            return
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        self._finish(job, result=result)
+
+    def _requeue(self, job, retry_after):
+        with self._cond:
+            self._in_flight -= 1
+            self.requeued += 1
+            heapq.heappush(self._delayed, (time.monotonic() + retry_after, job.priority, next(self._seq), job))
+            self._cond.notify_all()
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            self._in_flight -= 1
+            self._waits.append(time.monotonic() - job.enqueued_at)
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+        if job.future.cancelled():
+            return
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                # Groups and channels: no burst on top of the per-minute budget,
+                # so no 60-second window ever holds more than group_rate_per_minute sends
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+            self._evict_idle_buckets()
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle_buckets(self):
+        # A full bucket carries no state, so idle chats can be forgotten
+        now = time.monotonic()
+        while len(self._chat_buckets) > self.max_chat_buckets:
+            chat_id, bucket = next(iter(self._chat_buckets.items()))
+            if not bucket.is_full(now):
+                break
+            del self._chat_buckets[chat_id]
+
+
+class AsyncSendScheduler:
+    """sendMessage scheduler for the asyncio engine, running on its event loop.
+
+    Sends go out through the engine's AsyncTelegramClient, so the sends in
+    flight are bounded by its connection pool rather than by SEND_WORKERS
+    threads. Tokens are taken from ``scheduler``'s global and per-chat
+    buckets, so replies, broadcasts and the threaded engine share one set
+    of flood limits.
+    """
+
+    def __init__(self, scheduler, client, max_retries=5):
+        self.scheduler = scheduler
+        self.client = client
+        self.max_retries = max_retries
+        self._ready = []
+        self._delayed = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._sends = set()
+
+        self._waits = deque(maxlen=1000)
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def submit(self, token, params, priority=PRIORITY_INTERACTIVE):
+        """Queue a sendMessage call; must be called on the loop. Returns its SendJob"""
+        loop = asyncio.get_event_loop()
+        job = SendJob(token, params, priority, future=loop.create_future())
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        heapq.heappush(self._ready, (priority, next(self._seq), job))
+        self.enqueued += 1
+        self._wakeup.set()
+        return job
+
+    async def close(self):
+        """Stop scheduling; jobs still queued fail with CancelledError"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._sends, return_exceptions=True)
+            self._task = None
+        for queue in (self._ready, self._delayed):
+            for entry in queue:
+                if not entry[-1].future.done():
+                    entry[-1].future.cancel()
+            queue.clear()
+
+    def queue_depth(self):
+        return len(self._ready) + len(self._delayed)
+
+    def stats(self):
+        stats = {
+            "queued": len(self._ready),
+            "delayed": len(self._delayed),
+            "in_flight": len(self._sends),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "requeued": self.requeued,
+        }
+        stats.update(wait_stats(self._waits))
+        return stats
+
+    # Scheduling loop
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, job = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, job))
+
+            if not self._ready:
+                await self._wait(self._delayed[0][0] - now if self._delayed else None)
+                continue
+
+            priority, seq, job = self._ready[0]
+            global_wait, chat_wait = self.scheduler.acquire(job.chat_id, priority)
+            if global_wait > 0:
+                await self._wait(global_wait)
+                continue
+
+            heapq.heappop(self._ready)
+            if chat_wait > 0:
+                heapq.heappush(self._delayed, (now + chat_wait, priority, seq, job))
+                continue
+
+            send = asyncio.ensure_future(self._send(job))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _send(self, job):
+        job.attempts += 1
+        try:
+            # 429s are rescheduled here instead of sleeping inside the client
+            result = await self.client.call(job.token, "sendMessage", job.params, retry_429=False)
+        except TelegramAPIError as e:
+            if e.status_code == 429 and job.attempts <= self.max_retries:
+                self.requeued += 1
+                heapq.heappush(self._delayed, (time.monotonic() + (e.retry_after or 1), job.priority,
+                                               next(self._seq), job))
+                self._wakeup.set()
+                return
+            self._finish(job, error=e)
+            return
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        self._finish(job, result=result)
+
+    def _finish(self, job, result=None, error=None):
+        self._waits.append(time.monotonic() - job.enqueued_at)
+        if job.future.done():
+            return
+        if error is None:
+            self.sent += 1
+            job.future.set_result(result)
+        else:
+            self.failed += 1
+            job.future.set_exception(error)
+
+
+send_scheduler = SendScheduler(
+    global_rate=Config.RATE_LIMIT_GLOBAL,
+    chat_rate=Config.RATE_LIMIT_PER_CHAT,
+    group_rate_per_minute=Config.RATE_LIMIT_GROUP_PER_MINUTE,
+    chat_burst=Config.RATE_LIMIT_CHAT_BURST,
+    workers=Config.SEND_WORKERS,
+    max_retries=Config.SEND_MAX_RETRIES,
+)
@@ -0,0 +1,121 @@
+import html
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# BotSetting keys that override the built-in reply texts
+TEMPLATE_KEYS = ('reply_start_text', 'reply_help_text', 'reply_about_text', 'webapp_url', 'webapp_button_text')
+
+DEFAULT_START_TEXT = (
+    "به بازی حسین ایکس بات ۳ خوش آمدید {first_name}! 👋\n\n"
+    "من اینجا هستم تا به شما کمک کنم.\n\n"
+    "برای دیدن دستورات از /help استفاده کنید یا مینی اپ را از دکمه زیر باز کنید."
+)
+DEFAULT_HELP_TEXT = (
+    "دستورات قابل استفاده:\n\n"
+    "/start - شروع مجدد ربات\n"
+    "/help - نمایش این پیام راهنما\n"
+    "/about - درباره این ربات\n"
+)
+DEFAULT_ABOUT_TEXT = (
+    "🤖 حسین ایکس بات ۳\n\n"
+    "یک ربات تلگرام ساخته شده با پایتون.\n"
+    "توسعه داده شده برای سرگرمی و بازی."
+)
+DEFAULT_BUTTON_TEXT = "باز کردن مینی اپ حسین ایکس بات"
+
+# Placeholder swapped for the user id when the keyboard is serialized once
+_USER_ID_MARK = "\x00user_id\x00"
+
+
+def default_webapp_url():
+    """Mini App URL with a {user_id} placeholder"""
+    # 1. First option: Use GitHub Pages (when available)
+    github_url = "homland1.github.io/HosseinX-bot3"
+
+    # 2. Fallback to Replit URL if GitHub Pages is not ready
+    replit_domain = os.environ.get('REPLIT_DOMAINS', '57a0603e-812d-4af0-a6fd-47ceb27f1626-00-365m8arhc6yga.picard.replit.dev')
+    if ',' in replit_domain:  # Handle multiple domains
+        replit_domain = replit_domain.split(',')[0]
+
+    # 3. Choose which URL to use (for now use Replit URL)
+    use_github = False  # Set to True when GitHub Pages is ready
+
+    if use_github:
+        return f"https://{github_url}/miniapp/?user_id={{user_id}}"
+    return f"https://{replit_domain}/telegram-miniapp/index.html?user_id={{user_id}}"
+
+
+class CompiledTemplates:
+    """Reply texts and keyboards prepared once; rendering only joins strings"""
+
+    def __init__(self, start_text, help_text, about_text, webapp_url, button_text):
+        self.start_parts = start_text.split('{first_name}')
+        self.start_log_suffix = "\n[Mini App Button Added]"
+        self.help_text = help_text
+        self.about_text = about_text
+
+        if '{user_id}' not in webapp_url:
+            webapp_url += ('&' if '?' in webapp_url else '?') + 'user_id={user_id}'
+        keyboard = {"inline_keyboard": [[{"text": button_text, "web_app": {"url": webapp_url.replace('{user_id}', _USER_ID_MARK)}}]]}
+        # json.dumps escapes the NUL bytes, so split on the escaped form
+        self.keyboard_parts = json.dumps(keyboard).split(json.dumps(_USER_ID_MARK)[1:-1])
+
+    def start(self, user_id, first_name):
+        """Return (text, serialized reply_markup, log_text) for /start"""
+        text = html.escape(first_name or '', quote=False).join(self.start_parts)
+        return text, str(user_id).join(self.keyboard_parts), text + self.start_log_suffix
+
+
+class ReplyTemplates:
+    """Current CompiledTemplates, rebuilt from the settings cache on ``reload``"""
+
+    def __init__(self):
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        compiled = self._compiled
+        if compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = self._compile(self._load_overrides())
+                compiled = self._compiled
+        return compiled
+
+    def reload(self, overrides=None):
+        """Rebuild the templates, from ``overrides`` or from the cached settings"""
+        compiled = self._compile(self._load_overrides() if overrides is None else overrides)
+        with self._lock:
+            self._compiled = compiled
+        return compiled
+
+    @staticmethod
+    def _compile(overrides):
+        return CompiledTemplates(
+            overrides.get('reply_start_text') or DEFAULT_START_TEXT,
+            overrides.get('reply_help_text') or DEFAULT_HELP_TEXT,
+            overrides.get('reply_about_text') or DEFAULT_ABOUT_TEXT,
+            overrides.get('webapp_url') or default_webapp_url(),
+            overrides.get('webapp_button_text') or DEFAULT_BUTTON_TEXT,
+        )
+
+    @staticmethod
+    def _load_overrides():
+        try:
+            from settings_cache import settings_cache
+            return settings_cache.get_many(TEMPLATE_KEYS)
+        except Exception as e:
+            logger.error(f"Error loading reply templates: {e}")
+            return {}
+
+    def watch_settings(self):
+        """Recompile whenever a template setting changes, in this or another process"""
+        from settings_cache import settings_cache
+        settings_cache.subscribe(TEMPLATE_KEYS, lambda changed: self.reload())
+
+
+reply_templates = ReplyTemplates()
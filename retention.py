@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Retention for BotLog and BotMessage: incremental hourly/daily rollups,
+optional archival of expired rows to gzip-compressed NDJSON, and chunked
+deletion of rows older than the configured TTL.
+
+Runs in the background when RETENTION_ENABLED=True, or once from the
+command line with ``python retention.py``.
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('hour', 'day')
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+class Retention:
+    """Roll up, archive and purge old BotMessage and BotLog rows.
+
+    Rollups advance a per-table id watermark stored in BotSetting. The
+    watermark moves with a compare-and-set in the same transaction as the
+    rollup counts, so concurrent runs in several workers never count a row
+    twice. Only rows at or below the watermark are ever deleted.
+
+    Concurrent writers can commit a row after a row with a higher id, so
+    the watermark stops before the first row younger than
+    ``settle_seconds``. A lower id still in flight when the chunk is read
+    is then committed by the time the watermark passes it.
+    """
+
+    def __init__(self, log_days=30, message_days=90, chunk_size=1000, archive_dir='', pause=0.05,
+                 settle_seconds=600):
+        self.log_days = log_days
+        self.message_days = message_days
+        self.chunk_size = chunk_size
+        self.archive_dir = archive_dir
+        self.pause = pause
+        self.settle_seconds = settle_seconds
+
+    def run_once(self):
+        """Bring rollups up to date, then purge expired rows"""
+        from app import app, db
+        from models import BotLog, BotMessage, LogRollup, MessageRollup
+
+        with app.app_context():
+            summary = {
+                "messages_rolled_up": self._rollup_all(db, BotMessage, MessageRollup, self._aggregate_messages),
+                "logs_rolled_up": self._rollup_all(db, BotLog, LogRollup, self._aggregate_logs),
+                "messages_deleted": self._purge(db, BotMessage, self.message_days),
+                "logs_deleted": self._purge(db, BotLog, self.log_days),
+            }
+        logger.info(f"Retention run finished: {summary}")
+        return summary
+
+    # Rollups
+
+    @staticmethod
+    def _aggregate_messages(rows):
+        counts = defaultdict(lambda: [0, 0])
+        for row in rows:
+            for granularity in GRANULARITIES:
+                entry = counts[(granularity, bucket_start(row.timestamp, granularity), row.telegram_user_id)]
+                entry[0] += 1
+                entry[1] += 1 if row.is_from_user else 0
+        return {key: {"message_count": c, "from_user_count": f} for key, (c, f) in counts.items()}
+
+    @staticmethod
+    def _aggregate_logs(rows):
+        counts = defaultdict(int)
+        for row in rows:
+            for granularity in GRANULARITIES:
+                counts[(granularity, bucket_start(row.timestamp, granularity), row.level)] += 1
+        return {key: {"log_count": c} for key, c in counts.items()}
+
+    def _rollup_all(self, db, Source, Rollup, aggregate):
+        total = 0
+        while True:
+            rolled = self._rollup_chunk(db, Source, Rollup, aggregate)
+            if not rolled:
+                return total
+            total += rolled
+
+    def _rollup_chunk(self, db, Source, Rollup, aggregate):
+        from models import BotSetting
+
+        key = f"rollup_watermark_{Source.__tablename__}"
+        watermark = self._watermark(db, key)
+
+        if Source.__tablename__ == 'bot_message':
+            columns = (Source.id, Source.timestamp, Source.telegram_user_id, Source.is_from_user)
+            group_column = Rollup.telegram_user_id
+        else:
+            columns = (Source.id, Source.timestamp, Source.level)
+            group_column = Rollup.level
+
+        rows = db.session.execute(
+            select(*columns).where(Source.id > watermark).order_by(Source.id).limit(self.chunk_size)
+        ).all()
+        settled_before = datetime.utcnow() - timedelta(seconds=self.settle_seconds)
+        for position, row in enumerate(rows):
+            if row.timestamp is not None and row.timestamp >= settled_before:
+                rows = rows[:position]
+                break
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        deltas = aggregate([row for row in rows if row.timestamp is not None])
+        existing = {}
+        if deltas:
+            buckets = {bucket for _, bucket, _ in deltas}
+            groups = {group for _, _, group in deltas}
+            existing = {
+                (row.granularity, row.bucket_start, getattr(row, group_column.key)): row
+                for row in db.session.scalars(
+                    select(Rollup).where(Rollup.bucket_start.in_(buckets), group_column.in_(groups))
+                )
+            }
+
+        inserts, updates = [], []
+        for (granularity, bucket, group), counts in deltas.items():
+            row = existing.get((granularity, bucket, group))
+            if row is None:
+                inserts.append(dict(counts, granularity=granularity, bucket_start=bucket, **{group_column.key: group}))
+            else:
+                updates.append({"id": row.id, **{name: getattr(row, name) + value for name, value in counts.items()}})
+        if inserts:
+            db.session.execute(insert(Rollup), inserts)
+        if updates:
+            db.session.execute(update(Rollup), updates)
+
+        # Compare-and-set: lose the race cleanly if another worker got here first
+        new_watermark = rows[-1].id
+        moved = db.session.execute(
+            update(BotSetting)
+            .where(BotSetting.key == key, BotSetting.value == str(watermark))
+            .values(value=str(new_watermark))
+        ).rowcount
+        if not moved:
+            db.session.rollback()
+            return 0
+        db.session.commit()
+        return len(rows)
+
+    def _watermark(self, db, key):
+        from models import BotSetting
+
+        value = db.session.scalar(select(BotSetting.value).where(BotSetting.key == key))
+        if value is None:
+            try:
+                db.session.add(BotSetting(key=key, value='0'))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            return 0
+        return int(value)
+
+    # Archival and deletion
+
+    def _purge(self, db, Source, days):
+        if days <= 0:
+            return 0
+
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        watermark = self._watermark(db, f"rollup_watermark_{Source.__tablename__}")
+        table = Source.__table__
+        deleted = 0
+
+        while True:
+            rows = db.session.execute(
+                select(table)
+                .where(table.c.timestamp < cutoff, table.c.id <= watermark)
+                .order_by(table.c.id)
+                .limit(self.chunk_size)
+            ).mappings().all()
+            if not rows:
+                db.session.rollback()
+                return deleted
+
+            if self.archive_dir:
+                self._archive(table.name, rows)
+
+            # Short transactions keep row locks brief on large tables
+            db.session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+            db.session.commit()
+            deleted += len(rows)
+            time.sleep(self.pause)
+
+    def _archive(self, table_name, rows):
+        """Append rows to today's gzip NDJSON file; gzip members concatenate cleanly"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{table_name}-{datetime.utcnow():%Y%m%d}.ndjson.gz")
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in rows:
+                archive.write(json.dumps(dict(row), default=_json_default, ensure_ascii=False) + '\n')
+
+
+class RetentionWorker:
+    """Background thread running Retention.run_once every ``interval`` seconds"""
+
+    def __init__(self, retention, interval=3600):
+        self.retention = retention
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.retention.run_once()
+            except Exception as e:
+                logger.error(f"Retention run failed: {e}")
+            self._stop.wait(self.interval)
+
+
+retention = Retention(
+    log_days=Config.RETENTION_LOG_DAYS,
+    message_days=Config.RETENTION_MESSAGE_DAYS,
+    chunk_size=Config.RETENTION_CHUNK_SIZE,
+    archive_dir=Config.RETENTION_ARCHIVE_DIR,
+    settle_seconds=Config.RETENTION_SETTLE_SECONDS,
+)
+retention_worker = RetentionWorker(retention, interval=Config.RETENTION_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(retention.run_once(), indent=2))
@@ -0,0 +1,171 @@
+import functools
+import json
+import time
+from collections import namedtuple
+
+# An outgoing Bot API call produced by a handler; ``log_text`` is stored as the bot's message
+Reply = namedtuple('Reply', ['method', 'params', 'log_text'])
+
+
+def message_reply(chat_id, text, reply_markup=None, log_text=None):
+    """sendMessage reply; ``reply_markup`` may be a dict or an already serialized string"""
+    params = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+    if reply_markup:
+        params["reply_markup"] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
+    return Reply("sendMessage", params, text if log_text is None else log_text)
+
+
+def callback_answer(callback_query_id, text=None):
+    """answerCallbackQuery reply; stops the loading indicator on the pressed button"""
+    params = {"callback_query_id": callback_query_id}
+    if text:
+        params["text"] = text
+    return Reply("answerCallbackQuery", params, None)
+
+
+class UpdateContext:
+    """Everything a handler and the middleware need to know about one update"""
+
+    __slots__ = ('token', 'update', 'send', 'kind', 'message', 'user', 'user_id', 'chat_id',
+                 'text', 'command', 'args', 'handler', 'label', 'replies', 'failed', 'started',
+                 'deferred_sends')
+
+    def __init__(self, token, update, send):
+        self.token = token
+        self.update = update
+        self.send = send
+        self.kind = 'other'
+        self.message = None
+        self.user = {}
+        self.user_id = None
+        self.chat_id = None
+        self.text = None
+        self.command = None
+        self.args = ''
+        self.handler = None
+        self.label = 'other'
+        self.replies = []
+        self.failed = False
+        self.started = time.perf_counter()
+        # True when send() only queues replies and the engine awaits them after dispatch
+        self.deferred_sends = False
+
+
+class Router:
+    """Dispatches updates to decorator-registered handlers with one dict lookup.
+
+    Commands are keyed by name, callback queries by the part of their data
+    before the first ``:``, everything else by update kind (``text``,
+    ``web_app_data``, ``callback_query``, ...). Middleware wraps every
+    handler call, so persistence, metrics and error handling live in one
+    place. Handlers return None, a Reply or a list of Replies; each reply is
+    handed to ``ctx.send(token, reply)``, which the engine provides.
+    """
+
+    def __init__(self):
+        self._commands = {}
+        self._callbacks = {}
+        self._kinds = {}
+        self._middleware = []
+        self._chain = self._run_handler
+
+    # Registration
+
+    def command(self, *names):
+        def register(handler):
+            for name in names:
+                self._commands['/' + name.lstrip('/').lower()] = handler
+            return handler
+        return register
+
+    def callback(self, prefix):
+        def register(handler):
+            self._callbacks[prefix] = handler
+            return handler
+        return register
+
+    def on(self, kind):
+        def register(handler):
+            self._kinds[kind] = handler
+            return handler
+        return register
+
+    def middleware(self, middleware):
+        """Register ``middleware(ctx, call_next)``; the first registered runs outermost"""
+        self._middleware.append(middleware)
+        chain = self._run_handler
+        for registered in reversed(self._middleware):
+            chain = functools.partial(registered, call_next=chain)
+        self._chain = chain
+        return middleware
+
+    def commands(self):
+        return sorted(self._commands)
+
+    # Dispatch
+
+    def context(self, token, update, send):
+        """Classify an update and pick its handler"""
+        ctx = UpdateContext(token, update, send)
+
+        if 'message' in update:
+            message = ctx.message = update['message']
+            ctx.user = message.get('from') or {}
+            ctx.chat_id = message.get('chat', {}).get('id')
+            if 'web_app_data' in message:
+                ctx.kind = 'web_app_data'
+                ctx.text = message['web_app_data'].get('data', '')
+            elif 'text' in message:
+                ctx.text = message['text']
+                if ctx.text.startswith('/'):
+                    return self._resolve_command(ctx)
+                ctx.kind = 'text'
+            else:
+                ctx.kind = 'message'
+        elif 'callback_query' in update:
+            query = update['callback_query']
+            ctx.kind = 'callback_query'
+            ctx.user = query.get('from') or {}
+            ctx.message = query.get('message')
+            ctx.chat_id = (ctx.message or {}).get('chat', {}).get('id', ctx.user.get('id'))
+            ctx.text = query.get('data', '')
+            ctx.handler = self._callbacks.get(ctx.text.split(':', 1)[0])
+        else:
+            ctx.kind = next((key for key in update if key != 'update_id'), 'other')
+
+        ctx.user_id = ctx.user.get('id')
+        ctx.handler = ctx.handler or self._kinds.get(ctx.kind)
+        # Update kinds are a small fixed set, so they are safe metric labels
+        ctx.label = ctx.kind
+        return ctx
+
+    def _resolve_command(self, ctx):
+        command, _, ctx.args = ctx.text.partition(' ')
+        ctx.kind = 'command'
+        # "/start@SomeBot" is how commands arrive in groups
+        ctx.command = command.split('@', 1)[0].lower()
+        ctx.user_id = ctx.user.get('id')
+        ctx.handler = self._commands.get(ctx.command) or self._kinds.get('unknown_command')
+        ctx.label = ctx.command if ctx.command in self._commands else 'unknown_command'
+        return ctx
+
+    def dispatch(self, ctx):
+        """Run the middleware chain and the handler; returns the context"""
+        self._chain(ctx)
+        return ctx
+
+    def _run_handler(self, ctx):
+        if ctx.handler is None:
+            return
+        replies = ctx.handler(ctx)
+        if replies is None:
+            return
+        if isinstance(replies, Reply):
+            replies = [replies]
+        for reply in replies:
+            ctx.replies.append(reply)
+            if ctx.send(ctx.token, reply) is None:
+                ctx.failed = True
+
+
+router = Router()
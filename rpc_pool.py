@@ -0,0 +1,251 @@
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Methods that change chain state are never sent twice at once
+WRITE_METHODS = frozenset(('eth_sendRawTransaction', 'eth_sendTransaction', 'eth_sign', 'eth_signTransaction'))
+
+
+class RPCEndpointError(Exception):
+    """An endpoint failed to answer (transport error, HTTP error or unusable body)"""
+
+
+class Endpoint:
+    """One JSON-RPC URL with its health figures and circuit breaker"""
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = 0.0          # EWMA of successful request time, seconds
+        self.error_rate = 0.0       # EWMA of failures (1) and successes (0)
+        self.block_number = None    # last head this endpoint reported
+        self.state = CLOSED
+        self.failures = 0           # consecutive failures
+        self.trips = 0              # consecutive times the breaker opened
+        self.retry_at = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return self.state == CLOSED or (self.state == OPEN and now >= self.retry_at)
+
+    def score(self, error_penalty):
+        """Expected cost of a request in seconds, a failure counting ``error_penalty``; lower is better"""
+        return self.latency + error_penalty * self.error_rate
+
+
+class RPCPool:
+    """Routes JSON-RPC requests over several endpoints by health.
+
+    Every endpoint keeps an EWMA of its latency and error rate and the last
+    block number it reported. Requests go to the endpoint with the lowest
+    score among those not lagging more than ``max_lag`` blocks behind the
+    best head. A read that has not been answered after three times the
+    endpoint's average latency (at most ``hedge_delay`` seconds) is also
+    sent to the next endpoint and the first answer wins;
+    any failed request moves on to the next endpoint. ``eject_failures``
+    consecutive failures open an endpoint's circuit breaker for
+    ``eject_seconds`` (doubling on every further trip), after which one
+    trial request, or a health check, decides whether it comes back.
+    """
+
+    def __init__(self, urls, timeout=10.0, hedge_delay=0.3, eject_failures=3, eject_seconds=30.0,
+                 max_lag=5, alpha=0.2, error_penalty=1.0, pool_size=10):
+        if not urls:
+            raise ValueError("RPCPool needs at least one URL")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_lag = max_lag
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.hedges = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(urls)), thread_name_prefix="rpc-pool")
+
+        # One keep-alive session for all endpoints
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # Requests
+
+    def request(self, method, payload):
+        """Send an encoded JSON-RPC request and return the decoded response"""
+        candidates = self.ranked()
+        if method in WRITE_METHODS or self.hedge_delay is None or len(candidates) == 1:
+            return self._failover(candidates, method, payload)
+        return self._hedged(candidates, method, payload)
+
+    def call(self, method, params=None):
+        """Convenience wrapper: the ``result`` of ``method``, raising on a JSON-RPC error"""
+        payload = json.dumps({"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self._ids)})
+        response = self.request(method, payload.encode())
+        if "error" in response:
+            raise RPCEndpointError(f"{method}: {response['error']}")
+        return response["result"]
+
+    def batch(self, calls):
+        """Send ``[(method, params), ...]`` as one JSON-RPC batch; responses come back in call order"""
+        if not calls:
+            return []
+        ids = [next(self._ids) for _ in calls]
+        payload = json.dumps([{"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+                              for request_id, (method, params) in zip(ids, calls)])
+        responses = self.request(f"batch:{calls[0][0]}", payload.encode())
+        if not isinstance(responses, list):
+            raise RPCEndpointError(f"batch request rejected: {responses.get('error') if isinstance(responses, dict) else responses}")
+        by_id = {response.get("id"): response for response in responses}
+        return [by_id.get(request_id, {"error": {"message": "missing from batch response"}}) for request_id in ids]
+
+    def ranked(self):
+        """Endpoints in the order they should be tried"""
+        now = time.monotonic()
+        with self._lock:
+            head = self._head()
+            usable = [e for e in self.endpoints if e.available(now)]
+            if not usable:
+                # Everything is ejected: try all of them, the earliest to recover first
+                return sorted(self.endpoints, key=lambda e: e.retry_at)
+            return sorted(usable, key=lambda e: (self._lagging(e, head), e.score(self.error_penalty)))
+
+    def _failover(self, candidates, method, payload):
+        error = None
+        for attempt, endpoint in enumerate(candidates):
+            if attempt:
+                with self._lock:
+                    self.failovers += 1
+            try:
+                return self._send(endpoint, method, payload)
+            except RPCEndpointError as e:
+                error = e
+        raise error
+
+    def _hedged(self, candidates, method, payload):
+        backups = list(candidates[1:])
+        pending = {self._executor.submit(self._send, candidates[0], method, payload)}
+        hedge_after = min(self.hedge_delay, 3 * candidates[0].latency) if candidates[0].latency else self.hedge_delay
+        hedged = False
+        error = None
+        while pending:
+            timeout = hedge_after if backups and not hedged else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The first endpoint is slow: ask the next one as well
+                hedged = True
+                with self._lock:
+                    self.hedges += 1
+                pending.add(self._executor.submit(self._send, backups.pop(0), method, payload))
+                continue
+            for future in done:
+                try:
+                    return future.result()
+                except RPCEndpointError as e:
+                    error = e
+            if not pending and backups:
+                with self._lock:
+                    self.failovers += 1
+                pending.add(self._executor.submit(self._send, backups.pop(0), method, payload))
+        raise error
+
+    def _send(self, endpoint, method, payload):
+        with self._lock:
+            if endpoint.state == OPEN:
+                endpoint.state = HALF_OPEN      # this request is its trial
+        started = time.monotonic()
+        try:
+            response = self.session.post(endpoint.url, data=payload, timeout=self.timeout,
+                                         headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self._record(endpoint, False, time.monotonic() - started)
+            raise RPCEndpointError(f"{endpoint.url}: {e}") from e
+
+        # A JSON-RPC error is still an answer from a working node
+        self._record(endpoint, True, time.monotonic() - started)
+        if method == 'eth_blockNumber' and isinstance(body, dict) and "result" in body:
+            endpoint.block_number = int(body["result"], 16)
+        return body
+
+    # Health
+
+    def _record(self, endpoint, ok, elapsed):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.error_rate += self.alpha * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if ok:
+                endpoint.latency = elapsed if not endpoint.latency else endpoint.latency + self.alpha * (elapsed - endpoint.latency)
+                if endpoint.state != CLOSED:
+                    logger.info(f"RPC endpoint {endpoint.url} readmitted")
+                endpoint.state, endpoint.failures, endpoint.trips = CLOSED, 0, 0
+                return
+
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.state == HALF_OPEN or endpoint.failures >= self.eject_failures:
+                endpoint.trips += 1
+                endpoint.state = OPEN
+                endpoint.retry_at = time.monotonic() + self.eject_seconds * 2 ** min(endpoint.trips - 1, 3)
+                logger.warning(f"RPC endpoint {endpoint.url} ejected after {endpoint.failures} failures")
+
+    def check_health(self):
+        """Ask every endpoint (ejected ones too, once their wait is over) for the head block"""
+        now = time.monotonic()
+        payload = json.dumps({"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 0}).encode()
+        with self._lock:
+            probes = [e for e in self.endpoints if e.available(now)]
+        futures = [self._executor.submit(self._send, endpoint, 'eth_blockNumber', payload) for endpoint in probes]
+        wait(futures)
+        return self.is_available()
+
+    def is_available(self):
+        """True if at least one endpoint is not ejected"""
+        now = time.monotonic()
+        with self._lock:
+            return any(endpoint.available(now) for endpoint in self.endpoints)
+
+    def best_url(self):
+        return self.ranked()[0].url
+
+    def stats(self):
+        with self._lock:
+            head = self._head()
+            return {
+                "hedges": self.hedges,
+                "failovers": self.failovers,
+                "head": head,
+                "endpoints": [{
+                    "url": e.url,
+                    "state": e.state,
+                    "latency_ms": round(e.latency * 1000, 2),
+                    "error_rate": round(e.error_rate, 3),
+                    "block_lag": None if head is None or e.block_number is None else head - e.block_number,
+                    "requests": e.requests,
+                    "errors": e.errors,
+                } for e in self.endpoints],
+            }
+
+    def _head(self):
+        heads = [e.block_number for e in self.endpoints if e.block_number is not None and e.state == CLOSED]
+        return max(heads) if heads else None
+
+    def _lagging(self, endpoint, head):
+        return head is not None and endpoint.block_number is not None and head - endpoint.block_number > self.max_lag
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+import uuid
+
+from sqlalchemy import delete, select, update
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# BotSetting row whose value changes on every write made through the cache
+VERSION_KEY = 'settings_version'
+
+
+class SettingsCache:
+    """In-memory BotSetting values shared by the admin app and the bot.
+
+    Keys are loaded on first use and then served from memory. Every write
+    through ``set_many`` also stores a new random version stamp, so other
+    processes (gunicorn workers) notice a change with a single-row read of
+    the stamp, done at most every ``check_interval`` seconds, and reload
+    only the keys they hold. Subscribers are called with the changed keys.
+    """
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._values = {}       # key -> value, None when there is no row
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._watcher = None
+
+    # Reading
+
+    def get(self, key, default=None):
+        return self.get_many((key,)).get(key, default)
+
+    def get_many(self, keys):
+        """Values of ``keys``; missing settings are left out"""
+        self.check()
+        with self._lock:
+            missing = [key for key in keys if key not in self._values]
+            if missing:
+                self._values.update(self._read(missing))
+            return {key: self._values[key] for key in keys if self._values[key] is not None}
+
+    # Writing
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """Write settings in one transaction; a None value deletes the setting"""
+        from app import app, db
+        from models import BotSetting
+
+        version = uuid.uuid4().hex
+        values = dict(values, **{VERSION_KEY: version})
+        with app.app_context():
+            existing = set(db.session.scalars(select(BotSetting.key).where(BotSetting.key.in_(values))))
+            for key, value in values.items():
+                if value is None:
+                    db.session.execute(delete(BotSetting).where(BotSetting.key == key))
+                elif key in existing:
+                    db.session.execute(update(BotSetting).where(BotSetting.key == key).values(value=value))
+                else:
+                    db.session.add(BotSetting(key=key, value=value))
+            db.session.commit()
+
+        del values[VERSION_KEY]
+        with self._lock:
+            changed = {key: value for key, value in values.items()
+                       if key in self._values and self._values[key] != value}
+            self._values.update(values)
+            self._version = version
+        self._notify(changed)
+
+    # Change propagation
+
+    def subscribe(self, keys, callback):
+        """Call ``callback(changed)`` whenever one of ``keys`` changes in any process"""
+        self.get_many(keys)
+        self._listeners.append((frozenset(keys), callback))
+
+    def check(self, force=False):
+        """Reload held keys if another process changed settings since the last check"""
+        now = time.monotonic()
+        if not force and now < self._checked + self.check_interval:
+            return
+        self._checked = now
+
+        version = self._read((VERSION_KEY,)).get(VERSION_KEY)
+        with self._lock:
+            if version == self._version:
+                return
+            first_check = self._version is None and not self._values
+            self._version = version
+            keys = list(self._values)
+        if first_check or not keys:
+            return
+
+        fresh = self._read(keys)
+        with self._lock:
+            changed = {key: value for key, value in fresh.items() if self._values.get(key) != value}
+            self._values.update(fresh)
+        self._notify(changed)
+
+    def start_watcher(self):
+        """Check for changes in the background, for processes that serve no requests"""
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, name="settings-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check(force=True)
+            except Exception as e:
+                logger.error(f"Error checking settings version: {e}")
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        for keys, callback in list(self._listeners):
+            if keys.intersection(changed):
+                try:
+                    callback({key: value for key, value in changed.items() if key in keys})
+                except Exception as e:
+                    logger.error(f"Error applying changed settings: {e}")
+
+    @staticmethod
+    def _read(keys):
+        """Current values of ``keys``, None for settings without a row"""
+        from app import app, db
+        from models import BotSetting
+
+        with app.app_context():
+            rows = dict(db.session.execute(select(BotSetting.key, BotSetting.value).where(BotSetting.key.in_(keys))).all())
+        return {key: rows.get(key) for key in keys}
+
+
+settings_cache = SettingsCache(check_interval=Config.SETTINGS_CHECK_INTERVAL)
@@ -0,0 +1,360 @@
+import atexit
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the handling-latency histogram buckets
+LATENCY_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# BotSetting key of the periodic snapshot
+SNAPSHOT_KEY = 'stats_snapshot'
+
+# Seconds a daily count read from BotMessage itself is reused
+DAILY_COUNT_TTL = 300
+
+# Active users per hour are a HyperLogLog sketch of 2**10 one-byte
+# registers (about 3% standard error), so the snapshot stays the same
+# size however many users are active
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+class _Minute:
+    __slots__ = ('messages', 'errors', 'latency')
+
+    def __init__(self, messages=0, errors=0, latency=None):
+        self.messages = messages
+        self.errors = errors
+        self.latency = latency or [0] * len(LATENCY_BOUNDS)
+
+
+def _hll_add(registers, user_id):
+    value = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+    index = value >> (64 - HLL_PRECISION)
+    rest = value & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = 64 - HLL_PRECISION - rest.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def _hll_union(registers, other):
+    return bytearray(map(max, registers, other))
+
+
+def _hll_count(registers):
+    estimate = 0.7213 / (1 + 1.079 / HLL_REGISTERS) * HLL_REGISTERS ** 2 / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if zeros and estimate <= 2.5 * HLL_REGISTERS:
+        # Linear counting is more accurate while many registers are empty
+        return round(HLL_REGISTERS * math.log(HLL_REGISTERS / zeros))
+    return round(estimate)
+
+
+class StatsService:
+    """Dashboard statistics maintained incrementally by the update handlers.
+
+    Every handled update bumps per-minute counters (messages, errors and a
+    latency histogram) and adds the sender to a fixed-size sketch of the
+    users active in the current hour, so reading the stats never scans
+    BotMessage. Every
+    ``persist_interval`` seconds each worker merges what it recorded into
+    one shared BotSetting snapshot, and every cache refresh re-reads that
+    snapshot, so whichever worker serves /api/stats reports the whole
+    cluster (up to ``persist_interval`` behind for other workers).
+    """
+
+    def __init__(self, cache_ttl=5.0, persist_interval=60.0):
+        self.cache_ttl = cache_ttl
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        # Recorded in this worker and not yet merged into the snapshot
+        self._minutes = OrderedDict()   # minute timestamp -> _Minute
+        self._hours = OrderedDict()     # hour timestamp -> HyperLogLog registers
+        self._messages = 0
+        self._new_users = 0
+        self._counted_users = None      # BotUser count, until the snapshot holds one
+        self._daily = None              # messages per day counted from BotMessage
+        self._daily_expires = 0.0
+        self._cache = None
+        self._cache_expires = 0.0
+        self._thread = None
+
+    # Recording (hot path)
+
+    def record_update(self, user_id, duration, error=False):
+        now = int(time.time())
+        minute, hour = now - now % 60, now - now % 3600
+        slot = bisect.bisect_left(LATENCY_BOUNDS, duration)
+        with self._lock:
+            bucket = self._minutes.get(minute)
+            if bucket is None:
+                bucket = self._minutes[minute] = _Minute()
+            bucket.messages += 1
+            bucket.errors += 1 if error else 0
+            bucket.latency[slot] += 1
+            self._messages += 1
+            if user_id is not None:
+                users = self._hours.get(hour)
+                if users is None:
+                    users = self._hours[hour] = bytearray(HLL_REGISTERS)
+                _hll_add(users, user_id)
+        self._ensure_started()
+
+    def record_new_users(self, count):
+        with self._lock:
+            self._new_users += count
+
+    # Reading
+
+    def snapshot(self):
+        """Current stats, cached for ``cache_ttl`` seconds"""
+        now = time.monotonic()
+        if self._cache is not None and self._cache_expires > now:
+            return self._cache
+
+        current = int(time.time())
+        state = self._read_state()
+        with self._lock:
+            self._merge(state, self._minutes, self._hours, self._messages, self._new_users)
+        self._expire(state, current)
+        if state["total_users"] is None:
+            state["total_users"] = self._count_users()
+
+        minutes = state["minutes"]
+        last_minute = current - current % 60 - 60
+        last_hour = [bucket for start, bucket in minutes.items() if start > current - 3600]
+        handled = sum(bucket[0] for bucket in last_hour)
+        errors = sum(bucket[1] for bucket in last_hour)
+        histogram = [sum(column) for column in zip(*(bucket[2] for bucket in last_hour))] if last_hour else []
+        active = bytearray(HLL_REGISTERS)
+        for users in state["hours"].values():
+            active = _hll_union(active, users)
+
+        stats = {
+            "total_users": state["total_users"],
+            "total_messages": state["total_messages"],
+            "messages_last_minute": minutes[last_minute][0] if last_minute in minutes else 0,
+            "messages_per_minute": round(handled / 60, 2),
+            "active_users_24h": _hll_count(active),
+            "error_rate": round(errors / handled, 4) if handled else 0.0,
+            "latency_p50": self._quantile(histogram, 0.5),
+            "latency_p95": self._quantile(histogram, 0.95),
+            "messages_per_day": self._daily_messages(),
+            "generated_at": datetime.utcnow().isoformat(),
+        }
+        self._cache, self._cache_expires = stats, now + self.cache_ttl
+        return stats
+
+    @staticmethod
+    def _quantile(histogram, q):
+        """Upper bound of the histogram bucket holding the q-quantile"""
+        total = sum(histogram)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(LATENCY_BOUNDS, histogram):
+            running += count
+            if running >= q * total:
+                return bound if bound != float('inf') else LATENCY_BOUNDS[-2]
+        return None
+
+    def _daily_messages(self):
+        """Messages per day for the last week.
+
+        Read from the MessageRollup table, which only retention keeps up to
+        date; without rollups the same week is counted from BotMessage, at
+        most once every DAILY_COUNT_TTL seconds.
+        """
+        try:
+            from app import app, db
+            from models import BotMessage, MessageRollup
+            from sqlalchemy import func, select
+
+            since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=6)
+            with app.app_context():
+                if Config.RETENTION_ENABLED:
+                    rows = db.session.execute(
+                        select(MessageRollup.bucket_start, func.sum(MessageRollup.message_count))
+                        .where(MessageRollup.granularity == 'day', MessageRollup.bucket_start >= since)
+                        .group_by(MessageRollup.bucket_start)
+                        .order_by(MessageRollup.bucket_start)
+                    ).all()
+                    if rows:
+                        return [{"day": day.date().isoformat(), "messages": int(count)} for day, count in rows]
+
+                now = time.monotonic()
+                if self._daily is not None and self._daily_expires > now:
+                    return self._daily
+                # Range scan of ix_bot_message_timestamp over seven days
+                day = func.date(BotMessage.timestamp)
+                rows = db.session.execute(
+                    select(day, func.count(BotMessage.id))
+                    .where(BotMessage.timestamp >= since)
+                    .group_by(day)
+                    .order_by(day)
+                ).all()
+            self._daily = [{"day": day if isinstance(day, str) else day.isoformat(), "messages": int(count)}
+                           for day, count in rows]
+            self._daily_expires = now + DAILY_COUNT_TTL
+            return self._daily
+        except Exception as e:
+            logger.error(f"Error reading daily message counts: {e}")
+            return []
+
+    # Shared snapshot
+
+    @staticmethod
+    def _decode(value):
+        state = json.loads(value) if value else {}
+        return {
+            "total_messages": state.get("total_messages", 0),
+            "total_users": state.get("total_users"),
+            "minutes": {int(start): [m, e, list(latency)] for start, (m, e, latency) in state.get("minutes", {}).items()},
+            "hours": {int(start): bytearray(base64.b64decode(users)) for start, users in state.get("hours", {}).items()},
+        }
+
+    @staticmethod
+    def _encode(state):
+        return json.dumps({
+            "total_messages": state["total_messages"],
+            "total_users": state["total_users"],
+            "minutes": {start: state["minutes"][start] for start in sorted(state["minutes"])},
+            "hours": {start: base64.b64encode(state["hours"][start]).decode() for start in sorted(state["hours"])},
+        })
+
+    @staticmethod
+    def _merge(state, minutes, hours, messages, new_users):
+        """Add counts recorded in this worker to a decoded snapshot"""
+        for start, bucket in minutes.items():
+            entry = state["minutes"].get(start)
+            if entry is None:
+                state["minutes"][start] = [bucket.messages, bucket.errors, list(bucket.latency)]
+            else:
+                entry[0] += bucket.messages
+                entry[1] += bucket.errors
+                entry[2] = [a + b for a, b in zip(entry[2], bucket.latency)]
+        for start, users in hours.items():
+            state["hours"][start] = _hll_union(state["hours"].get(start, bytearray(HLL_REGISTERS)), users)
+        state["total_messages"] += messages
+        if state["total_users"] is not None:
+            state["total_users"] += new_users
+
+    @staticmethod
+    def _expire(state, now):
+        state["minutes"] = {start: b for start, b in state["minutes"].items() if start > now - 3600}
+        state["hours"] = {start: users for start, users in state["hours"].items() if start > now - 86400}
+
+    def _read_state(self):
+        """The shared snapshot as last persisted by any worker"""
+        try:
+            from app import app
+            from models import BotSetting
+
+            with app.app_context():
+                setting = BotSetting.query.filter_by(key=SNAPSHOT_KEY).first()
+                return self._decode(setting.value if setting else None)
+        except Exception as e:
+            logger.error(f"Error loading stats snapshot: {e}")
+            return self._decode(None)
+
+    def _count_users(self):
+        # Only needed until the first snapshot is written; counted once per process
+        if self._counted_users is None:
+            try:
+                from app import app, db
+                from models import BotUser
+                from sqlalchemy import func, select
+
+                with app.app_context():
+                    self._counted_users = db.session.scalar(select(func.count(BotUser.id)))
+            except Exception as e:
+                logger.error(f"Error counting users: {e}")
+        return self._counted_users
+
+    def persist(self):
+        """Merge the counts recorded here into the shared BotSetting snapshot"""
+        with self._persist_lock:
+            with self._lock:
+                minutes, self._minutes = self._minutes, OrderedDict()
+                hours, self._hours = self._hours, OrderedDict()
+                messages, self._messages = self._messages, 0
+                new_users, self._new_users = self._new_users, 0
+            if not (minutes or hours or messages or new_users):
+                return
+
+            try:
+                from app import app, db
+                from models import BotSetting, BotUser
+                from sqlalchemy import func, select
+
+                with app.app_context():
+                    # Row lock, so workers merging at the same time do not overwrite each other
+                    setting = db.session.scalars(
+                        select(BotSetting).where(BotSetting.key == SNAPSHOT_KEY).with_for_update()
+                    ).first()
+                    if setting is None:
+                        setting = BotSetting(key=SNAPSHOT_KEY)
+                        db.session.add(setting)
+                    state = self._decode(setting.value)
+                    if state["total_users"] is None:
+                        # The count already includes the users created since
+                        state["total_users"] = db.session.scalar(select(func.count(BotUser.id)))
+                        self._merge(state, minutes, hours, messages, 0)
+                    else:
+                        self._merge(state, minutes, hours, messages, new_users)
+                    self._expire(state, int(time.time()))
+                    setting.value = self._encode(state)
+                    db.session.commit()
+            except Exception as e:
+                logger.error(f"Error persisting stats snapshot: {e}")
+                self._restore(minutes, hours, messages, new_users)
+
+    def _restore(self, minutes, hours, messages, new_users):
+        """Put counts that could not be persisted back for the next attempt"""
+        with self._lock:
+            for start, bucket in minutes.items():
+                current = self._minutes.get(start)
+                if current is None:
+                    self._minutes[start] = bucket
+                else:
+                    current.messages += bucket.messages
+                    current.errors += bucket.errors
+                    current.latency = [a + b for a, b in zip(current.latency, bucket.latency)]
+            for start, users in hours.items():
+                self._hours[start] = _hll_union(self._hours.get(start, bytearray(HLL_REGISTERS)), users)
+            self._minutes = OrderedDict(sorted(self._minutes.items()))
+            self._hours = OrderedDict(sorted(self._hours.items()))
+            self._messages += messages
+            self._new_users += new_users
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="stats-persister", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.persist_interval)
+            self.persist()
+
+
+stats_service = StatsService(cache_ttl=Config.STATS_CACHE_TTL, persist_interval=Config.STATS_PERSIST_INTERVAL)
+
+# Counts recorded since the last merge are not lost on a clean shutdown
+atexit.register(stats_service.persist)
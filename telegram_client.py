@@ -0,0 +1,124 @@
+import logging
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from metrics import TELEGRAM_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramAPIError(Exception):
+    """Error response from the Telegram Bot API"""
+
+    def __init__(self, status_code, description, error_code=None, retry_after=None):
+        super().__init__(f"{status_code}: {description}")
+        self.status_code = status_code
+        self.description = description
+        self.error_code = error_code or status_code
+        self.retry_after = retry_after
+
+
+class TelegramClient:
+    """Pooled, keep-alive HTTP client for the Telegram Bot API.
+
+    One ``requests.Session`` is shared by every caller so connections to
+    api.telegram.org are reused instead of doing a TCP+TLS handshake per
+    request. 429 responses are retried after ``retry_after`` seconds and
+    5xx responses with exponential backoff.
+    """
+
+    def __init__(self, base_url="https://api.telegram.org", pool_size=10,
+                 connect_timeout=5.0, read_timeout=15.0, max_retries=3,
+                 backoff_base=0.5, max_retry_after=30):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_retry_after = max_retry_after
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def call(self, token, method, params=None, http_method='post', read_timeout=None, retry_429=True):
+        """Call a Bot API method and return the decoded JSON response.
+
+        Raises TelegramAPIError for API errors that are not (or no longer)
+        retryable and ``requests`` exceptions for transport failures.
+        """
+        url = f"{self.base_url}/bot{token}/{method}"
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        attempt = 0
+
+        while True:
+            started = time.perf_counter()
+            try:
+                if http_method == 'get':
+                    response = self.session.get(url, params=params, timeout=timeout)
+                else:
+                    response = self.session.post(url, data=params, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                TELEGRAM_REQUEST_SECONDS.labels(method, 'error').observe(time.perf_counter() - started)
+                if not isinstance(e, requests.exceptions.ConnectTimeout):
+                    raise
+                # Nothing reached the server, so retrying cannot duplicate a send
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                time.sleep(self._backoff(attempt))
+                continue
+
+            TELEGRAM_REQUEST_SECONDS.labels(method, response.status_code).observe(time.perf_counter() - started)
+            if response.status_code < 400:
+                return response.json()
+
+            error = self._error_from_response(response)
+
+            if attempt < self.max_retries:
+                if error.status_code == 429 and retry_429 and (error.retry_after or 0) <= self.max_retry_after:
+                    attempt += 1
+                    logger.warning(f"Telegram rate limit on {method}, retrying in {error.retry_after}s")
+                    time.sleep(error.retry_after or self._backoff(attempt))
+                    continue
+                if error.status_code >= 500:
+                    attempt += 1
+                    time.sleep(self._backoff(attempt))
+                    continue
+
+            raise error
+
+    def close(self):
+        self.session.close()
+
+    def _backoff(self, attempt):
+        delay = self.backoff_base * (2 ** (attempt - 1))
+        return delay + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _error_from_response(response):
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        parameters = payload.get('parameters') or {}
+        return TelegramAPIError(
+            response.status_code,
+            payload.get('description') or response.reason,
+            error_code=payload.get('error_code'),
+            retry_after=parameters.get('retry_after'),
+        )
+
+
+telegram_client = TelegramClient(
+    base_url=Config.TELEGRAM_API_URL,
+    pool_size=max(Config.BOT_WORKERS, Config.SEND_WORKERS) + 2,
+    connect_timeout=Config.TELEGRAM_CONNECT_TIMEOUT,
+    read_timeout=Config.TELEGRAM_READ_TIMEOUT,
+    max_retries=Config.TELEGRAM_MAX_RETRIES,
+)
@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import uuid
+from datetime import datetime
+
+from eth_utils import keccak
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the on-chain payload: magic, format version
+BATCH_MAGIC = b'HXB'
+BATCH_VERSION = 1
+
+# Record ids are "<batch id>.<position in the batch>"
+RECORD_ID_RE = re.compile(r'^(\d{14}-[0-9a-f]{8})\.(\d+)$')
+
+
+# Merkle tree (leaf and node hashes are domain-separated so a node can never pass as a leaf)
+
+def encode_record(record):
+    """Canonical bytes of a record, the same in every process"""
+    return json.dumps(record, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def leaf_hash(record):
+    return keccak(b'\x00' + encode_record(record))
+
+
+def node_hash(left, right):
+    return keccak(b'\x01' + left + right)
+
+
+def merkle_levels(leaves):
+    """All tree levels from the leaves up; an odd last node moves up unchanged"""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_proof(levels, index):
+    """Sibling hashes from leaf ``index`` up to the root, as [hex, side] pairs"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(['0x' + level[sibling].hex(), 'left' if sibling < index else 'right'])
+        index //= 2
+    return proof
+
+
+def verify_proof(record, proof, root):
+    """True if ``record`` with ``proof`` hashes up to ``root`` (hex)"""
+    current = leaf_hash(record)
+    for sibling, side in proof:
+        sibling = bytes.fromhex(sibling[2:])
+        current = node_hash(sibling, current) if side == 'left' else node_hash(current, sibling)
+    return '0x' + current.hex() == root
+
+
+def batch_payload(root, count):
+    """Transaction data for a batch: magic, version, 32-byte root, record count (40 bytes)"""
+    return '0x' + (BATCH_MAGIC + bytes([BATCH_VERSION]) + root + struct.pack('>I', count)).hex()
+
+
+class RecordBatcher:
+    """Collects user records and anchors each batch on-chain with one transaction.
+
+    Records added within ``window`` seconds, up to ``max_records``, form a
+    batch. Its Merkle root goes on-chain in a 40-byte payload through
+    ``submit(hex_data, info)``, which returns a TxHandle or a result dict
+    with a ``tx_hash``, and the records with their inclusion proofs are
+    written to ``<batch_dir>/<batch_id>.json``. A record id names its batch
+    and position, so ``lookup`` reads one batch file and works from any
+    process sharing ``batch_dir``, and after a restart.
+
+    A batch whose transaction cannot be sent, reverts or was dropped by the
+    network keeps its id and records and is sent again with the next
+    window, up to ``max_retries`` times; only then is it marked "failed".
+    A transaction without a receipt in time may still be mined, so it is
+    never sent again: every window ``check(tx_hash)`` looks it up again
+    and returns ``(status, block_number)`` with status "success",
+    "failed", "dropped" or "pending". Batches submitted in demo mode are
+    marked "demo", as nothing reached the chain.
+    """
+
+    def __init__(self, submit, window=10.0, max_records=500, batch_dir='blockchain_batches', max_retries=3,
+                 check=None):
+        self.submit = submit
+        self.check = check
+        self.window = window
+        self.max_records = max_records
+        self.batch_dir = batch_dir
+        self.max_retries = max_retries
+        self._open_id = None
+        self._open = []             # records of the batch being filled
+        self._full = []             # (batch_id, records) waiting for the next flush
+        self._retry = []            # (batch_id, records, attempts) of failed batches to send again
+        self._submitting = {}       # batch_id -> records being submitted right now
+        self._handles = {}          # batch_id -> (TxHandle, batch, records, attempts) of a batch still being mined
+        self._unconfirmed = {}      # batch_id -> (batch, records, attempts) whose receipt timed out
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, record):
+        """Queue a record for the next batch and return its record id"""
+        with self._lock:
+            if self._open_id is None:
+                self._open_id = f"{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+            record_id = f"{self._open_id}.{len(self._open)}"
+            self._open.append(record)
+            full = len(self._open) >= self.max_records
+            if full:
+                self._full.append((self._open_id, self._open))
+                self._open_id, self._open = None, []
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="record-batcher", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+        return record_id
+
+    def flush(self):
+        """Submit every queued batch now; returns the batches written"""
+        with self._flush_lock:
+            # Settled timed-out transactions may put their batch back in the retry list
+            self._recheck()
+            with self._lock:
+                waiting = self._retry + [(batch_id, records, 0) for batch_id, records in self._full]
+                if self._open:
+                    waiting.append((self._open_id, self._open, 0))
+                self._retry, self._full, self._open_id, self._open = [], [], None, []
+                self._submitting.update((batch_id, records) for batch_id, records, _ in waiting)
+            batches = []
+            for batch_id, records, attempts in waiting:
+                try:
+                    batches.append(self._submit_batch(batch_id, records, attempts))
+                finally:
+                    with self._lock:
+                        del self._submitting[batch_id]
+            return batches
+
+    def lookup(self, record_id):
+        """Status, batch, transaction and inclusion proof of a record; None if unknown"""
+        match = RECORD_ID_RE.match(record_id or '')
+        if match is None:
+            return None
+        batch_id, index = match.group(1), int(match.group(2))
+
+        with self._lock:
+            queued = dict(self._full, **self._submitting)
+            if self._open_id is not None:
+                queued[self._open_id] = self._open
+            if batch_id in queued and index < len(queued[batch_id]):
+                return {"record_id": record_id, "status": "queued", "record": queued[batch_id][index]}
+
+        try:
+            batch = self._read(batch_id)
+        except FileNotFoundError:
+            return None
+        if index >= len(batch["records"]):
+            return None
+        entry = batch["records"][index]
+        return {
+            "record_id": record_id,
+            "status": batch["status"],
+            "record": entry["record"],
+            "batch_id": batch_id,
+            "root": batch["root"],
+            "proof": entry["proof"],
+            "tx_hash": batch.get("tx_hash"),
+            "block_number": batch.get("block_number"),
+            "demo_mode": batch.get("demo_mode", False),
+        }
+
+    def pending_count(self):
+        with self._lock:
+            return (len(self._open) + sum(len(records) for _, records in self._full)
+                    + sum(len(records) for _, records, _ in self._retry))
+
+    # Internals
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.window)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing record batches: {e}")
+
+    def _submit_batch(self, batch_id, records, attempts=0):
+        levels = merkle_levels([leaf_hash(record) for record in records])
+        root = levels[-1][0]
+        batch = {
+            "batch_id": batch_id,
+            "root": '0x' + root.hex(),
+            "created_at": datetime.utcnow().isoformat(),
+            "records": [{"record": record, "proof": merkle_proof(levels, index)} for index, record in enumerate(records)],
+        }
+
+        handle = None
+        try:
+            sent = self.submit(batch_payload(root, len(records)), {"batch_id": batch_id, "records": len(records)})
+            if isinstance(sent, dict):
+                if sent.get("status") == "error":
+                    raise RuntimeError(sent.get("error"))
+                if sent.get("demo_mode"):
+                    # Nothing was sent: the hash is made up and no block holds the root
+                    batch.update(status="demo", tx_hash=sent.get("tx_hash"), block_number=None, demo_mode=True)
+                else:
+                    batch.update(status="confirmed" if sent.get("block_number") else "submitted",
+                                 tx_hash=sent.get("tx_hash"), block_number=sent.get("block_number"))
+            else:
+                handle = sent
+                batch.update(status="submitted", tx_hash=handle.tx_hash, block_number=None)
+        except Exception as e:
+            logger.error(f"Error submitting record batch {batch_id}: {e}")
+            batch.update(tx_hash=None, block_number=None)
+            self._retry_later(batch, records, attempts, e)
+
+        self._write(batch)
+        logger.info(f"Record batch {batch_id}: {len(records)} records, root {batch['root']}, tx {batch['tx_hash']}")
+        if handle is not None:
+            with self._lock:
+                self._handles[batch_id] = (handle, batch, records, attempts)
+            handle.future.add_done_callback(lambda _: self._settle(batch_id))
+        return batch
+
+    def _settle(self, batch_id):
+        """Record the outcome of a batch transaction in its file"""
+        with self._lock:
+            handle, batch, records, attempts = self._handles.pop(batch_id, (None, None, None, 0))
+        if handle is None:
+            return
+        if handle.status == "success":
+            batch.update(status="confirmed", block_number=handle.block_number)
+        elif handle.status == "failed":
+            error = RuntimeError(f"transaction {handle.tx_hash} reverted")
+            logger.error(f"Record batch {batch_id} transaction did not succeed: {error}")
+            batch.update(block_number=handle.block_number)
+            self._retry_later(batch, records, attempts, error)
+        else:
+            # No receipt in time: the transaction can still be mined, so sending
+            # the root again could anchor it twice
+            logger.warning(f"Record batch {batch_id}: {handle.error}; still watching {handle.tx_hash}")
+            batch["error"] = str(handle.error)
+            if self.check is not None:
+                with self._lock:
+                    self._unconfirmed[batch_id] = (batch, records, attempts)
+        self._write(batch)
+
+    def _recheck(self):
+        """Look up the transactions of batches whose receipt timed out"""
+        with self._lock:
+            unconfirmed = list(self._unconfirmed.items())
+        for batch_id, (batch, records, attempts) in unconfirmed:
+            try:
+                status, block_number = self.check(batch["tx_hash"])
+            except Exception as e:
+                logger.warning(f"Error checking record batch {batch_id} transaction: {e}")
+                continue
+            if status == "pending":
+                continue
+            with self._lock:
+                del self._unconfirmed[batch_id]
+            if status == "success":
+                batch.update(status="confirmed", block_number=block_number)
+                batch.pop("error", None)
+            else:
+                # Reverted, or gone from the network: safe to send again
+                batch.update(block_number=block_number)
+                self._retry_later(batch, records, attempts, RuntimeError(f"transaction {batch['tx_hash']} {status}"))
+            self._write(batch)
+
+    def _retry_later(self, batch, records, attempts, error):
+        """Queue a failed batch for the next window, or give up after max_retries"""
+        attempts += 1
+        batch.update(attempts=attempts, error=str(error))
+        if attempts > self.max_retries:
+            batch["status"] = "failed"
+            logger.error(f"Record batch {batch['batch_id']} failed {attempts} times, giving up")
+            return
+        batch["status"] = "retrying"
+        with self._lock:
+            self._retry.append((batch["batch_id"], records, attempts))
+
+    def _write(self, batch):
+        # Written to a temporary file first so readers never see half a batch
+        os.makedirs(self.batch_dir, exist_ok=True)
+        path = os.path.join(self.batch_dir, f"{batch['batch_id']}.json")
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as batch_file:
+            json.dump(batch, batch_file, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def _read(self, batch_id):
+        with open(os.path.join(self.batch_dir, f"{batch_id}.json"), encoding='utf-8') as batch_file:
+            return json.load(batch_file)
@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Node error messages that mean our local nonce no longer matches the chain
+NONCE_ERRORS = ('nonce too low', 'nonce too high', 'replacement transaction underpriced', 'invalid nonce')
+
+# The node already has this exact transaction, so it counts as sent
+ALREADY_KNOWN = ('already known', 'known transaction', 'already imported')
+
+
+def is_nonce_error(error):
+    message = str(error).lower()
+    return any(text in message for text in NONCE_ERRORS)
+
+
+def is_already_known(error):
+    message = str(error).lower()
+    return any(text in message for text in ALREADY_KNOWN)
+
+
+class NonceManager:
+    """Hands out consecutive nonces for one wallet without asking the node each time.
+
+    The next nonce is read from the chain (pending transaction count) on
+    ``prime`` or the first ``allocate``, and again after ``sync`` or
+    ``reset``, which callers use when the node rejects a nonce or a signed
+    transaction could not be broadcast.
+    """
+
+    def __init__(self, fetch_nonce):
+        self.fetch_nonce = fetch_nonce
+        self._next = None
+        self._lock = threading.Lock()
+        self.syncs = 0
+
+    def allocate(self):
+        with self._lock:
+            if self._next is None:
+                self._sync_locked()
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def prime(self):
+        """Read the next nonce from the chain unless it is known already"""
+        with self._lock:
+            if self._next is None:
+                self._sync_locked()
+
+    def sync(self):
+        """Read the next nonce from the chain again"""
+        with self._lock:
+            self._sync_locked()
+            return self._next
+
+    def reset(self):
+        """Forget the local nonce; the next ``allocate`` reads it from the chain"""
+        with self._lock:
+            self._next = None
+
+    def _sync_locked(self):
+        self._next = self.fetch_nonce()
+        self.syncs += 1
+        logger.info(f"Nonce synced from chain: {self._next}")
+
+
+class TxHandle:
+    """A broadcast transaction; ``wait`` blocks until its receipt (or timeout) arrives"""
+
+    def __init__(self, tx_hash, nonce, data=None):
+        self.tx_hash = tx_hash
+        self.nonce = nonce
+        self.data = data
+        self.submitted_at = time.monotonic()
+        self.receipt = None
+        self.error = None
+        self.future = Future()
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "pending"
+        if self.error is not None:
+            return "error"
+        return "success" if int(self.receipt.get("status", "0x0"), 16) == 1 else "failed"
+
+    @property
+    def block_number(self):
+        return int(self.receipt["blockNumber"], 16) if self.receipt else None
+
+    @property
+    def gas_used(self):
+        return int(self.receipt["gasUsed"], 16) if self.receipt else None
+
+    def wait(self, timeout=None):
+        """The receipt as returned by the node; raises if tracking failed or timed out"""
+        return self.future.result(timeout)
+
+    def _resolve(self, receipt):
+        self.receipt = receipt
+        self.future.set_result(receipt)
+
+    def _fail(self, error):
+        self.error = error
+        self.future.set_exception(error)
+
+
+class ReceiptTracker:
+    """Polls the receipts of all pending transactions together.
+
+    Every ``poll_interval`` seconds the hashes still pending are looked up
+    with JSON-RPC batch requests of up to ``batch_size`` calls, so one
+    round trip covers many transactions. A transaction without a receipt
+    after ``timeout`` seconds fails with TimeoutError. ``on_receipt`` is
+    called with each handle once it is settled.
+    """
+
+    def __init__(self, pool, poll_interval=1.0, timeout=120.0, batch_size=100, on_receipt=None):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.on_receipt = on_receipt
+        self._pending = {}      # tx hash -> TxHandle
+        self._lock = threading.Lock()
+        self._thread = None
+        self.polls = 0
+
+    def track(self, handle):
+        with self._lock:
+            self._pending[handle.tx_hash] = handle
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="receipt-tracker", daemon=True)
+                self._thread.start()
+        return handle
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def poll(self):
+        """Look up every pending receipt once"""
+        with self._lock:
+            pending = list(self._pending.values())
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            try:
+                responses = self.pool.batch([("eth_getTransactionReceipt", [handle.tx_hash]) for handle in chunk])
+            except Exception as e:
+                logger.warning(f"Error polling transaction receipts: {e}")
+                continue
+            self.polls += 1
+            for handle, response in zip(chunk, responses):
+                if response.get("result"):
+                    self._settle(handle, receipt=response["result"])
+
+        now = time.monotonic()
+        for handle in pending:
+            if not handle.done and now - handle.submitted_at > self.timeout:
+                self._settle(handle, error=TimeoutError(f"no receipt for {handle.tx_hash} after {self.timeout:g}s"))
+
+    def _settle(self, handle, receipt=None, error=None):
+        with self._lock:
+            if self._pending.pop(handle.tx_hash, None) is None:
+                return
+        if error is None:
+            handle._resolve(receipt)
+        else:
+            handle._fail(error)
+        if self.on_receipt is not None:
+            try:
+                self.on_receipt(handle)
+            except Exception as e:
+                logger.error(f"Error handling receipt of {handle.tx_hash}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if self.pending_count():
+                self.poll()
@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+import time
+from array import array
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def offset_key(token):
+    """BotSetting key of a bot's committed offset; the bot id is the part of the token before ':'"""
+    return f"update_offset_{token.split(':', 1)[0]}"
+
+
+class UpdateTracker:
+    """Deduplicates update_ids and keeps the committed getUpdates offset.
+
+    Telegram update ids increase by one per update, so the last ``window``
+    ids fit in a fixed ring (``slots[update_id % window]``) and checking an
+    id is one array lookup. Ids older than the window, or below the
+    committed offset, count as duplicates. The offset is the lowest id still
+    being handled (or the next id when nothing is); the poller stores it in
+    BotSetting together with the ids above it that are already handled, so
+    a restarted poller resumes there without handling anything twice. The
+    write happens on a background thread, so ``done`` never waits for the
+    database (it runs on the asyncio engine's event loop).
+    """
+
+    def __init__(self, window=10000, flush_interval=1.0):
+        self.window = window
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._slots = array('q', [-1]) * window
+        self._in_flight = set()
+        self._key = None
+        self._floor = 0          # committed offset: every id below it is done
+        self._highest = -1
+        self._persist = False
+        self._dirty = False
+        self._flushed_at = 0.0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.duplicates = 0
+
+    # Setup
+
+    def load(self, token, persist=True):
+        """Reset to ``token``'s stored state; returns the offset to poll from, or None"""
+        key = offset_key(token)
+        state = self._read(key)
+        with self._lock:
+            self._key, self._persist = key, persist
+            self._slots = array('q', [-1]) * self.window
+            self._in_flight.clear()
+            self._floor = state.get("offset", 0)
+            self._highest = self._floor - 1
+            for update_id in state.get("done", []):
+                self._mark(update_id)
+        return self._floor or None
+
+    def ensure_loaded(self, token):
+        """Load a bot's state once; used by webhook workers, which never persist"""
+        if self._key != offset_key(token):
+            self.load(token, persist=False)
+
+    # Hot path
+
+    def accept(self, update_id):
+        """Mark an update as being handled; False if it was seen before"""
+        with self._lock:
+            if update_id < self._floor or update_id <= self._highest - self.window \
+                    or self._slots[update_id % self.window] == update_id:
+                self.duplicates += 1
+                return False
+            self._mark(update_id)
+            self._in_flight.add(update_id)
+            return True
+
+    def forget(self, update_id):
+        """Undo ``accept`` for an update that could not be queued"""
+        with self._lock:
+            self._in_flight.discard(update_id)
+            if self._slots[update_id % self.window] == update_id:
+                self._slots[update_id % self.window] = -1
+
+    def done(self, update_id):
+        """Record that an update was handled; the offset is persisted now and then in the background"""
+        with self._lock:
+            self._in_flight.discard(update_id)
+            self._dirty = True
+        if self._persist and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self._ensure_started()
+            self._wakeup.set()
+
+    def offset(self):
+        with self._lock:
+            return self._committed()
+
+    # Persistence
+
+    def flush(self):
+        """Store the committed offset and the handled ids above it"""
+        if not self._persist or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                offset = self._floor = max(self._floor, self._committed())
+                done = [update_id for update_id in range(offset, self._highest + 1)
+                        if self._slots[update_id % self.window] == update_id and update_id not in self._in_flight]
+                key, self._dirty = self._key, False
+            self._flushed_at = time.monotonic()
+            self._write(key, json.dumps({"offset": offset, "done": done}))
+        except Exception as e:
+            logger.error(f"Error storing update offset: {e}")
+        finally:
+            self._flush_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "offset": self._committed(),
+                "in_flight": len(self._in_flight),
+                "duplicates": self.duplicates,
+            }
+
+    # Internals
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="update-offset-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+
+    def _mark(self, update_id):
+        self._slots[update_id % self.window] = update_id
+        self._highest = max(self._highest, update_id)
+
+    def _committed(self):
+        return min(self._in_flight) if self._in_flight else max(self._floor, self._highest + 1)
+
+    @staticmethod
+    def _read(key):
+        try:
+            from app import app
+            from models import BotSetting
+
+            with app.app_context():
+                setting = BotSetting.query.filter_by(key=key).first()
+                return json.loads(setting.value) if setting and setting.value else {}
+        except Exception as e:
+            logger.error(f"Error loading update offset: {e}")
+            return {}
+
+    @staticmethod
+    def _write(key, value):
+        from app import app, db
+        from models import BotSetting
+
+        # Written directly rather than through settings_cache: this is state, not a setting
+        with app.app_context():
+            setting = BotSetting.query.filter_by(key=key).first()
+            if setting is None:
+                setting = BotSetting(key=key)
+                db.session.add(setting)
+            setting.value = value
+            db.session.commit()
+
+
+update_tracker = UpdateTracker(window=Config.UPDATE_DEDUP_WINDOW, flush_interval=Config.UPDATE_OFFSET_FLUSH_INTERVAL)
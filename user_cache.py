@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from config import Config
+
+# Detached snapshot of a BotUser row, safe to share between threads
+CachedUser = namedtuple('CachedUser', [
+    'telegram_id', 'username', 'first_name', 'last_name', 'joined_at', 'is_active'
+])
+
+
+class UserCache:
+    """Bounded, thread-safe LRU cache of known Telegram users keyed by telegram_id"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, telegram_id):
+        """Return the cached user or None if it is unknown or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at < now:
+                del self._entries[telegram_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return user
+
+    def put(self, user):
+        """Store a CachedUser, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[user.telegram_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, telegram_id):
+        """Drop a user, e.g. after its row changed"""
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def snapshot(user):
+    """Build a CachedUser from a BotUser row or any object with the same fields"""
+    return CachedUser(
+        telegram_id=user.telegram_id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        joined_at=user.joined_at,
+        is_active=user.is_active,
+    )
+
+
+user_cache = UserCache(max_size=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)